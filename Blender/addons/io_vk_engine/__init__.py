@@ -8,20 +8,30 @@ bl_info = {
 }
 
 from . import utils
+from . import mesh_optimization
 from . import mesh
 from . import texture
 from . import material
+from . import scene_archive
+from . import entity_binary
+from . import scene_bvh
 from . import entities
+from . import animation_compression
 from . import animation
 
 if "bpy" in locals():
     from importlib import reload
 
     reload(utils)
+    reload(mesh_optimization)
     reload(mesh)
     reload(texture)
     reload(material)
+    reload(scene_archive)
+    reload(entity_binary)
+    reload(scene_bvh)
     reload(entities)
+    reload(animation_compression)
     reload(animation)
 
     del reload
@@ -1,7 +1,9 @@
 import bpy
 import mathutils
+import numpy as np
 
 from . import utils
+from . import animation_compression
 
 from typing import (
     List,
@@ -14,48 +16,567 @@ from bpy.props import (
     BoolProperty,
     EnumProperty,
     StringProperty,
+    FloatProperty,
     PointerProperty,
 )
 
-class JointSample:
-    def __init__(
-        self,
-        local_position : utils.Vec3f,
-        local_orientation : utils.Quatf,
-        local_scale : utils.Vec3f
-    ):
-        self.local_position = local_position
-        self.local_orientation = local_orientation
-        self.local_scale = local_scale
+Animation_Version = 10000
+# Each track of each joint is stored as a list of keys (see SampledAnimation.WriteTracks)
+Animation_Version_Reduced_Keys = 10100
+# Same as above, with quantized key values (see SampledAnimation.WriteQuantizedTracks)
+Animation_Version_Quantized = 10200
+# Same as reduced keys, with f32 key times so keys can be between poses (see SampledAnimation.WriteTimedTracks)
+Animation_Version_Timed_Keys = 10300
 
-class ArmaturePose:
-    def __init__(
-        self,
-        joint_count : int
-    ):
-        self.joints : List[JointSample] = [
-            JointSample((0,0,0), (0,0,0,1), (1,1,1))
-            for i in range(joint_count)
-        ]
+Joint_Sample_Dtype = np.dtype([
+    ("local_position", "<f4", 3),
+    ("local_orientation", "<f4", 4),
+    ("local_scale", "<f4", 3),
+])
+
+# The matrix helpers below do the same single precision operations in the same order as
+# mathutils does, so sampling all the frames at once gives exactly the same results as
+# doing the math per bone with mathutils. Matrices are row major, like numpy.array(Matrix).
+
+# Move the matrix rows and columns to the first axes, so each component is a contiguous array
+def MatrixComponents(matrices : np.ndarray) -> np.ndarray:
+    return np.ascontiguousarray(np.moveaxis(matrices, (-2, -1), (0, 1)), dtype=np.float32)
+
+def MatricesFromComponents(components : np.ndarray) -> np.ndarray:
+    return np.moveaxis(components, (0, 1), (-2, -1))
+
+# Multiply arrays of matrices like Matrix @ Matrix (each product is done in single
+# precision and accumulated in double precision)
+def MultiplyMatrices(a : np.ndarray, b : np.ndarray) -> np.ndarray:
+    a = MatrixComponents(a)
+    b = MatrixComponents(b)
+
+    result = np.empty((4, 4) + np.broadcast_shapes(a.shape[2:], b.shape[2:]), dtype=np.float32)
+    for row in range(4):
+        for col in range(4):
+            dot = (a[row, 0] * b[0, col]).astype(np.float64)
+            for k in range(1, 4):
+                dot += a[row, k] * b[k, col]
+
+            result[row, col] = dot
+
+    return MatricesFromComponents(result)
+
+def Determinant3(a1, a2, a3, b1, b2, b3, c1, c2, c3):
+    return a1 * (b2 * c3 - b3 * c2) - b1 * (a2 * c3 - a3 * c2) + c1 * (a2 * b3 - a3 * b2)
+
+# Invert an array of 4x4 matrices like Matrix.inverted (adjoint divided by the determinant)
+def InvertMatrices(matrices : np.ndarray) -> np.ndarray:
+    # mathutils matrices are column major
+    m = MatrixComponents(matrices.swapaxes(-1, -2))
+
+    a1, b1, c1, d1 = m[0, 0], m[0, 1], m[0, 2], m[0, 3]
+    a2, b2, c2, d2 = m[1, 0], m[1, 1], m[1, 2], m[1, 3]
+    a3, b3, c3, d3 = m[2, 0], m[2, 1], m[2, 2], m[2, 3]
+    a4, b4, c4, d4 = m[3, 0], m[3, 1], m[3, 2], m[3, 3]
+
+    adjoint = np.empty_like(m)
+
+    adjoint[0, 0] = Determinant3(b2, b3, b4, c2, c3, c4, d2, d3, d4)
+    adjoint[1, 0] = -Determinant3(a2, a3, a4, c2, c3, c4, d2, d3, d4)
+    adjoint[2, 0] = Determinant3(a2, a3, a4, b2, b3, b4, d2, d3, d4)
+    adjoint[3, 0] = -Determinant3(a2, a3, a4, b2, b3, b4, c2, c3, c4)
+
+    adjoint[0, 1] = -Determinant3(b1, b3, b4, c1, c3, c4, d1, d3, d4)
+    adjoint[1, 1] = Determinant3(a1, a3, a4, c1, c3, c4, d1, d3, d4)
+    adjoint[2, 1] = -Determinant3(a1, a3, a4, b1, b3, b4, d1, d3, d4)
+    adjoint[3, 1] = Determinant3(a1, a3, a4, b1, b3, b4, c1, c3, c4)
+
+    adjoint[0, 2] = Determinant3(b1, b2, b4, c1, c2, c4, d1, d2, d4)
+    adjoint[1, 2] = -Determinant3(a1, a2, a4, c1, c2, c4, d1, d2, d4)
+    adjoint[2, 2] = Determinant3(a1, a2, a4, b1, b2, b4, d1, d2, d4)
+    adjoint[3, 2] = -Determinant3(a1, a2, a4, b1, b2, b4, c1, c2, c4)
+
+    adjoint[0, 3] = -Determinant3(b1, b2, b3, c1, c2, c3, d1, d2, d3)
+    adjoint[1, 3] = Determinant3(a1, a2, a3, c1, c2, c3, d1, d2, d3)
+    adjoint[2, 3] = -Determinant3(a1, a2, a3, b1, b2, b3, d1, d2, d3)
+    adjoint[3, 3] = Determinant3(a1, a2, a3, b1, b2, b3, c1, c2, c3)
+
+    det = (
+        a1 * Determinant3(b2, b3, b4, c2, c3, c4, d2, d3, d4) -
+        b1 * Determinant3(a2, a3, a4, c2, c3, c4, d2, d3, d4) +
+        c1 * Determinant3(a2, a3, a4, b2, b3, b4, d2, d3, d4) -
+        d1 * Determinant3(a2, a3, a4, b2, b3, b4, c2, c3, c4)
+    )
+
+    if np.any(det == 0):
+        raise ValueError("Matrix.inverted(M): matrix does not have an inverse")
+
+    return MatricesFromComponents(adjoint / det).swapaxes(-1, -2)
+
+# Decompose an array of 4x4 matrices into translations, rotations (x, y, z, w quaternions)
+# and scales like Matrix.decompose
+def DecomposeMatrices(matrices : np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    one = np.float32(1)
+
+    # Column major, so m[i] is the i-th axis
+    m = MatrixComponents(matrices.swapaxes(-1, -2))
+    locations = np.moveaxis(m[3, :3], 0, -1)
+
+    axes = m[:3, :3]
+    lengths_sq = axes[:, 0] * axes[:, 0] + axes[:, 1] * axes[:, 1] + axes[:, 2] * axes[:, 2]
+    valid = lengths_sq > np.float32(1.0e-35)
+    scales = np.where(valid, np.sqrt(np.where(valid, lengths_sq, one)), 0).astype(np.float32)
+    rot = np.where(valid[:, None], axes * (one / np.where(valid, scales, one))[:, None], 0).astype(np.float32)
+
+    negative = (
+        rot[0, 0] * (rot[1, 1] * rot[2, 2] - rot[1, 2] * rot[2, 1]) -
+        rot[1, 0] * (rot[0, 1] * rot[2, 2] - rot[0, 2] * rot[2, 1]) +
+        rot[2, 0] * (rot[0, 1] * rot[1, 2] - rot[0, 2] * rot[1, 1])
+    ) < 0
+    sign = np.where(negative, -one, one)
+    rot *= sign
+    scales = np.moveaxis(scales * sign, 0, -1)
+
+    m00, m01, m02 = rot[0, 0], rot[0, 1], rot[0, 2]
+    m10, m11, m12 = rot[1, 0], rot[1, 1], rot[1, 2]
+    m20, m21, m22 = rot[2, 0], rot[2, 1], rot[2, 2]
+    trace = m00 + m11 + m22
+
+    # Pick the formula with the best precision, like mat3_normalized_to_quat_fast
+    use_trace = trace > 0
+    use_x = ~use_trace & (m00 > m11) & (m00 > m22)
+    use_y = ~use_trace & ~use_x & (m11 > m22)
+    conditions = [use_trace, use_x, use_y]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        s = np.float32(2) * np.sqrt(np.select(
+            conditions,
+            [one + trace, one + m00 - m11 - m22, one + m11 - m00 - m22],
+            one + m22 - m00 - m11
+        ))
+        biggest = np.float32(0.25) * s
+        s = one / s
+
+        w = np.select(conditions, [biggest, (m12 - m21) * s, (m20 - m02) * s], (m01 - m10) * s)
+        x = np.select(conditions, [(m12 - m21) * s, biggest, (m10 + m01) * s], (m20 + m02) * s)
+        y = np.select(conditions, [(m20 - m02) * s, (m10 + m01) * s, biggest], (m21 + m12) * s)
+        z = np.select(conditions, [(m01 - m10) * s, (m20 + m02) * s, (m21 + m12) * s], biggest)
+
+    # Make sure W is non-negative for a canonical result
+    flip = ~use_trace & (w < 0)
+    x, y, z, w = (np.where(flip, -c, c) for c in (x, y, z, w))
+
+    length = np.sqrt(w * w + x * x + y * y + z * z)
+    zero = length == 0
+    s = one / np.where(zero, one, length)
+
+    quats = np.stack([
+        np.where(zero, one, x * s),
+        np.where(zero, 0, y * s),
+        np.where(zero, 0, z * s),
+        np.where(zero, 0, w * s),
+    ], axis=-1).astype(np.float32)
+
+    return locations, quats, scales
+
+# Rotation matrices of arrays of w, x, y, z quaternions (normalized first, like Blender does
+# for pose bones)
+def QuaternionsToMatrices(quats : np.ndarray) -> np.ndarray:
+    quats = quats / np.linalg.norm(quats, axis=-1, keepdims=True)
+    w, x, y, z = quats[..., 0], quats[..., 1], quats[..., 2], quats[..., 3]
+
+    result = np.empty(quats.shape[:-1] + (3, 3), dtype=np.float64)
+    result[..., 0, 0] = 1 - 2 * (y * y + z * z)
+    result[..., 0, 1] = 2 * (x * y - w * z)
+    result[..., 0, 2] = 2 * (x * z + w * y)
+    result[..., 1, 0] = 2 * (x * y + w * z)
+    result[..., 1, 1] = 1 - 2 * (x * x + z * z)
+    result[..., 1, 2] = 2 * (y * z - w * x)
+    result[..., 2, 0] = 2 * (x * z - w * y)
+    result[..., 2, 1] = 2 * (y * z + w * x)
+    result[..., 2, 2] = 1 - 2 * (x * x + y * y)
+
+    return result
+
+# Rotation matrices of arrays of angle, x, y, z axis angle rotations
+def AxisAnglesToMatrices(axis_angles : np.ndarray) -> np.ndarray:
+    angles = axis_angles[..., 0]
+    axes = axis_angles[..., 1:]
+    lengths = np.linalg.norm(axes, axis=-1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        half_angles = np.where(lengths > 0, angles, 0) * 0.5
+        axes = np.where(lengths[..., None] > 0, axes / lengths[..., None], 0)
+
+    quats = np.concatenate([np.cos(half_angles)[..., None], axes * np.sin(half_angles)[..., None]], axis=-1)
+
+    return QuaternionsToMatrices(quats)
+
+# Rotation matrices of arrays of euler angles, order being a rotation mode like XYZ
+# (the X rotation is applied first)
+def EulersToMatrices(eulers : np.ndarray, order : str) -> np.ndarray:
+    result = np.broadcast_to(np.identity(3), eulers.shape[:-1] + (3, 3))
+    for axis in order:
+        index = "XYZ".index(axis)
+        c = np.cos(eulers[..., index])
+        s = np.sin(eulers[..., index])
+
+        rotation = np.zeros(eulers.shape[:-1] + (3, 3), dtype=np.float64)
+        rotation[..., index, index] = 1
+        i, j = [k for k in range(3) if k != index]
+        # Going from one axis to the next one is a positive rotation (Y to Z around X...)
+        if index == 1:
+            i, j = j, i
+        rotation[..., i, i] = c
+        rotation[..., i, j] = -s
+        rotation[..., j, i] = s
+        rotation[..., j, j] = c
+
+        result = rotation @ result
+
+    return result
+
+# Compute the joint samples for all the frames from the pose bone matrices, as an array of
+# Joint_Sample_Dtype with a row per frame. bone_matrices has a 4x4 matrix per frame and
+# per pose bone, joint_bones and joint_parents are the pose bone indices of each joint and
+# of its parent (-1 if it has none).
+def ComputeJointSamples(
+    bone_matrices : np.ndarray,
+    joint_bones : List[int],
+    joint_parents : List[int],
+    transform : np.ndarray,
+    scale_fixup : np.ndarray
+) -> np.ndarray:
+    frame_count = bone_matrices.shape[0]
+    samples = np.zeros((frame_count, len(joint_bones)), dtype=Joint_Sample_Dtype)
+    if frame_count == 0 or len(joint_bones) == 0:
+        return samples
+
+    world = MultiplyMatrices(MultiplyMatrices(transform, bone_matrices), scale_fixup)
+
+    joint_parents = np.array(joint_parents, dtype=np.int64)
+    has_parent = joint_parents >= 0
+
+    local = world[:, joint_bones]
+    parent_inverse = InvertMatrices(world[:, joint_parents[has_parent]])
+    local[:, has_parent] = MultiplyMatrices(parent_inverse, local[:, has_parent])
+
+    locations, orientations, scales = DecomposeMatrices(local)
+
+    samples["local_position"] = locations
+    samples["local_orientation"] = orientations
+    samples["local_scale"] = scales
+
+    return samples
 
 class SampledAnimation:
     def __init__(
         self
     ):
         self.name_to_joint_id : Dict[str, int] = {}
-        self.poses : List[ArmaturePose] = []
+        # Joint_Sample_Dtype array, with a row per pose and a column per joint
+        self.samples : np.ndarray = np.zeros((0, 0), dtype=Joint_Sample_Dtype)
+        # Sorted times of the rows of samples, as fractional pose indices, when some of them
+        # are between poses (see ArmatureSampler.SampleAdaptive). None if there is a row per pose.
+        self.sample_times : np.ndarray = None
+
+    def PoseCount(self) -> int:
+        if self.sample_times is None:
+            return len(self.samples)
+
+        return int(np.floor(self.sample_times[-1])) + 1 if len(self.sample_times) > 0 else 0
+
+    # The samples of the poses, without the ones in between
+    def PoseSamples(self) -> np.ndarray:
+        if self.sample_times is None:
+            return self.samples
+
+        return self.samples[self.sample_times == np.floor(self.sample_times)]
+
+    # Compress the joint tracks so they can be reconstructed within the given tolerances
+    # (rotation_tolerance is in radians). Returns, for each joint, its position, orientation
+    # and scale tracks as (key times, key values) pairs, key times being pose indices
+    # (fractional if there are samples between poses).
+    def CompressTracks(
+        self,
+        position_tolerance : float,
+        rotation_tolerance : float,
+        scale_tolerance : float
+    ) -> List[List[Tuple[np.ndarray, np.ndarray]]]:
+        tracks = []
+        for joint_index in range(len(self.name_to_joint_id)):
+            samples = self.samples[:, joint_index]
+            tracks.append([
+                animation_compression.CompressTrack(samples["local_position"], position_tolerance, False, self.sample_times),
+                animation_compression.CompressTrack(samples["local_orientation"], rotation_tolerance, True, self.sample_times),
+                animation_compression.CompressTrack(samples["local_scale"], scale_tolerance, False, self.sample_times),
+            ])
+
+        return tracks
+
+    # Tracks with all the samples as keys, for writing quantized tracks without reducing keys
+    def UncompressedTracks(self) -> List[List[Tuple[np.ndarray, np.ndarray]]]:
+        key_times = np.arange(len(self.samples))
+
+        tracks = []
+        for joint_index in range(len(self.name_to_joint_id)):
+            samples = self.samples[:, joint_index]
+            tracks.append([
+                (key_times, samples["local_position"]),
+                (key_times, animation_compression.MakeQuaternionsContinuous(samples["local_orientation"])),
+                (key_times, samples["local_scale"]),
+            ])
+
+        return tracks
+
+    def WriteHeader(self, file, version : int):
+        import struct
+
+        fw = file.write
+
+        fw(b"ARMATURE_ANIMATION")
+
+        fw(struct.pack("<I", version))
+
+        fw(struct.pack("<I", self.PoseCount()))
+        fw(struct.pack("<I", len(self.name_to_joint_id)))
+        for name in self.name_to_joint_id:
+            fw(b"%s\0" % bytes(name, 'UTF-8'))
+
+    def WriteSamples(self, file):
+        file.write(np.ascontiguousarray(self.PoseSamples()).tobytes())
+
+    # For each joint, the position, orientation and scale tracks are written one after the
+    # other as a u32 key count, the u16 pose index of each key and the f32 key values
+    def WriteTracks(self, file, tracks : List[List[Tuple[np.ndarray, np.ndarray]]]):
+        import struct
+
+        fw = file.write
+
+        for joint_tracks in tracks:
+            for key_times, key_values in joint_tracks:
+                fw(struct.pack("<I", len(key_times)))
+                fw(np.ascontiguousarray(key_times, dtype="<u2").tobytes())
+                fw(np.ascontiguousarray(key_values, dtype="<f4").tobytes())
 
-    def FromAction(
+    # Same as WriteTracks, except key times are f32 fractional pose indices
+    def WriteTimedTracks(self, file, tracks : List[List[Tuple[np.ndarray, np.ndarray]]]):
+        import struct
+
+        fw = file.write
+
+        for joint_tracks in tracks:
+            for key_times, key_values in joint_tracks:
+                fw(struct.pack("<I", len(key_times)))
+                fw(np.ascontiguousarray(key_times, dtype="<f4").tobytes())
+                fw(np.ascontiguousarray(key_values, dtype="<f4").tobytes())
+
+    # The header is followed by the u32 number of bits of the quantized rotations (48 or 32).
+    # Then for each joint, the position, orientation and scale tracks are written one after
+    # the other as a u32 key count and the u16 pose index of each key, which are omitted
+    # when the track has a key per pose or a single key. Key values are:
+    # * for positions and scales, the f32 value if there is a single key, otherwise the f32
+    # minimum and extent of the track followed by the values quantized on u16 relative to them
+    # * for orientations, the quaternions packed by animation_compression.PackQuaternions
+    # Scale tracks that are all 1 have no keys.
+    def WriteQuantizedTracks(self, file, tracks : List[List[Tuple[np.ndarray, np.ndarray]]], rotation_bits : int):
+        import struct
+
+        fw = file.write
+
+        fw(struct.pack("<I", rotation_bits))
+
+        for joint_tracks in tracks:
+            for track_index, (key_times, key_values) in enumerate(joint_tracks):
+                if track_index == 2 and np.all(np.abs(key_values - 1) <= animation_compression.Unit_Scale_Epsilon):
+                    fw(struct.pack("<I", 0))
+                    continue
+
+                fw(struct.pack("<I", len(key_times)))
+                if len(key_times) != 1 and len(key_times) != len(self.samples):
+                    fw(np.ascontiguousarray(key_times, dtype="<u2").tobytes())
+
+                if track_index == 1:
+                    fw(animation_compression.PackQuaternions(key_values, rotation_bits).tobytes())
+                elif len(key_times) == 1:
+                    fw(np.ascontiguousarray(key_values, dtype="<f4").tobytes())
+                else:
+                    minimum, extent, quantized = animation_compression.QuantizeRange(key_values)
+                    fw(minimum.astype("<f4").tobytes())
+                    fw(extent.astype("<f4").tobytes())
+                    fw(quantized.astype("<u2").tobytes())
+
+    # Write the dense samples, or the tracks returned by CompressTracks or UncompressedTracks
+    # if there are any. rotation_bits is 48 or 32 to write quantized tracks. Tracks of
+    # animations with samples between poses are always written with timed keys.
+    def WriteBinary(
+        self,
+        filename : str,
+        tracks : List[List[Tuple[np.ndarray, np.ndarray]]] = None,
+        rotation_bits : int = 0
+    ):
+        with open(filename, "wb") as file:
+            if tracks is None:
+                self.WriteHeader(file, Animation_Version)
+                self.WriteSamples(file)
+            elif self.sample_times is not None:
+                self.WriteHeader(file, Animation_Version_Timed_Keys)
+                self.WriteTimedTracks(file, tracks)
+            elif rotation_bits != 0:
+                self.WriteHeader(file, Animation_Version_Quantized)
+                self.WriteQuantizedTracks(file, tracks, rotation_bits)
+            else:
+                self.WriteHeader(file, Animation_Version_Reduced_Keys)
+                self.WriteTracks(file, tracks)
+
+    # Read the content of a .anim file, reconstructing the dense samples if needed. Files with
+    # timed keys can be reconstructed at the given fractional pose indices instead of at each pose.
+    def FromBytes(data : bytes, times : np.ndarray = None):
+        import struct
+
+        magic = b"ARMATURE_ANIMATION"
+        if data[:len(magic)] != magic:
+            raise Exception("Not an animation file")
+
+        offset = len(magic)
+        version, pose_count, joint_count = struct.unpack_from("<III", data, offset)
+        offset += 12
+
+        if version not in (Animation_Version, Animation_Version_Reduced_Keys, Animation_Version_Quantized, Animation_Version_Timed_Keys):
+            raise Exception(f"Unknown animation file version {version}")
+
+        result = SampledAnimation()
+        for i in range(joint_count):
+            end = data.index(b"\0", offset)
+            result.name_to_joint_id.update({ data[offset:end].decode("UTF-8") : i })
+            offset = end + 1
+
+        if version == Animation_Version:
+            result.samples = np.frombuffer(data, Joint_Sample_Dtype, pose_count * joint_count, offset).reshape(pose_count, joint_count).copy()
+
+            return result
+
+        if version == Animation_Version_Timed_Keys:
+            result.ReadTimedTracks(data, offset, pose_count, times)
+
+            return result
+
+        result.samples = np.zeros((pose_count, joint_count), dtype=Joint_Sample_Dtype)
+
+        if version == Animation_Version_Quantized:
+            result.ReadQuantizedTracks(data, offset)
+
+            return result
+
+        for joint_index in range(joint_count):
+            for field, component_count in (("local_position", 3), ("local_orientation", 4), ("local_scale", 3)):
+                key_count = struct.unpack_from("<I", data, offset)[0]
+                offset += 4
+
+                key_times = np.frombuffer(data, "<u2", key_count, offset)
+                offset += key_times.nbytes
+
+                key_values = np.frombuffer(data, "<f4", key_count * component_count, offset).reshape(key_count, component_count)
+                offset += key_values.nbytes
+
+                result.samples[field][:, joint_index] = animation_compression.DecodeTrack(
+                    key_times, key_values, pose_count, field == "local_orientation"
+                )
+
+        return result
+
+    def ReadTimedTracks(self, data : bytes, offset : int, pose_count : int, times : np.ndarray):
+        import struct
+
+        if times is None:
+            times = np.arange(pose_count, dtype=np.float64)
+        else:
+            self.sample_times = times
+
+        self.samples = np.zeros((len(times), len(self.name_to_joint_id)), dtype=Joint_Sample_Dtype)
+
+        for joint_index in range(len(self.name_to_joint_id)):
+            for field, component_count in (("local_position", 3), ("local_orientation", 4), ("local_scale", 3)):
+                key_count = struct.unpack_from("<I", data, offset)[0]
+                offset += 4
+
+                key_times = np.frombuffer(data, "<f4", key_count, offset)
+                offset += key_times.nbytes
+
+                key_values = np.frombuffer(data, "<f4", key_count * component_count, offset).reshape(key_count, component_count)
+                offset += key_values.nbytes
+
+                self.samples[field][:, joint_index] = animation_compression.InterpolateKeys(
+                    key_times, key_values, times, field == "local_orientation"
+                )
+
+    def ReadQuantizedTracks(self, data : bytes, offset : int):
+        import struct
+
+        pose_count, joint_count = self.samples.shape
+
+        rotation_bits = struct.unpack_from("<I", data, offset)[0]
+        offset += 4
+
+        if rotation_bits != 48 and rotation_bits != 32:
+            raise Exception(f"Invalid quantized rotation size {rotation_bits}")
+
+        for joint_index in range(joint_count):
+            for field in ("local_position", "local_orientation", "local_scale"):
+                key_count = struct.unpack_from("<I", data, offset)[0]
+                offset += 4
+
+                if key_count == 0:
+                    self.samples[field][:, joint_index] = 1
+                    continue
+
+                if key_count != 1 and key_count != pose_count:
+                    key_times = np.frombuffer(data, "<u2", key_count, offset)
+                    offset += key_times.nbytes
+                else:
+                    key_times = np.arange(key_count)
+
+                if field == "local_orientation":
+                    if rotation_bits == 32:
+                        packed = np.frombuffer(data, "<u4", key_count, offset)
+                    else:
+                        packed = np.frombuffer(data, "<u2", key_count * 3, offset).reshape(key_count, 3)
+                    offset += packed.nbytes
+
+                    # Packing makes the biggest component positive, which can flip consecutive keys
+                    key_values = animation_compression.MakeQuaternionsContinuous(
+                        animation_compression.UnpackQuaternions(packed, rotation_bits)
+                    )
+                elif key_count == 1:
+                    key_values = np.frombuffer(data, "<f4", 3, offset).reshape(1, 3)
+                    offset += key_values.nbytes
+                else:
+                    minimum, extent = np.frombuffer(data, "<f4", 6, offset).reshape(2, 3)
+                    offset += 24
+
+                    quantized = np.frombuffer(data, "<u2", key_count * 3, offset).reshape(key_count, 3)
+                    offset += quantized.nbytes
+
+                    key_values = animation_compression.DequantizeRange(minimum, extent, quantized)
+
+                self.samples[field][:, joint_index] = animation_compression.DecodeTrack(
+                    key_times, key_values, pose_count, field == "local_orientation"
+                )
+
+    def FromFile(filename : str):
+        with open(filename, "rb") as file:
+            return SampledAnimation.FromBytes(file.read())
+
+# Samples actions on an armature. Everything that only depends on the armature (the joints
+# and the transforms) is computed once, so the same sampler can be used for many actions.
+class ArmatureSampler:
+    def __init__(
+        self,
         blender_obj : bpy.types.Object,
         pose_obj : bpy.types.Object,
-        blender_action : bpy.types.Action,
-        frame_begin : int,
-        frame_end : int,
-        frame_step : int,
         apply_object_transform : bool,
         dest_coordinate_system : utils.CoordinateSystem,
         transform_matrix : mathutils.Matrix
     ):
+        self.blender_obj = blender_obj
+        self.pose_obj = pose_obj
+
         transform = transform_matrix
 
         if apply_object_transform:
@@ -65,85 +586,398 @@ class SampledAnimation:
 
         scale_fixup = dest_coordinate_system.ScaleConversionMatrix().to_4x4()
 
-        def AppendPose(
-            anim : SampledAnimation,
-            blender_pose : bpy.types.Pose
-        ):
-            pose = ArmaturePose(len(anim.name_to_joint_id))
-            for bone in blender_pose.bones:
-                if bone.name not in anim.name_to_joint_id:
-                    continue
+        self.transform = np.array(transform, dtype=np.float32)
+        self.scale_fixup = np.array(scale_fixup, dtype=np.float32)
+
+        # Initialize the name to joint id dict
+        self.name_to_joint_id : Dict[str, int] = {}
+        joint_count = 0
+        for bone in pose_obj.pose.bones:
+            if not bone.bone.use_deform:
+                continue
 
-                local_transform = transform @ bone.matrix
-                local_transform = local_transform @ scale_fixup
+            self.name_to_joint_id.update({ bone.name : joint_count })
+            joint_count += 1
 
-                if bone.parent is not None:
-                    parent_matrix = transform @ bone.parent.matrix
-                    parent_matrix = parent_matrix @ scale_fixup
+        bones = pose_obj.pose.bones
+        bone_indices = { bone.name : i for i, bone in enumerate(bones) }
 
-                    local_transform = parent_matrix.inverted() @ local_transform
+        self.joint_bones = [bone_indices[name] for name in self.name_to_joint_id]
+        self.joint_parents = [
+            bone_indices[bones[i].parent.name] if bones[i].parent is not None else -1
+            for i in self.joint_bones
+        ]
 
-                location, orientation, scale = local_transform.decompose()
+    # Returns the reason why the pose can't be computed from the F-curves of the action
+    # alone, or None if it can
+    def FastSamplingBlocker(self) -> str:
+        if self.pose_obj != self.blender_obj:
+            return "the deform armature is not the control armature"
 
-                joint_index = anim.name_to_joint_id[bone.name]
-                pose.joints[joint_index] = JointSample(
-                    location,
-                    (
-                        orientation.x,
-                        orientation.y,
-                        orientation.z,
-                        orientation.w,
-                    ),
-                    scale
-                )
+        anim_data = self.blender_obj.animation_data
+        if len(anim_data.drivers) > 0:
+            return "the armature object has drivers"
 
-            anim.poses.append(pose)
+        armature_anim_data = self.blender_obj.data.animation_data
+        if armature_anim_data is not None and len(armature_anim_data.drivers) > 0:
+            return "the armature has drivers"
 
-        result = SampledAnimation()
-        prev_action = blender_obj.animation_data.action
-        prev_frame = bpy.context.scene.frame_current
+        for bone in self.pose_obj.pose.bones:
+            if any(not constraint.mute for constraint in bone.constraints):
+                return f"bone {bone.name} has constraints"
 
-        blender_obj.animation_data.action = blender_action
-        bpy.context.scene.frame_set(frame_begin)
+            if not bone.bone.use_inherit_rotation or bone.bone.inherit_scale != 'FULL' or not bone.bone.use_local_location:
+                return f"bone {bone.name} does not fully inherit the transform of its parent"
 
-        # Initialize the name to joint id dict
-        joint_count = 0
-        for bone in pose_obj.pose.bones:
-            if not bone.bone.use_deform:
+        return None
+
+    # Evaluate the pose bone matrices from the F-curves of the action, for armatures that
+    # have no constraints or drivers (see FastSamplingBlocker). Channels that are not
+    # animated keep their current value, like when evaluating the scene.
+    def EvaluateFCurves(self, blender_action : bpy.types.Action, frames : range) -> np.ndarray:
+        import re
+
+        bones = self.pose_obj.pose.bones
+        bone_indices = { bone.name : i for i, bone in enumerate(bones) }
+        frame_count = len(frames)
+
+        channels = {
+            "location" : np.array([tuple(bone.location) for bone in bones], dtype=np.float64).reshape(-1, 3),
+            "rotation_quaternion" : np.array([tuple(bone.rotation_quaternion) for bone in bones], dtype=np.float64).reshape(-1, 4),
+            "rotation_euler" : np.array([tuple(bone.rotation_euler) for bone in bones], dtype=np.float64).reshape(-1, 3),
+            "rotation_axis_angle" : np.array([tuple(bone.rotation_axis_angle) for bone in bones], dtype=np.float64).reshape(-1, 4),
+            "scale" : np.array([tuple(bone.scale) for bone in bones], dtype=np.float64).reshape(-1, 3),
+        }
+        channels = { name : np.repeat(values[None], frame_count, axis=0) for name, values in channels.items() }
+
+        data_path_regex = re.compile(r'^pose\.bones\["((?:[^"\\]|\\.)*)"\]\.(\w+)$')
+        for fcurve in blender_action.fcurves:
+            if fcurve.mute:
                 continue
 
-            result.name_to_joint_id.update({ bone.name : joint_count })
-            joint_count += 1
+            match = data_path_regex.match(fcurve.data_path)
+            if match is None:
+                continue
+
+            bone_name = re.sub(r"\\(.)", r"\1", match.group(1))
+            channel = match.group(2)
+            if bone_name not in bone_indices or channel not in channels:
+                continue
+
+            values = channels[channel]
+            if fcurve.array_index >= values.shape[-1]:
+                continue
+
+            values[:, bone_indices[bone_name], fcurve.array_index] = [fcurve.evaluate(frame) for frame in frames]
 
-        for frame in range(frame_begin, frame_end + 1, frame_step):
-            bpy.context.scene.frame_set(frame)
-            AppendPose(result, pose_obj.pose)
+        # Local transforms, location @ rotation @ scale. Blender ignores the location of
+        # bones that are connected to their parent.
+        basis = np.zeros((frame_count, len(bones), 4, 4), dtype=np.float64)
+        basis[..., 3, 3] = 1
+        basis[..., :3, 3] = channels["location"]
 
-        bpy.context.scene.frame_set(prev_frame)
-        blender_obj.animation_data.action = prev_action
+        connected = np.array([bone.bone.use_connect for bone in bones], dtype=bool)
+        basis[:, connected, :3, 3] = 0
+
+        for i, bone in enumerate(bones):
+            if bone.rotation_mode == 'QUATERNION':
+                rotation = QuaternionsToMatrices(channels["rotation_quaternion"][:, i])
+            elif bone.rotation_mode == 'AXIS_ANGLE':
+                rotation = AxisAnglesToMatrices(channels["rotation_axis_angle"][:, i])
+            else:
+                rotation = EulersToMatrices(channels["rotation_euler"][:, i], bone.rotation_mode)
+
+            basis[:, i, :3, :3] = rotation * channels["scale"][:, i, None, :]
+
+        # Pose matrices, parent pose @ rest pose relative to the parent @ local transform
+        rest = np.array([[tuple(row) for row in bone.bone.matrix_local] for bone in bones], dtype=np.float64).reshape(-1, 4, 4)
+        pose = np.empty_like(basis)
+        done = np.zeros(len(bones), dtype=bool)
+
+        def Evaluate(i : int):
+            if done[i]:
+                return
+
+            parent = bones[i].parent
+            if parent is None:
+                pose[:, i] = rest[i] @ basis[:, i]
+            else:
+                p = bone_indices[parent.name]
+                Evaluate(p)
+                pose[:, i] = pose[:, p] @ (np.linalg.inv(rest[p]) @ rest[i]) @ basis[:, i]
+
+            done[i] = True
+
+        for i in range(len(bones)):
+            Evaluate(i)
+
+        return pose.astype(np.float32)
+
+    # Compute the joint samples of the action at the given frames, which can be fractional
+    def SampleFrames(self, blender_action : bpy.types.Action, frames : np.ndarray, fast : bool) -> np.ndarray:
+        import math
+
+        bones = self.pose_obj.pose.bones
+
+        if fast:
+            bone_matrices = self.EvaluateFCurves(blender_action, frames)
+        else:
+            # Read all the pose bone matrices of a frame at once, and do the math for
+            # all the frames when we're done sampling
+            bone_matrices = np.empty((len(frames), len(bones) * 16), dtype=np.float32)
+            for i, frame in enumerate(frames):
+                whole_frame = math.floor(frame)
+                bpy.context.scene.frame_set(int(whole_frame), subframe=float(frame - whole_frame))
+                bones.foreach_get("matrix", bone_matrices[i])
+
+            # foreach_get gives us column major matrices
+            bone_matrices = bone_matrices.reshape(len(frames), len(bones), 4, 4).transpose(0, 1, 3, 2)
+
+        return ComputeJointSamples(
+            bone_matrices,
+            self.joint_bones,
+            self.joint_parents,
+            self.transform,
+            self.scale_fixup
+        )
+
+    # Sample an action. This sets the action of the armature and the current frame of the
+    # scene, restoring them is left to the caller so it can be done once for many actions.
+    # If fast is True, the pose is computed from the F-curves of the action without
+    # evaluating the scene, the caller must check FastSamplingBlocker first.
+    def Sample(
+        self,
+        blender_action : bpy.types.Action,
+        frame_begin : int,
+        frame_end : int,
+        frame_step : int,
+        fast : bool = False
+    ) -> SampledAnimation:
+        self.blender_obj.animation_data.action = blender_action
+
+        result = SampledAnimation()
+        result.name_to_joint_id = dict(self.name_to_joint_id)
+        result.samples = self.SampleFrames(blender_action, np.arange(frame_begin, frame_end + 1, frame_step), fast)
 
         return result
 
-    def WriteBinary(self, filename : str):
-        import struct
+    # Sample an action at each pose like Sample does, then add samples between poses where
+    # the motion is too fast to be interpolated from the surrounding samples within the
+    # tolerances (rotation_tolerance is in radians). Intervals that need it are halved up to
+    # max_subdivisions times, so the samples are at least frame_step / 2^max_subdivisions
+    # frames apart.
+    def SampleAdaptive(
+        self,
+        blender_action : bpy.types.Action,
+        frame_begin : int,
+        frame_end : int,
+        frame_step : int,
+        position_tolerance : float,
+        rotation_tolerance : float,
+        scale_tolerance : float,
+        max_subdivisions : int,
+        fast : bool = False
+    ) -> SampledAnimation:
+        result = self.Sample(blender_action, frame_begin, frame_end, frame_step, fast)
+        samples = result.samples
+        times = np.arange(len(samples), dtype=np.float64)
 
-        with open(filename, "wb") as file:
-            fw = file.write
+        # Intervals to split, as the index of their first sample
+        intervals = np.arange(len(samples) - 1)
+        half_length = 1.0
+        for _ in range(max_subdivisions):
+            if len(intervals) == 0:
+                break
+
+            half_length *= 0.5
+            halfway_times = times[intervals] + half_length
+            halfway_samples = self.SampleFrames(blender_action, frame_begin + halfway_times * frame_step, fast)
+
+            needed = np.zeros(len(intervals), dtype=bool)
+            for field, tolerance, is_rotation in (
+                ("local_position", position_tolerance, False),
+                ("local_orientation", rotation_tolerance, True),
+                ("local_scale", scale_tolerance, False),
+            ):
+                errors = animation_compression.HalfwayErrors(
+                    samples[field][intervals],
+                    samples[field][intervals + 1],
+                    halfway_samples[field],
+                    is_rotation
+                )
+                needed |= np.any(errors > tolerance, axis=1)
+
+            new_times = halfway_times[needed]
+            times = np.concatenate([times, new_times])
+            samples = np.concatenate([samples, halfway_samples[needed]])
+            order = np.argsort(times, kind="stable")
+            times = times[order]
+            samples = samples[order]
+
+            # Both halves of the intervals we split are candidates for the next level
+            new_indices = np.searchsorted(times, new_times)
+            intervals = np.union1d(new_indices - 1, new_indices)
+
+        result.samples = samples
+        result.sample_times = times
+
+        return result
+
+# Compare an animation written with reduced keys or quantized tracks to the dense samples
+# it was made from
+def CompressionReport(
+    anim : SampledAnimation,
+    tracks : List[List[Tuple[np.ndarray, np.ndarray]]],
+    filename : str
+) -> str:
+    import io
+    import os
+
+    # The baseline is a sample per pose, even if the animation has samples between poses
+    dense_file = io.BytesIO()
+    anim.WriteHeader(dense_file, Animation_Version)
+    anim.WriteSamples(dense_file)
+    dense_data = dense_file.getvalue()
+
+    with open(filename, "rb") as file:
+        data = file.read()
+
+    decoded = SampledAnimation.FromBytes(data, anim.sample_times)
+
+    key_count = sum(len(key_times) for joint_tracks in tracks for key_times, _ in joint_tracks)
+    track_count = 3 * len(tracks)
+    constant_track_count = sum(len(key_times) == 1 for joint_tracks in tracks for key_times, _ in joint_tracks)
+
+    errors = {}
+    for field, is_rotation in (("local_position", False), ("local_orientation", True), ("local_scale", False)):
+        errors[field] = animation_compression.TrackErrors(
+            decoded.samples[field].reshape(-1, anim.samples[field].shape[-1]),
+            anim.samples[field].reshape(-1, anim.samples[field].shape[-1]),
+            is_rotation
+        ).max(initial=0)
+
+    return (
+        f"{os.path.basename(filename)}: {key_count}/{track_count * len(anim.samples)} keys, {constant_track_count}/{track_count} constant tracks, "
+        f"max errors: position {errors['local_position']:.6g}, rotation {np.degrees(errors['local_orientation']):.6g} deg, scale {errors['local_scale']:.6g}, "
+        f"size {len(dense_data)} -> {len(data)} bytes ({len(data) / max(len(dense_data), 1) * 100:.1f}%)"
+    )
+
+# Number of samples taken between poses by adaptive sampling, and number of keys each joint
+# ended up with
+def AdaptiveSamplingReport(anim : SampledAnimation, tracks : List[List[Tuple[np.ndarray, np.ndarray]]]) -> str:
+    joint_names = list(anim.name_to_joint_id.keys())
+    key_counts = np.array([sum(len(key_times) for key_times, _ in joint_tracks) for joint_tracks in tracks])
+    if len(key_counts) == 0:
+        return "no joints"
+
+    busiest = np.argsort(-key_counts, kind="stable")[:5]
+
+    return (
+        f"{len(anim.samples) - anim.PoseCount()} samples between poses, "
+        f"keys per joint min {key_counts.min()}, average {key_counts.mean():.1f}, max {key_counts.max()} "
+        f"({', '.join(f'{joint_names[i]} {key_counts[i]}' for i in busiest)})"
+    )
+
+# Increment this whenever a change in the exporter changes the output for the same input,
+# so clips exported with the previous version are not considered up to date
+Anim_Export_Cache_Version = 1
+
+# Hash of the state of the rigs that affects the sampled poses, besides the actions:
+# the rest pose, the constraints and drivers, and the value of the channels that are
+# not animated by the actions
+def RigKey(armature_obj : bpy.types.Object, pose_obj : bpy.types.Object) -> str:
+    def AnimDataKey(anim_data : bpy.types.AnimData):
+        if anim_data is None:
+            return None
+
+        return (
+            [(d.data_path, d.array_index, d.mute, d.driver.expression) for d in anim_data.drivers],
+            anim_data.use_nla,
+            [(t.name, t.mute) for t in anim_data.nla_tracks],
+        )
+
+    def ObjectKey(obj : bpy.types.Object):
+        return (
+            obj.name,
+            [
+                (
+                    b.name,
+                    b.parent.name if b.parent is not None else "",
+                    b.bone.use_deform,
+                    [tuple(row) for row in b.bone.matrix_local],
+                    b.rotation_mode,
+                    [(c.name, c.type, c.mute, c.influence, getattr(c, "subtarget", "")) for c in b.constraints],
+                )
+                for b in obj.pose.bones
+            ],
+            AnimDataKey(obj.animation_data),
+            AnimDataKey(obj.data.animation_data),
+        )
+
+    return repr((
+        ObjectKey(armature_obj),
+        ObjectKey(pose_obj) if pose_obj != armature_obj else None,
+    ))
+
+# Values of the properties of an RNA struct (such as an F-curve modifier), recursing into
+# collections. Pointers and UI state are left out.
+def RNAKey(struct) -> list:
+    key = []
+    for prop in struct.bl_rna.properties:
+        if prop.identifier in ("rna_type", "active", "show_expanded", "is_valid"):
+            continue
 
-            fw(b"ARMATURE_ANIMATION")
+        if prop.type == 'COLLECTION':
+            key.append((prop.identifier, [RNAKey(item) for item in getattr(struct, prop.identifier)]))
+        elif prop.type != 'POINTER':
+            value = getattr(struct, prop.identifier)
+            if getattr(prop, "is_array", False):
+                value = tuple(value)
 
-            fw(struct.pack("<I", 10000)) # Version
+            key.append((prop.identifier, value))
 
-            fw(struct.pack("<I", len(self.poses)))
-            fw(struct.pack("<I", len(self.name_to_joint_id)))
-            for name in self.name_to_joint_id:
-                fw(b"%s\0" % bytes(name, 'UTF-8'))
+    return key
 
-            for pose in self.poses:
-                for joint in pose.joints:
-                    fw(struct.pack("<fff", *joint.local_position))
-                    fw(struct.pack("<ffff", *joint.local_orientation))
-                    fw(struct.pack("<fff", *joint.local_scale))
+Pose_Bone_Channels = ("location", "rotation_quaternion", "rotation_euler", "rotation_axis_angle", "scale")
+
+# Hash of everything that affects the exported file of an action, so we can skip
+# exporting actions that did not change since the last export. Channels that the action
+# does not animate keep their current value when sampling, so their values are part of
+# the hash, but the values of the animated channels are not, since they depend on the
+# current frame and on the action that was active before.
+def HashActionInputs(action : bpy.types.Action, armature_obj : bpy.types.Object, frame_begin : int, frame_end : int, options_key : str) -> str:
+    import hashlib
+
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(bytes(f"{Anim_Export_Cache_Version} {frame_begin} {frame_end} {options_key}", 'UTF-8'))
+
+    for fcurve in action.fcurves:
+        hasher.update(bytes(repr((
+            fcurve.data_path,
+            fcurve.array_index,
+            fcurve.mute,
+            fcurve.extrapolation,
+            [(m.type, RNAKey(m)) for m in fcurve.modifiers],
+            [(k.interpolation, k.easing) for k in fcurve.keyframe_points],
+        )), 'UTF-8'))
+
+        for attribute in ("co", "handle_left", "handle_right"):
+            values = np.empty(len(fcurve.keyframe_points) * 2, dtype=np.float32)
+            fcurve.keyframe_points.foreach_get(attribute, values)
+            hasher.update(values.tobytes())
+
+    animated = set((fcurve.data_path, fcurve.array_index) for fcurve in action.fcurves if not fcurve.mute)
+
+    static_channels = []
+    for bone in armature_obj.pose.bones:
+        for channel in Pose_Bone_Channels:
+            data_path = bone.path_from_id(channel)
+            values = tuple(getattr(bone, channel))
+            static_channels.append((data_path, [v if (data_path, i) not in animated else None for i, v in enumerate(values)]))
+
+    hasher.update(bytes(repr(static_channels), 'UTF-8'))
+
+    return hasher.hexdigest()
 
 def ExportAnimationsForArmature(
     context : bpy.types.Context,
@@ -155,9 +989,19 @@ def ExportAnimationsForArmature(
     frame_step : int,
     apply_object_transform : bool,
     dest_coordinate_system : utils.CoordinateSystem,
-    transform_matrix : mathutils.Matrix = mathutils.Matrix.Identity(4)
+    transform_matrix : mathutils.Matrix = mathutils.Matrix.Identity(4),
+    reduce_keys : bool = False,
+    position_tolerance : float = 0.0001,
+    rotation_tolerance : float = 0.05,
+    scale_tolerance : float = 0.0001,
+    quantized_rotation_bits : int = 0,
+    fast_sampling : bool = False,
+    adaptive_sampling : bool = False,
+    max_subdivisions : int = 2,
+    use_cache : bool = False
 ):
     import os
+    import time
 
     os.makedirs(dirname, exist_ok = True)
 
@@ -167,23 +1011,217 @@ def ExportAnimationsForArmature(
     if armature_obj.animation_data is None or pose_obj.pose is None:
         return
 
-    for action in actions:
-        output_filename = os.path.join(dirname, action.name) + ".anim"
-        if use_action_frame_range:
-            frame_begin, frame_end = (
-                int(action.frame_range[0]),
-                int(action.frame_range[1])
+    total_start = time.perf_counter()
+
+    sampler = ArmatureSampler(armature_obj, pose_obj, apply_object_transform, dest_coordinate_system, transform_matrix)
+
+    if fast_sampling:
+        blocker = sampler.FastSamplingBlocker()
+        if blocker is not None:
+            print(f"WARNING: Cannot use fast sampling because {blocker}, evaluating the scene instead")
+            fast_sampling = False
+
+    cache = utils.ExportCache(os.path.join(dirname, ".anim_export_cache.json"), Anim_Export_Cache_Version)
+    options_key = ""
+    if use_cache:
+        cache.Load()
+
+        options_key = repr((
+            apply_object_transform,
+            [tuple(row) for row in armature_obj.matrix_world] if apply_object_transform else None,
+            dest_coordinate_system.right + dest_coordinate_system.up + dest_coordinate_system.forward,
+            [tuple(row) for row in transform_matrix],
+            frame_step,
+            reduce_keys,
+            position_tolerance,
+            rotation_tolerance,
+            scale_tolerance,
+            quantized_rotation_bits,
+            fast_sampling,
+            adaptive_sampling,
+            max_subdivisions,
+            RigKey(armature_obj, pose_obj),
+        ))
+
+    # The scene state is only restored once all the actions are sampled
+    prev_action = armature_obj.animation_data.action
+    prev_frame = context.scene.frame_current
+    prev_use_nla = armature_obj.animation_data.use_nla
+    exported_count = 0
+
+    try:
+        # Each clip is sampled from its action alone, the NLA strips would blend the other
+        # clips in for the channels the action does not animate
+        armature_obj.animation_data.use_nla = False
+
+        for action in actions:
+            exported = ExportAction(
+                context,
+                dirname,
+                sampler,
+                action,
+                use_action_frame_range,
+                frame_step,
+                reduce_keys,
+                position_tolerance,
+                rotation_tolerance,
+                scale_tolerance,
+                quantized_rotation_bits,
+                fast_sampling,
+                adaptive_sampling,
+                max_subdivisions,
+                cache if use_cache else None,
+                options_key
             )
+
+            if exported:
+                exported_count += 1
+    finally:
+        armature_obj.animation_data.use_nla = prev_use_nla
+        context.scene.frame_set(prev_frame)
+        armature_obj.animation_data.action = prev_action
+
+        # Save what we successfully exported even if something failed along the way
+        if use_cache:
+            cache.Save()
+
+    print(f"Exported {exported_count} animation clip(s) in {time.perf_counter() - total_start:.2f} s")
+
+    if use_cache:
+        print(f"Export cache: {cache.hits} unchanged clip(s) skipped, {cache.misses} exported")
+
+# Sample and write a single action. Returns False if the action is skipped because the
+# export cache says it is up to date.
+def ExportAction(
+    context : bpy.types.Context,
+    dirname : str,
+    sampler : ArmatureSampler,
+    action : bpy.types.Action,
+    use_action_frame_range : bool,
+    frame_step : int,
+    reduce_keys : bool,
+    position_tolerance : float,
+    rotation_tolerance : float,
+    scale_tolerance : float,
+    quantized_rotation_bits : int,
+    fast_sampling : bool,
+    adaptive_sampling : bool = False,
+    max_subdivisions : int = 2,
+    cache : utils.ExportCache = None,
+    options_key : str = ""
+) -> bool:
+    import os
+    import math
+    import time
+
+    output_filename = os.path.join(dirname, action.name) + ".anim"
+    if use_action_frame_range:
+        frame_begin, frame_end = (
+            int(action.frame_range[0]),
+            int(action.frame_range[1])
+        )
+    else:
+        frame_begin, frame_end = (
+            int(context.scene.frame_start),
+            int(context.scene.frame_end)
+        )
+
+    content_hash = ""
+    if cache is not None:
+        content_hash = HashActionInputs(action, sampler.blender_obj, frame_begin, frame_end, options_key)
+        if cache.IsUpToDate(action.name, content_hash):
+            cache.hits += 1
+            return False
+
+        cache.misses += 1
+
+    start = time.perf_counter()
+    if adaptive_sampling:
+        anim = sampler.SampleAdaptive(
+            action, frame_begin, frame_end, frame_step,
+            position_tolerance, math.radians(rotation_tolerance), scale_tolerance,
+            max_subdivisions, fast_sampling
+        )
+    else:
+        anim = sampler.Sample(action, frame_begin, frame_end, frame_step, fast_sampling)
+    sample_time = time.perf_counter() - start
+    start = time.perf_counter()
+
+    # Samples between poses are only useful with reduced keys, which are then written with
+    # f32 key times whatever the other options are
+    use_tracks = reduce_keys or quantized_rotation_bits != 0 or adaptive_sampling
+
+    if adaptive_sampling and quantized_rotation_bits != 0:
+        print(f"WARNING: Quantized tracks cannot have keys between poses, writing float tracks for animation clip {action.name}")
+
+    # Key times are stored as u16 pose indices
+    if use_tracks and not adaptive_sampling and len(anim.samples) > 65536:
+        print(f"WARNING: Animation clip {action.name} has too many poses ({len(anim.samples)}) for reduced keys or quantized tracks, writing all the samples")
+        use_tracks = False
+
+    if use_tracks:
+        if reduce_keys or adaptive_sampling:
+            tracks = anim.CompressTracks(position_tolerance, math.radians(rotation_tolerance), scale_tolerance)
         else:
-            frame_begin, frame_end = (
-                int(context.scene.frame_start),
-                int(context.scene.frame_end)
-            )
+            tracks = anim.UncompressedTracks()
 
-        anim = SampledAnimation.FromAction(armature_obj, pose_obj, action, frame_begin, frame_end, frame_step, apply_object_transform, dest_coordinate_system, transform_matrix)
+        anim.WriteBinary(output_filename, tracks, quantized_rotation_bits)
+    else:
         anim.WriteBinary(output_filename)
 
-        print(f"Exported animation clip {action.name} to file {output_filename}")
+    write_time = time.perf_counter() - start
+
+    print(f"Exported animation clip {action.name} to file {output_filename}")
+    sampling_mode = "F-curves" if fast_sampling else "scene"
+    print(f"    {anim.PoseCount()} poses, sampling {sample_time:.2f} s ({sample_time / max(len(anim.samples), 1) * 1000:.2f} ms per sample, evaluating the {sampling_mode}), writing {write_time:.2f} s")
+
+    if use_tracks:
+        print(f"    {CompressionReport(anim, tracks, output_filename)}")
+
+    if adaptive_sampling:
+        print(f"    {AdaptiveSamplingReport(anim, tracks)}")
+
+    if cache is not None:
+        cache.Update(action.name, content_hash, [output_filename])
+
+    return True
+
+# Returns the actions to export for an armature: the action from the options, all the actions
+# animating bones of the armature, or the actions of the NLA strips of the armature.
+# Actions whose name doesn't match name_filter (a pattern like Walk_*) are skipped.
+def ActionsToExport(
+    armature_obj : bpy.types.Object,
+    action_source : str,
+    action : bpy.types.Action,
+    name_filter : str
+) -> List[bpy.types.Action]:
+    import fnmatch
+
+    if action_source == "ACTION":
+        return [action] if action is not None else []
+
+    if action_source == "NLA":
+        candidates = []
+        if armature_obj.animation_data is not None:
+            for track in armature_obj.animation_data.nla_tracks:
+                for strip in track.strips:
+                    if strip.action is not None and strip.action not in candidates:
+                        candidates.append(strip.action)
+    else:
+        bone_names = set(bone.name for bone in armature_obj.pose.bones)
+
+        def AnimatesArmature(action : bpy.types.Action) -> bool:
+            for fcurve in action.fcurves:
+                if fcurve.data_path.startswith('pose.bones["'):
+                    bone_name = fcurve.data_path[len('pose.bones["'):].split('"]', 1)[0]
+                    if bone_name in bone_names:
+                        return True
+
+            return False
+
+        candidates = [action for action in bpy.data.actions if AnimatesArmature(action)]
+
+    return [action for action in candidates if fnmatch.fnmatchcase(action.name, name_filter or "*")]
 
 class ActionWrapperProperty(bpy.types.PropertyGroup):
     action: PointerProperty(
@@ -224,12 +1262,103 @@ class AnimExportOptions(bpy.types.PropertyGroup):
         type=bpy.types.Object
     )
 
+    action_source : EnumProperty(
+        name="Actions",
+        description="Actions to export.",
+        items=(
+            ("ACTION", "Single Action", "Export the selected action."),
+            ("ALL", "All Actions", "Export all the actions animating bones of the control armature."),
+            ("NLA", "NLA Tracks", "Export the actions of the NLA strips of the control armature."),
+        ),
+        default="ACTION"
+    )
+
     action : PointerProperty(
         name="Action",
         description="Action to export.",
         type=bpy.types.Action
     )
 
+    action_filter : StringProperty(
+        name="Name Filter",
+        description="Only export actions whose name matches this pattern (e.g. Walk_*).",
+        default="*"
+    )
+
+    frame_step : IntProperty(
+        name="Frame Step",
+        description="Number of frames between poses.",
+        default=1,
+        min=1
+    )
+
+    adaptive_sampling : BoolProperty(
+        name="Adaptive Sampling",
+        description="Add samples between poses where the motion can't be interpolated within the tolerances below, and reduce keys. Keys can be between poses, which writes a newer version of the animation file format.",
+        default=False
+    )
+
+    max_subdivisions : IntProperty(
+        name="Sub-frame Levels",
+        description="Number of times the interval between two poses can be halved by adaptive sampling.",
+        default=2,
+        min=1,
+        max=6
+    )
+
+    reduce_keys : BoolProperty(
+        name="Reduce Keys",
+        description="Remove constant tracks and the keys that can be interpolated from their neighbours within the tolerances below. This writes a newer version of the animation file format.",
+        default=False
+    )
+
+    position_tolerance : FloatProperty(
+        name="Position Tolerance",
+        description="Maximum position error allowed when reducing keys or sampling adaptively.",
+        default=0.0001,
+        min=0,
+        precision=5
+    )
+
+    rotation_tolerance : FloatProperty(
+        name="Rotation Tolerance",
+        description="Maximum rotation error allowed when reducing keys or sampling adaptively, in degrees.",
+        default=0.05,
+        min=0,
+        precision=4
+    )
+
+    scale_tolerance : FloatProperty(
+        name="Scale Tolerance",
+        description="Maximum scale error allowed when reducing keys or sampling adaptively.",
+        default=0.0001,
+        min=0,
+        precision=5
+    )
+
+    fast_sampling : BoolProperty(
+        name="Fast Sampling",
+        description="Compute the pose from the F-curves of the actions instead of evaluating the whole scene for each frame. Armatures with constraints or drivers are sampled by evaluating the scene.",
+        default=False
+    )
+
+    use_cache : BoolProperty(
+        name="Skip Unchanged",
+        description="Only export the actions whose keyframes, rig or export options changed since the last export to the output directory.",
+        default=False
+    )
+
+    quantization : EnumProperty(
+        name="Quantization",
+        description="Quantize the tracks: rotations are packed on 48 or 32 bits, positions and scales on 16 bits per component relative to the range of their track, and scales that are all 1 are omitted. This writes a newer version of the animation file format.",
+        items=(
+            ("NONE", "None", "Write float tracks."),
+            ("48", "48 Bit Rotations", "Pack rotations on 48 bits."),
+            ("32", "32 Bit Rotations", "Pack rotations on 32 bits."),
+        ),
+        default="NONE"
+    )
+
 class EXPORTER_OT_VkEngineAnimation(bpy.types.Operator):
     bl_idname = "export.vk_engine_anim"
     bl_label = "Export Vk-Engine animations (.anim)"
@@ -245,7 +1374,8 @@ class EXPORTER_OT_VkEngineAnimation(bpy.types.Operator):
         pose_object : bpy.types.Object = options.deform_armature
         actions : List[bpy.types.Action] = []
 
-        actions.append(options.action)
+        if armature_object is not None:
+            actions = ActionsToExport(armature_object, options.action_source, options.action, options.action_filter)
 
         dest_coordinate_system = utils.CoordinateSystem.FromString(options.coordinate_system)
 
@@ -257,9 +1387,18 @@ class EXPORTER_OT_VkEngineAnimation(bpy.types.Operator):
                 pose_object,
                 actions,
                 use_action_frame_range=True,
-                frame_step=1,
+                frame_step=options.frame_step,
                 apply_object_transform=options.apply_object_transform,
-                dest_coordinate_system=dest_coordinate_system
+                dest_coordinate_system=dest_coordinate_system,
+                reduce_keys=options.reduce_keys,
+                position_tolerance=options.position_tolerance,
+                rotation_tolerance=options.rotation_tolerance,
+                scale_tolerance=options.scale_tolerance,
+                quantized_rotation_bits=0 if options.quantization == "NONE" else int(options.quantization),
+                fast_sampling=options.fast_sampling,
+                adaptive_sampling=options.adaptive_sampling,
+                max_subdivisions=options.max_subdivisions,
+                use_cache=options.use_cache
             )
 
         context.window.cursor_set('DEFAULT')
@@ -282,9 +1421,25 @@ class VIEW3D_PT_VkEngineAnimationExport(bpy.types.Panel):
         layout.row().prop(options, "output_directory")
         layout.row().prop(options, "control_armature")
         layout.row().prop(options, "deform_armature")
-        layout.row().prop(options, "action")
+        layout.row().prop(options, "action_source")
+        if options.action_source == "ACTION":
+            layout.row().prop(options, "action")
+        else:
+            layout.row().prop(options, "action_filter")
+        layout.row().prop(options, "use_cache")
+        layout.row().prop(options, "fast_sampling")
+        layout.row().prop(options, "frame_step")
+        layout.row().prop(options, "adaptive_sampling")
+        if options.adaptive_sampling:
+            layout.row().prop(options, "max_subdivisions")
+        layout.row().prop(options, "reduce_keys")
+        if options.reduce_keys or options.adaptive_sampling:
+            layout.row().prop(options, "position_tolerance")
+            layout.row().prop(options, "rotation_tolerance")
+            layout.row().prop(options, "scale_tolerance")
+        layout.row().prop(options, "quantization")
 
-        valid = options.output_directory != "" and options.control_armature is not None and options.deform_armature is not None and options.action is not None
+        valid = options.output_directory != "" and options.control_armature is not None and options.deform_armature is not None and (options.action is not None or options.action_source != "ACTION")
 
         row = layout.row()
         row.enabled = valid
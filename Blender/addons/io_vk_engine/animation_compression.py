@@ -0,0 +1,228 @@
+# This file contains the algorithms used to compress the sampled joint tracks of an
+# animation before it is written. Tracks are arrays with a row per pose, positions and
+# scales have 3 columns and orientations are x, y, z, w quaternions. Nothing in here
+# touches bpy.
+
+import numpy as np
+
+from typing import (
+    Tuple
+)
+
+# Flip the sign of the quaternions so consecutive ones are in the same hemisphere,
+# otherwise interpolating between them would take the long way around
+def MakeQuaternionsContinuous(quats : np.ndarray) -> np.ndarray:
+    if len(quats) < 2:
+        return quats.copy()
+
+    dots = np.einsum("ij,ij->i", quats[1:], quats[:-1])
+    signs = np.concatenate([[1], np.cumprod(np.where(dots < 0, -1, 1))])
+
+    return (quats * signs[:, None]).astype(quats.dtype)
+
+# Interpolate between the keys of a track like the engine does when sampling an animation
+# (lerp for positions and scales, nlerp for orientations), at the given fractional times
+def InterpolateKeys(key_times : np.ndarray, key_values : np.ndarray, times : np.ndarray, is_rotation : bool) -> np.ndarray:
+    if len(key_times) == 1:
+        return np.repeat(key_values.astype(np.float64), len(times), axis=0)
+
+    next_keys = np.clip(np.searchsorted(key_times, times, side="right"), 1, len(key_times) - 1)
+    prev_keys = next_keys - 1
+
+    t0 = key_times[prev_keys].astype(np.float64)
+    t1 = key_times[next_keys].astype(np.float64)
+    t = np.clip((times - t0) / (t1 - t0), 0, 1)[:, None]
+
+    a = key_values[prev_keys].astype(np.float64)
+    b = key_values[next_keys].astype(np.float64)
+    result = a + (b - a) * t
+
+    if is_rotation:
+        result /= np.linalg.norm(result, axis=1, keepdims=True)
+
+    return result
+
+# Error of each sample of a track compared to the reference track: the distance for
+# positions and scales, and the angle in radians for orientations
+def TrackErrors(values : np.ndarray, reference : np.ndarray, is_rotation : bool) -> np.ndarray:
+    values = values.astype(np.float64)
+    reference = reference.astype(np.float64)
+
+    if is_rotation:
+        dots = np.abs(np.einsum("ij,ij->i", values, reference))
+        dots /= np.linalg.norm(values, axis=1) * np.linalg.norm(reference, axis=1)
+
+        return 2 * np.arccos(np.clip(dots, 0, 1))
+
+    return np.linalg.norm(values - reference, axis=1)
+
+# Error of the sample halfway between two others compared to interpolating between them.
+# Arrays have the samples of all the joints, the error of each joint is returned.
+def HalfwayErrors(first : np.ndarray, last : np.ndarray, halfway : np.ndarray, is_rotation : bool) -> np.ndarray:
+    first = first.astype(np.float64)
+    last = last.astype(np.float64)
+
+    if is_rotation:
+        last = last * np.where(np.sum(first * last, axis=-1, keepdims=True) < 0, -1, 1)
+
+    interpolated = (first + last) * 0.5
+    if is_rotation:
+        interpolated /= np.linalg.norm(interpolated, axis=-1, keepdims=True)
+
+    component_count = halfway.shape[-1]
+    errors = TrackErrors(interpolated.reshape(-1, component_count), halfway.reshape(-1, component_count), is_rotation)
+
+    return errors.reshape(halfway.shape[:-1])
+
+# Find the keys needed to reconstruct a track within tolerance by interpolating between
+# them. A track that never moves more than tolerance away from its first value is reduced
+# to a single key, otherwise the first and the last samples are always kept and the track
+# is split at the sample with the biggest error until all samples are within tolerance
+# (Ramer-Douglas-Peucker). times are the sorted times of the samples if they are not
+# evenly spaced. Returns the sorted indices of the samples to keep.
+def ReduceKeys(values : np.ndarray, tolerance : float, is_rotation : bool, times : np.ndarray = None) -> np.ndarray:
+    sample_count = len(values)
+    if sample_count == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    if TrackErrors(np.broadcast_to(values[0], values.shape), values, is_rotation).max() <= tolerance:
+        return np.zeros(1, dtype=np.int64)
+
+    keep = np.zeros(sample_count, dtype=bool)
+    keep[0] = True
+    keep[-1] = True
+
+    # Samples that can't be interpolated from their direct neighbours are kept right away,
+    # this saves a lot of splitting on tracks that keep most of their keys
+    if sample_count > 2:
+        if times is None:
+            halfway = (values[:-2].astype(np.float64) + values[2:]) * 0.5
+        else:
+            t = ((times[1:-1] - times[:-2]) / (times[2:] - times[:-2]))[:, None]
+            halfway = values[:-2].astype(np.float64) + (values[2:] - values[:-2].astype(np.float64)) * t
+
+        if is_rotation:
+            halfway /= np.linalg.norm(halfway, axis=1, keepdims=True)
+
+        keep[1:-1] = TrackErrors(halfway, values[1:-1], is_rotation) > tolerance
+
+    if times is None:
+        times = np.arange(sample_count, dtype=np.float64)
+
+    kept = np.flatnonzero(keep)
+    segments = [(int(first), int(last)) for first, last in zip(kept[:-1], kept[1:]) if last - first >= 2]
+    while len(segments) > 0:
+        first, last = segments.pop()
+        if last - first < 2:
+            continue
+
+        key_times = times[[first, last]].astype(np.float64)
+        key_values = values[[first, last]]
+
+        interpolated = InterpolateKeys(key_times, key_values, times[first + 1:last], is_rotation)
+        errors = TrackErrors(interpolated, values[first + 1:last], is_rotation)
+
+        worst = int(np.argmax(errors))
+        if errors[worst] > tolerance:
+            split = first + 1 + worst
+            keep[split] = True
+            segments.append((first, split))
+            segments.append((split, last))
+
+    return np.flatnonzero(keep)
+
+# Reconstruct the dense samples of a track from its keys
+def DecodeTrack(key_times : np.ndarray, key_values : np.ndarray, sample_count : int, is_rotation : bool) -> np.ndarray:
+    # Key times are sorted and unique, so there is a key per sample
+    if len(key_times) == sample_count:
+        if is_rotation:
+            key_values = key_values / np.linalg.norm(key_values, axis=1, keepdims=True)
+
+        return key_values.astype(np.float32)
+
+    times = np.arange(sample_count, dtype=np.float64)
+
+    return InterpolateKeys(key_times, key_values, times, is_rotation).astype(np.float32)
+
+# Compress a track, returns the key times and values. Key times are sample indices, or taken
+# from times if the samples are not evenly spaced.
+def CompressTrack(values : np.ndarray, tolerance : float, is_rotation : bool, times : np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+    if is_rotation:
+        values = MakeQuaternionsContinuous(values)
+
+    keys = ReduceKeys(values, tolerance, is_rotation, times)
+    key_times = keys if times is None else times[keys]
+
+    return key_times, np.ascontiguousarray(values[keys], dtype=np.float32)
+
+# Scale tracks that are within this distance of 1 are not written in quantized files
+Unit_Scale_Epsilon = 1.0e-5
+
+# Quantize a track to 16 bits per component, relative to its range.
+# Returns the range minimum, the range extent and the quantized values.
+def QuantizeRange(values : np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    minimum = values.min(axis=0).astype(np.float32)
+    extent = (values.max(axis=0) - minimum).astype(np.float32)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        normalized = np.where(extent > 0, (values - minimum) / extent, 0)
+
+    quantized = np.round(np.clip(normalized, 0, 1) * 65535).astype(np.uint16)
+
+    return minimum, extent, quantized
+
+def DequantizeRange(minimum : np.ndarray, extent : np.ndarray, quantized : np.ndarray) -> np.ndarray:
+    return (minimum + quantized.astype(np.float32) * (extent / np.float32(65535))).astype(np.float32)
+
+# Pack quaternions using the smallest three method: the biggest component is dropped (the
+# quaternion is negated if needed so it is positive) and the three others, which are in
+# [-1/sqrt(2), 1/sqrt(2)], are stored on (bits - 2) / 3 bits each, along with the 2 bit index
+# of the dropped component. Quaternions are packed in u32 for 32 bits and in three u16 for
+# 48 bits, the index being in the most significant bits.
+def PackQuaternions(quats : np.ndarray, bits : int) -> np.ndarray:
+    component_bits = (bits - 2) // 3
+    max_value = (1 << component_bits) - 1
+
+    quats = quats.astype(np.float64)
+    quats /= np.linalg.norm(quats, axis=1, keepdims=True)
+
+    biggest = np.argmax(np.abs(quats), axis=1)
+    signs = np.where(quats[np.arange(len(quats)), biggest] < 0, -1, 1)
+    quats *= signs[:, None]
+
+    packed = biggest.astype(np.uint64) << np.uint64(3 * component_bits)
+    smallest = quats[np.arange(4)[None, :] != biggest[:, None]].reshape(-1, 3)
+    normalized = np.clip(smallest * np.sqrt(0.5) + 0.5, 0, 1)
+    for i in range(3):
+        value = np.round(normalized[:, i] * max_value).astype(np.uint64)
+        packed |= value << np.uint64((2 - i) * component_bits)
+
+    if bits == 32:
+        return packed.astype("<u4")
+
+    return np.stack([
+        packed & np.uint64(0xffff),
+        (packed >> np.uint64(16)) & np.uint64(0xffff),
+        (packed >> np.uint64(32)) & np.uint64(0xffff),
+    ], axis=1).astype("<u2")
+
+def UnpackQuaternions(packed : np.ndarray, bits : int) -> np.ndarray:
+    component_bits = (bits - 2) // 3
+    max_value = (1 << component_bits) - 1
+
+    packed = packed.astype(np.uint64)
+    if bits == 48:
+        packed = packed[:, 0] | (packed[:, 1] << np.uint64(16)) | (packed[:, 2] << np.uint64(32))
+
+    biggest = (packed >> np.uint64(3 * component_bits)).astype(np.int64)
+
+    smallest = np.empty((len(packed), 3), dtype=np.float64)
+    for i in range(3):
+        value = (packed >> np.uint64((2 - i) * component_bits)) & np.uint64(max_value)
+        smallest[:, i] = (value.astype(np.float64) / max_value - 0.5) / np.sqrt(0.5)
+
+    quats = np.empty((len(packed), 4), dtype=np.float64)
+    quats[np.arange(4)[None, :] != biggest[:, None]] = smallest.ravel()
+    quats[np.arange(len(packed)), biggest] = np.sqrt(np.maximum(1 - np.sum(smallest * smallest, axis=1), 0))
+
+    return quats.astype(np.float32)
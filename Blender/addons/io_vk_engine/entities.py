@@ -9,7 +9,8 @@ import mathutils
 from typing import (
     List,
     Dict,
-    Tuple
+    Tuple,
+    Union
 )
 
 from bpy.props import (
@@ -22,9 +23,52 @@ from bpy.props import (
 
 from . import utils
 from . import material
+from . import scene_archive
+from . import entity_binary
+from . import scene_bvh
+
+from .scene_archive import (
+    EntityBlocks,
+    Field_Type_Guid,
+    Field_Type_String,
+    Field_Type_Bool,
+    Field_Type_Float,
+    Field_Type_Float_Array,
+)
 
 Entity_Version = 2
 
+# Custom property of the objects in which the GUID of their entity is stored, so it is the
+# same from one export to the next
+Entity_Guid_Property = "vk_engine_guid"
+
+def FormatFieldValue(field_type : int, value) -> str:
+    if field_type == Field_Type_Guid:
+        return f"0x{value}"
+
+    if field_type == Field_Type_String:
+        return f"\"{value}\""
+
+    if field_type == Field_Type_Float_Array:
+        return f"[{', '.join(f'{v}' for v in value)}]"
+
+    return f"{value}"
+
+# Text format of the .entity files. The first block is the Entity part of the entity, which
+# has no name.
+def BlocksToText(blocks : EntityBlocks) -> str:
+    lines = []
+    for block_name, block_index, fields in blocks:
+        if len(block_name) == 0:
+            lines.append(f"{block_index}:\n")
+        else:
+            lines.append(f"@{block_name} {block_index}:\n")
+
+        for name, index, field_type, value in fields:
+            lines.append(f"  @{name} {index}: {FormatFieldValue(field_type, value)}\n")
+
+    return "".join(lines)
+
 class Entity:
     def __init__(self):
         import uuid
@@ -36,33 +80,30 @@ class Entity:
         self.parent : Entity = None
         self.world_transform  = mathutils.Matrix.Identity(4)
 
-    def WriteToFile(self, file):
+    def Blocks(self) -> EntityBlocks:
         local_transform = self.world_transform
         if self.parent is not None:
             local_transform = self.parent.world_transform.inverted() @ local_transform
 
         local_position, local_rotation, local_scale = local_transform.decompose()
 
-        fw = file.write
-        fw(f"1:\n")
-        fw(f"  @guid 1: 0x{self.guid}\n")
-        fw(f"  @name 2: \"{self.name}\"\n")
-        fw(f"  @local_position 3: [{local_position.x}, {local_position.y}, {local_position.z}]\n")
-        fw(f"  @local_rotation 4: [{local_rotation.x}, {local_rotation.y}, {local_rotation.z}, {local_rotation.w}]\n")
-        fw(f"  @local_scale 5: [{local_scale.x}, {local_scale.y}, {local_scale.z}]\n")
-        if self.parent is not None:
-            fw(f"  @parent 6: 0x{self.parent.guid}\n")
-        else:
-            fw(f"  @parent 6: 0x00000000000000000000000000000000\n")
+        return [("", 1, [
+            ("guid", 1, Field_Type_Guid, self.guid),
+            ("name", 2, Field_Type_String, self.name),
+            ("local_position", 3, Field_Type_Float_Array, (local_position.x, local_position.y, local_position.z)),
+            ("local_rotation", 4, Field_Type_Float_Array, (local_rotation.x, local_rotation.y, local_rotation.z, local_rotation.w)),
+            ("local_scale", 5, Field_Type_Float_Array, (local_scale.x, local_scale.y, local_scale.z)),
+            ("parent", 6, Field_Type_Guid, self.parent.guid if self.parent is not None else "00000000000000000000000000000000"),
+        ])]
+
+    def WriteToFile(self, file):
+        file.write(BlocksToText(self.Blocks()))
 
 class EmptyEntity(Entity):
     def __init__(self):
         super().__init__()
         self.type = 'EmptyEntity'
 
-    def WriteToFile(self, file):
-        super().WriteToFile(file)
-
 class StaticMeshEntity(Entity):
     def __init__(self):
         super().__init__()
@@ -71,20 +112,49 @@ class StaticMeshEntity(Entity):
         self.material_name : str = ""
         self.cast_shadows : bool = True
 
-    def WriteToFile(self, file):
-        super().WriteToFile(file)
+    def Blocks(self) -> EntityBlocks:
+        fields = []
+
+        if len(self.mesh_name) > 0:
+            fields.append(("mesh", 2, Field_Type_String, self.mesh_name))
+
+        if len(self.material_name) > 0:
+            fields.append(("material", 3, Field_Type_String, self.material_name))
 
-        fw = file.write
+        fields.append(("cast_shadows", 4, Field_Type_Bool, self.cast_shadows))
 
-        fw(f"@mesh 2:\n")
+        return super().Blocks() + [("mesh", 2, fields)]
+
+# Many instances of the same mesh drawn at once, the transforms of the instances are relative
+# to the entity and are written as a flat array of position, rotation and scale values
+class InstancedMeshEntity(Entity):
+    def __init__(self):
+        super().__init__()
+        self.type = 'InstancedMeshEntity'
+        self.mesh_name : str = ""
+        self.material_name : str = ""
+        self.cast_shadows : bool = True
+        self.instance_transforms : List[mathutils.Matrix] = []
+
+    def Blocks(self) -> EntityBlocks:
+        fields = []
 
         if len(self.mesh_name) > 0:
-            fw(f"  @mesh 2: \"{self.mesh_name}\"\n")
+            fields.append(("mesh", 2, Field_Type_String, self.mesh_name))
 
         if len(self.material_name) > 0:
-            fw(f"  @material 3: \"{self.material_name}\"\n")
+            fields.append(("material", 3, Field_Type_String, self.material_name))
+
+        fields.append(("cast_shadows", 4, Field_Type_Bool, self.cast_shadows))
 
-        fw(f"  @cast_shadows 4: {self.cast_shadows}\n")
+        values = []
+        for transform in self.instance_transforms:
+            position, rotation, scale = transform.decompose()
+            values.extend((position.x, position.y, position.z, rotation.x, rotation.y, rotation.z, rotation.w, scale.x, scale.y, scale.z))
+
+        fields.append(("transforms", 5, Field_Type_Float_Array, values))
+
+        return super().Blocks() + [("instances", 2, fields)]
 
 class PointLightEntity(Entity):
     def __init__(self):
@@ -94,14 +164,12 @@ class PointLightEntity(Entity):
         self.light_intensity : float = 1
         self.cast_shadows : bool = False
 
-    def WriteToFile(self, file):
-        super().WriteToFile(file)
-
-        fw = file.write
-        fw(f"@light 2:\n")
-        fw(f"  @color 2: [{self.light_color[0]}, {self.light_color[1]}, {self.light_color[2]}]\n")
-        fw(f"  @intensity 3: {self.light_intensity}\n")
-        fw(f"  @cast_shadows 4: {self.cast_shadows}\n")
+    def Blocks(self) -> EntityBlocks:
+        return super().Blocks() + [("light", 2, [
+            ("color", 2, Field_Type_Float_Array, (self.light_color[0], self.light_color[1], self.light_color[2])),
+            ("intensity", 3, Field_Type_Float, self.light_intensity),
+            ("cast_shadows", 4, Field_Type_Bool, self.cast_shadows),
+        ])]
 
 class DirectionalLightEntity(Entity):
     def __init__(self):
@@ -111,32 +179,83 @@ class DirectionalLightEntity(Entity):
         self.light_intensity : float = 1
         self.cast_shadows : bool = True
 
-    def WriteToFile(self, file):
-        super().WriteToFile(file)
-
-        fw = file.write
-        fw(f"@light 2:\n")
-        fw(f"  @color 2: [{self.light_color[0]}, {self.light_color[1]}, {self.light_color[2]}]\n")
-        fw(f"  @intensity 3: {self.light_intensity}\n")
-        fw(f"  @cast_shadows 4: {self.cast_shadows}\n")
-
-def EntityFromBlenderObject(
-    context : bpy.types.Context,
-    root: Entity,
-    all_entities : List[Entity],
-    obj : bpy.types.Object,
-    dest_coordinate_system : utils.CoordinateSystem
-):
+    def Blocks(self) -> EntityBlocks:
+        return super().Blocks() + [("light", 2, [
+            ("color", 2, Field_Type_Float_Array, (self.light_color[0], self.light_color[1], self.light_color[2])),
+            ("intensity", 3, Field_Type_Float, self.light_intensity),
+            ("cast_shadows", 4, Field_Type_Bool, self.cast_shadows),
+        ])]
+
+def IsValidGuid(guid) -> bool:
+    if not isinstance(guid, str) or len(guid) != 32:
+        return False
+
+    try:
+        int(guid, 16)
+    except ValueError:
+        return False
+
+    return True
+
+# GUID of the entity of an object. Objects linked from a library can't store their GUID,
+# so it is derived from the library and the name of the object.
+def ObjectGuid(obj : bpy.types.Object) -> str:
+    import uuid
+
+    guid = obj.get(Entity_Guid_Property)
+    if IsValidGuid(guid):
+        return guid
+
+    return uuid.uuid5(uuid.NAMESPACE_URL, f"{obj.library.filepath if obj.library is not None else ''}/{obj.name}").hex
+
+# Make sure the objects have a GUID, and that two objects don't have the same one (duplicating
+# an object copies its custom properties). When that happens the object whose name comes first,
+# which is usually the original, keeps its GUID.
+def AssignObjectGuids(objects : List[bpy.types.Object]):
+    import uuid
+
+    used_guids = set()
+    for obj in sorted(objects, key=lambda o: o.name):
+        guid = obj.get(Entity_Guid_Property)
+        if obj.library is None and (not IsValidGuid(guid) or guid in used_guids):
+            guid = uuid.uuid4().hex
+            obj[Entity_Guid_Property] = guid
+
+        used_guids.add(ObjectGuid(obj))
+
+# Order the objects so parents come before their children, otherwise the parent of an
+# object might not have an entity yet when we create the entity of the object
+def SortObjectsParentsFirst(objects : List[bpy.types.Object]) -> List[bpy.types.Object]:
+    remaining = set(objects)
+    result = []
+
+    for obj in objects:
+        ancestors = []
+        while obj is not None and obj in remaining:
+            remaining.remove(obj)
+            ancestors.append(obj)
+            obj = obj.parent
+
+        result.extend(reversed(ancestors))
+
+    return result
+
+# Create the entity of an object, without its parent and transform. Returns None if the
+# object type is not supported.
+def CreateEntity(context : bpy.types.Context, obj : bpy.types.Object) -> Entity:
     entity = None
 
     options = context.scene.vk_engine_entities_export_options
 
+    # The mesh file names depend on the options of the mesh exporter
+    mesh_options = context.scene.vk_engine_mesh_export_options
+
     if obj.type == 'EMPTY':
         entity = EmptyEntity()
     elif obj.type == 'MESH':
         mesh = obj.data
 
-        filename = os.path.basename(obj.name)
+        filename = os.path.basename(utils.MeshAssetName(obj, options.share_mesh_data, mesh_options.apply_object_transform))
         filename = f"{filename}.mesh"
         filename = os.path.join(bpy.path.abspath(options.meshes_directory), filename)
 
@@ -162,23 +281,201 @@ def EntityFromBlenderObject(
             entity.light_color = light.color
             entity.cast_shadows = light.use_shadow
 
-    if entity is not None:
-        for e in all_entities:
-            if e.blender_obj == obj.parent:
-                entity.parent = e
-                break
+    return entity
+
+# Objects must be visited parents first (see SortObjectsParentsFirst), entities_by_object
+# is used to find the entity of the parent of the object
+def EntityFromBlenderObject(
+    context : bpy.types.Context,
+    root: Entity,
+    all_entities : List[Entity],
+    entities_by_object : Dict[bpy.types.Object, Entity],
+    obj : bpy.types.Object,
+    dest_coordinate_system : utils.CoordinateSystem
+):
+    entity = CreateEntity(context, obj)
 
-        if entity.parent is None:
-            entity.parent = root
+    if entity is not None:
+        entity.parent = entities_by_object.get(obj.parent, root)
 
         entity.blender_obj = obj
+        entity.guid = ObjectGuid(obj)
         entity.name = obj.name
         entity.world_transform = obj.matrix_world @ dest_coordinate_system.ConversionMatrix().to_4x4()
 
         all_entities.append(entity)
+        entities_by_object[obj] = entity
+
+        if context.scene.vk_engine_entities_export_options.expand_collection_instances:
+            CollectionInstanceEntities(context, entity, all_entities, obj, obj.matrix_world, dest_coordinate_system)
 
     return entity
 
+# Create the entities of the objects of the collection instanced by an object, as children of
+# the entity of the instancing object. Their GUIDs are derived from the GUID of the parent and
+# the name of the object, since the same object can be instanced many times.
+def CollectionInstanceEntities(
+    context : bpy.types.Context,
+    instancer : Entity,
+    all_entities : List[Entity],
+    instancer_obj : bpy.types.Object,
+    instancer_matrix : mathutils.Matrix,
+    dest_coordinate_system : utils.CoordinateSystem
+):
+    import uuid
+
+    if instancer_obj.instance_type != 'COLLECTION' or instancer_obj.instance_collection is None:
+        return
+
+    collection = instancer_obj.instance_collection
+    instance_matrix = instancer_matrix @ mathutils.Matrix.Translation(-collection.instance_offset)
+
+    entities_by_object : Dict[bpy.types.Object, Entity] = {}
+    for obj in SortObjectsParentsFirst(list(collection.all_objects)):
+        entity = CreateEntity(context, obj)
+        if entity is None:
+            continue
+
+        world_matrix = instance_matrix @ obj.matrix_world
+
+        entity.parent = entities_by_object.get(obj.parent, instancer)
+        entity.blender_obj = obj
+        entity.guid = uuid.uuid5(uuid.UUID(instancer.guid), obj.name).hex
+        entity.name = f"{instancer.name}_{obj.name}"
+        entity.world_transform = world_matrix @ dest_coordinate_system.ConversionMatrix().to_4x4()
+
+        all_entities.append(entity)
+        entities_by_object[obj] = entity
+
+        CollectionInstanceEntities(context, entity, all_entities, obj, world_matrix, dest_coordinate_system)
+
+# Replace the static mesh entities that have the same mesh and material, and no children,
+# with a single instanced mesh entity per mesh. Returns the new list of entities.
+def MergeInstances(all_entities : List[Entity], root : Entity) -> List[Entity]:
+    import uuid
+
+    parents = set(id(e.parent) for e in all_entities if e.parent is not None)
+
+    groups : Dict[Tuple[str, str, bool], List[StaticMeshEntity]] = {}
+    for e in all_entities:
+        if isinstance(e, StaticMeshEntity) and id(e) not in parents:
+            groups.setdefault((e.mesh_name, e.material_name, e.cast_shadows), []).append(e)
+
+    merged = set()
+    result = []
+    for (mesh_name, material_name, cast_shadows), entities in groups.items():
+        if len(entities) < 2:
+            continue
+
+        instanced = InstancedMeshEntity()
+        instanced.guid = uuid.uuid5(uuid.NAMESPACE_URL, f"{mesh_name}/{material_name}/{cast_shadows}").hex
+        instanced.name = f"{os.path.splitext(os.path.basename(mesh_name))[0]}_Instances"
+        instanced.mesh_name = mesh_name
+        instanced.material_name = material_name
+        instanced.cast_shadows = cast_shadows
+        instanced.parent = root
+        instanced.blender_obj = entities[0].blender_obj
+        if root is not None:
+            instanced.world_transform = root.world_transform.copy()
+
+        to_local = instanced.world_transform.inverted()
+        instanced.instance_transforms = [to_local @ e.world_transform for e in entities]
+
+        merged.update(id(e) for e in entities)
+        result.append(instanced)
+
+    return [e for e in all_entities if id(e) not in merged] + result
+
+# Transform of an entity in the space of the scene, as the engine computes it from the local
+# transforms written in the entity files (the root entity is written with an identity transform)
+def SceneTransform(entity : Entity, root : Entity) -> mathutils.Matrix:
+    if root is None:
+        return entity.world_transform
+
+    return root.world_transform.inverted() @ entity.world_transform
+
+# Compute the scene space AABBs of the mesh entities from the bounds of their evaluated
+# objects, and build the BVH of the scene. Instanced mesh entities have an AABB per instance.
+def BuildSceneBVH(all_entities : List[Entity], root : Entity, dest_coordinate_system : utils.CoordinateSystem) -> scene_bvh.SceneBVH:
+    import numpy as np
+
+    # Meshes are exported in the destination coordinate system, see mesh.py
+    conversion = dest_coordinate_system.ConversionMatrix().to_4x4()
+
+    guids = []
+    instances = []
+    matrices = []
+    corners = []
+    for e in all_entities:
+        if not isinstance(e, (StaticMeshEntity, InstancedMeshEntity)) or e.blender_obj is None:
+            continue
+
+        bound_box = [tuple(corner) for corner in e.blender_obj.bound_box]
+        scene_transform = SceneTransform(e, root)
+
+        if isinstance(e, InstancedMeshEntity):
+            for i, transform in enumerate(e.instance_transforms):
+                guids.append(e.guid)
+                instances.append(i)
+                matrices.append(scene_transform @ transform @ conversion)
+                corners.append(bound_box)
+        else:
+            guids.append(e.guid)
+            instances.append(scene_bvh.No_Instance_Index)
+            matrices.append(scene_transform @ conversion)
+            corners.append(bound_box)
+
+    matrices = np.array([[tuple(row) for row in m] for m in matrices], dtype=np.float64).reshape(-1, 4, 4)
+    corners = np.array(corners, dtype=np.float64).reshape(-1, 8, 3)
+
+    world_corners = np.einsum("nij,nkj->nki", matrices[:, :3, :3], corners) + matrices[:, None, :3, 3]
+
+    return scene_bvh.SceneBVH.Build(guids, instances, world_corners.min(axis=1), world_corners.max(axis=1))
+
+# Write a file only if its content changed, so files that did not change keep their
+# modification time. Returns True if the file was written.
+def WriteFileIfChanged(filename : str, content : str) -> bool:
+    # Entity files always use LF line endings, whatever the platform, so they are compared
+    # without newline translation and written as is
+    try:
+        with open(filename, "r", newline='') as file:
+            if file.read() == content:
+                return False
+    except (OSError, UnicodeDecodeError):
+        pass
+
+    with open(filename, "w", newline='\n') as file:
+        file.write(content)
+
+    return True
+
+def WriteBinaryFileIfChanged(filename : str, content : bytes) -> bool:
+    try:
+        with open(filename, "rb") as file:
+            if file.read() == content:
+                return False
+    except OSError:
+        pass
+
+    with open(filename, "wb") as file:
+        file.write(content)
+
+    return True
+
+# Write the files (content by filename) using worker threads, since writing many small files
+# is dominated by the filesystem calls. Returns the number of files that were written.
+def WriteFiles(contents : Dict[str, Union[str, bytes]], worker_count : int) -> int:
+    import concurrent.futures
+
+    if worker_count <= 0:
+        worker_count = os.cpu_count() or 1
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=worker_count) as executor:
+        return sum(executor.map(
+            lambda item: WriteBinaryFileIfChanged(*item) if isinstance(item[1], bytes) else WriteFileIfChanged(*item),
+            contents.items()
+        ))
+
 class EntitiesExportOptions(bpy.types.PropertyGroup):
     only_selected : BoolProperty(
         name = "Only Selected",
@@ -230,6 +527,57 @@ class EntitiesExportOptions(bpy.types.PropertyGroup):
         default = True
     )
 
+    share_mesh_data : BoolProperty(
+        name = "Share Mesh Data",
+        description = "Reference the mesh files named after the mesh datablocks for the objects that can share them. This must match the Share Mesh Data option used when exporting the meshes.",
+        default = False
+    )
+
+    expand_collection_instances : BoolProperty(
+        name = "Expand Collection Instances",
+        description = "Create entities for the objects of the collections instanced by empties, as children of the entity of the empty.",
+        default = False
+    )
+
+    merge_instances : BoolProperty(
+        name = "Merge Instances",
+        description = "Replace the mesh entities that use the same mesh and material, and have no children, with a single instanced mesh entity holding all their transforms.",
+        default = False
+    )
+
+    output_format : EnumProperty(
+        name = "Output Format",
+        description = "How the entities are written.",
+        items = (
+            ("DIRECTORY", "Entity Files", "Write a .scene directory with one .entity text file per entity."),
+            ("ARCHIVE", "Packed Archive", "Write all the entities in a single binary .scenepack file."),
+        ),
+        default = "DIRECTORY"
+    )
+
+    entity_encoding : EnumProperty(
+        name = "Entity Encoding",
+        description = "Encoding of the .entity files. Both encodings have the same fields with the same indices.",
+        items = (
+            ("TEXT", "Text", "Write the fields as text."),
+            ("BINARY", "Binary", "Write the fields as binary, with floats as 32 bit floats and strings prefixed with their length."),
+        ),
+        default = "TEXT"
+    )
+
+    write_bvh : BoolProperty(
+        name = "Write BVH",
+        description = "Compute the world space AABBs of the mesh entities and write a bounding volume hierarchy of them in a .bvh file next to the scene.",
+        default = False
+    )
+
+    worker_count : IntProperty(
+        name = "Worker Threads",
+        description = "Number of threads used to write the entity files. If this is 0 one thread per CPU core is used.",
+        default = 0,
+        min = 0
+    )
+
 class EXPORTER_OT_VkEngineEntities(bpy.types.Operator):
     bl_idname = "export.vk_engine_scene"
     bl_label = "Export Vk-Engine scene (.scene)"
@@ -237,10 +585,16 @@ class EXPORTER_OT_VkEngineEntities(bpy.types.Operator):
     bl_options = {'REGISTER', 'UNDO'}
 
     def execute(self, context : bpy.types.Context):
+        import time
+        import uuid
+
         context.window.cursor_set('WAIT')
 
         options = context.scene.vk_engine_entities_export_options
 
+        timings : Dict[str, float] = {}
+        start = time.perf_counter()
+
         objects : List[bpy.types.Object] = []
         if options.only_selected:
             objects = context.selected_objects
@@ -248,6 +602,7 @@ class EXPORTER_OT_VkEngineEntities(bpy.types.Operator):
             objects = context.scene.objects
 
         all_entities : List[Entity] = []
+        entities_by_object : Dict[bpy.types.Object, Entity] = {}
 
         dest_coordinate_system = utils.CoordinateSystem.FromString(options.coordinate_system)
 
@@ -256,39 +611,114 @@ class EXPORTER_OT_VkEngineEntities(bpy.types.Operator):
             root = EmptyEntity()
             root.world_transform = dest_coordinate_system.ConversionMatrix().to_4x4()
             root.name = f"{os.path.splitext(os.path.basename(context.blend_data.filepath))[0]}_Root"
+            root.guid = uuid.uuid5(uuid.NAMESPACE_URL, root.name).hex
             all_entities.append(root)
 
-        for obj in objects:
-            entity = EntityFromBlenderObject(context, root, all_entities, obj, dest_coordinate_system)
+        AssignObjectGuids(objects)
+
+        for obj in SortObjectsParentsFirst(objects):
+            entity = EntityFromBlenderObject(context, root, all_entities, entities_by_object, obj, dest_coordinate_system)
+
+        mesh_entities = [e for e in all_entities if isinstance(e, StaticMeshEntity)]
+        mesh_file_count = len(set(e.mesh_name for e in mesh_entities))
+        print(f"{len(mesh_entities)} mesh entities use {mesh_file_count} mesh file(s) ({len(mesh_entities) - mesh_file_count} file(s) saved by sharing)")
+
+        if options.merge_instances:
+            entity_count = len(all_entities)
+            all_entities = MergeInstances(all_entities, root)
+            instanced_count = sum(isinstance(e, InstancedMeshEntity) for e in all_entities)
+            merged_count = entity_count - len(all_entities) + instanced_count
+            print(f"{merged_count} mesh entities merged into {instanced_count} instanced mesh entities ({merged_count - instanced_count} draw(s) saved)")
+
+        timings["gather"] = time.perf_counter() - start
+        start = time.perf_counter()
 
         scene_name = os.path.splitext(os.path.basename(context.blend_data.filepath))[0]
-        output_dir = f"{scene_name}.scene"
-        output_dir = os.path.join(bpy.path.abspath(options.output_directory), output_dir)
 
-        try:
-            for f in os.listdir(output_dir):
-                os.remove(os.path.join(output_dir, f))
-        except:
-            pass
+        if options.write_bvh:
+            bvh = BuildSceneBVH(all_entities, root, dest_coordinate_system)
+            bvh_filename = os.path.join(bpy.path.abspath(options.output_directory), f"{scene_name}.bvh")
 
-        os.makedirs(output_dir, exist_ok=True)
+            os.makedirs(os.path.dirname(bvh_filename), exist_ok=True)
+            WriteBinaryFileIfChanged(bvh_filename, bvh.ToBytes())
 
+            timings["bvh"] = time.perf_counter() - start
+            start = time.perf_counter()
+
+            print(f"Wrote BVH of {len(bvh.items)} mesh AABBs ({len(bvh.nodes)} nodes) to {bvh_filename}")
+
+        all_blocks : List[EntityBlocks] = []
         for e in all_entities:
+            # Hack: we need the transform of the root entity to be identity
+            # when writing to the file, but we need it to be the same as the
+            # coordinate system conversion matrix when computing the children's
+            # local transform
+            if e is root:
+                prev_transform = e.world_transform
+                e.world_transform = mathutils.Matrix.Identity(4)
+
+            all_blocks.append(e.Blocks())
+
+            if e is root:
+                e.world_transform = prev_transform
+
+        if options.output_format == "ARCHIVE":
+            output_filename = os.path.join(bpy.path.abspath(options.output_directory), f"{scene_name}.scenepack")
+            content = scene_archive.PackSceneArchive([(e.guid, e.type, blocks) for e, blocks in zip(all_entities, all_blocks)])
+
+            timings["format"] = time.perf_counter() - start
+            start = time.perf_counter()
+
+            os.makedirs(os.path.dirname(output_filename), exist_ok=True)
+            written = WriteBinaryFileIfChanged(output_filename, content)
+
+            timings["write"] = time.perf_counter() - start
+
+            timings_string = ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in timings.items())
+            print(f"Exported {len(all_entities)} entities to {output_filename} ({len(content)} bytes, {'written' if written else 'unchanged'}, {timings_string})")
+
+            context.window.cursor_set('DEFAULT')
+
+            return {'FINISHED'}
+
+        output_dir = f"{scene_name}.scene"
+        output_dir = os.path.join(bpy.path.abspath(options.output_directory), output_dir)
+
+        # Format all the files in memory first, they are written all at once below
+        contents : Dict[str, Union[str, bytes]] = {}
+        for e, blocks in zip(all_entities, all_blocks):
             filename = f"{e.guid}_{e.type}.entity"
             filename = os.path.join(output_dir, filename)
-            with open(filename, "w", newline='\n') as file:
-                # Hack: we need the transform of the root entity to be identity
-                # when writing to the file, but we need it to be the same as the
-                # coordinate system conversion matrix when computing the children's
-                # local transform
-                if e is root:
-                    prev_transform = e.world_transform
-                    e.world_transform = mathutils.Matrix.Identity(4)
+            if options.entity_encoding == "BINARY":
+                contents[filename] = entity_binary.EncodeEntity(blocks)
+            else:
+                contents[filename] = BlocksToText(blocks)
+
+        timings["format"] = time.perf_counter() - start
+        start = time.perf_counter()
+
+        os.makedirs(output_dir, exist_ok=True)
+
+        # Remove the files of the entities that are not part of the scene anymore
+        removed_count = 0
+        for f in os.listdir(output_dir):
+            filename = os.path.join(output_dir, f)
+            if filename not in contents:
+                try:
+                    os.remove(filename)
+                    removed_count += 1
+                except OSError:
+                    pass
+
+        timings["cleanup"] = time.perf_counter() - start
+        start = time.perf_counter()
+
+        written_count = WriteFiles(contents, options.worker_count)
 
-                e.WriteToFile(file)
+        timings["write"] = time.perf_counter() - start
 
-                if e is root:
-                    e.world_transform = prev_transform
+        timings_string = ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in timings.items())
+        print(f"Exported {len(all_entities)} entities to {output_dir}: {written_count} file(s) written, {len(contents) - written_count} unchanged, {removed_count} removed ({timings_string})")
 
         context.window.cursor_set('DEFAULT')
 
@@ -312,6 +742,13 @@ class VIEW3D_PT_VkEngineEntitiesExport(bpy.types.Panel):
         layout.row().prop(options, "textures_directory")
         layout.row().prop(options, "materials_directory")
         layout.row().prop(options, "create_empty_root_entity")
+        layout.row().prop(options, "share_mesh_data")
+        layout.row().prop(options, "expand_collection_instances")
+        layout.row().prop(options, "merge_instances")
+        layout.row().prop(options, "output_format")
+        layout.row().prop(options, "entity_encoding")
+        layout.row().prop(options, "write_bvh")
+        layout.row().prop(options, "worker_count")
 
         valid = options.output_directory != "" and options.meshes_directory != "" and options.textures_directory != "" and options.materials_directory != ""
 
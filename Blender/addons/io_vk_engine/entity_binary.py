@@ -0,0 +1,121 @@
+# This file contains the binary encoding of the .entity files. It stores the same blocks and
+# fields as the text format, tagged with the same indices, so fields can be added, removed or
+# reordered the same way. Nothing in here touches bpy.
+#
+# Layout (little endian):
+#   header: magic (8 bytes), version u32, block count u32
+#   block:  index u16, field count u16, size in bytes of the fields u32, then the fields
+#   field:  index u16, type u8, then the value
+#
+# Values are a 16 bytes guid, a string as a u32 length followed by UTF-8 data, a u8 bool,
+# a f32 or a u32 count followed by that many f32. Field names are not stored, the indices
+# identify the fields. Blocks and fields with an unknown index can be skipped using the
+# block size and the field type.
+
+import struct
+
+from typing import (
+    List,
+    Tuple
+)
+
+from .scene_archive import (
+    EntityBlocks,
+    Field_Type_Guid,
+    Field_Type_String,
+    Field_Type_Bool,
+    Field_Type_Float,
+    Field_Type_Float_Array,
+)
+
+Entity_Binary_Magic = b"VKENTITY"
+Entity_Binary_Version = 10000
+
+Header_Struct = struct.Struct("<8s2I")
+Block_Struct = struct.Struct("<2HI")
+Field_Struct = struct.Struct("<HB")
+Guid_Field_Struct = struct.Struct("<HB16s")
+Bool_Field_Struct = struct.Struct("<HBB")
+Float_Field_Struct = struct.Struct("<HBf")
+Count_Field_Struct = struct.Struct("<HBI")
+
+def EncodeFields(fields) -> bytes:
+    parts = []
+    for name, index, field_type, value in fields:
+        if field_type == Field_Type_Guid:
+            parts.append(Guid_Field_Struct.pack(index, field_type, bytes.fromhex(value)))
+        elif field_type == Field_Type_String:
+            encoded = value.encode("utf-8")
+            parts.append(Count_Field_Struct.pack(index, field_type, len(encoded)))
+            parts.append(encoded)
+        elif field_type == Field_Type_Bool:
+            parts.append(Bool_Field_Struct.pack(index, field_type, 1 if value else 0))
+        elif field_type == Field_Type_Float:
+            parts.append(Float_Field_Struct.pack(index, field_type, value))
+        elif field_type == Field_Type_Float_Array:
+            parts.append(Count_Field_Struct.pack(index, field_type, len(value)))
+            parts.append(struct.pack(f"<{len(value)}f", *value))
+        else:
+            raise Exception(f"Unknown field type {field_type} for field {name}")
+
+    return b"".join(parts)
+
+def EncodeEntity(blocks : EntityBlocks) -> bytes:
+    parts = [Header_Struct.pack(Entity_Binary_Magic, Entity_Binary_Version, len(blocks))]
+    for block_name, block_index, fields in blocks:
+        encoded = EncodeFields(fields)
+        parts.append(Block_Struct.pack(block_index, len(fields), len(encoded)))
+        parts.append(encoded)
+
+    return b"".join(parts)
+
+# Returns the blocks of an encoded entity as (index, fields), with fields as (index, type, value)
+def DecodeEntity(data : bytes) -> List[Tuple[int, List[Tuple[int, int, object]]]]:
+    magic, version, block_count = Header_Struct.unpack_from(data, 0)
+    if magic != Entity_Binary_Magic:
+        raise Exception("Not a binary entity file")
+
+    if version != Entity_Binary_Version:
+        raise Exception(f"Unsupported binary entity version {version}, expected {Entity_Binary_Version}")
+
+    position = Header_Struct.size
+    blocks = []
+    for _ in range(block_count):
+        block_index, field_count, size = Block_Struct.unpack_from(data, position)
+        position += Block_Struct.size
+        block_end = position + size
+
+        fields = []
+        for _ in range(field_count):
+            index, field_type = Field_Struct.unpack_from(data, position)
+            position += Field_Struct.size
+
+            if field_type == Field_Type_Guid:
+                value = bytes(data[position:position + 16]).hex()
+                position += 16
+            elif field_type == Field_Type_String:
+                length, = struct.unpack_from("<I", data, position)
+                value = bytes(data[position + 4:position + 4 + length]).decode("utf-8")
+                position += 4 + length
+            elif field_type == Field_Type_Bool:
+                value = data[position] != 0
+                position += 1
+            elif field_type == Field_Type_Float:
+                value, = struct.unpack_from("<f", data, position)
+                position += 4
+            elif field_type == Field_Type_Float_Array:
+                count, = struct.unpack_from("<I", data, position)
+                value = struct.unpack_from(f"<{count}f", data, position + 4)
+                position += 4 + count * 4
+            else:
+                # The size of a field of an unknown type is unknown, skip the rest of the block
+                print(f"WARNING: Unknown field type {field_type} for field {index}, skipping the rest of block {block_index}")
+                break
+
+            fields.append((index, field_type, value))
+
+        position = block_end
+
+        blocks.append((block_index, fields))
+
+    return blocks
@@ -1,6 +1,6 @@
 import bpy
-import bmesh
 import mathutils
+import numpy as np
 
 from typing import (
     List,
@@ -10,6 +10,7 @@ from typing import (
 
 from bpy.props import (
     IntProperty,
+    FloatProperty,
     BoolProperty,
     EnumProperty,
     StringProperty,
@@ -17,6 +18,205 @@ from bpy.props import (
 )
 
 from . import utils
+from . import mesh_optimization
+
+# Vertex layouts of the .mesh files, these need to match StaticVertex and SkinnedVertex in the engine
+Static_Vertex_Dtype = np.dtype([
+    ("position", "<f4", 3),
+    ("normal", "<f4", 3),
+    ("tangent", "<f4", 4),
+    ("tex_coords", "<f4", 2),
+])
+
+Skinned_Vertex_Dtype = np.dtype(Static_Vertex_Dtype.descr + [
+    ("joint_ids", "<i2", 4),
+    ("joint_weights", "<f4", 3),
+])
+
+# Quantized vertex layouts, used when Mesh_Flag_Quantized_Vertices is set. Positions are
+# unorm16 relative to the bounding box of the mesh, normals and tangents are octahedral
+# encoded snorm16, texture coordinates are half floats and joint weights are unorm8.
+Quantized_Static_Vertex_Dtype = np.dtype([
+    ("position", "<u2", 3),
+    ("bitangent_sign", "<i2"),
+    ("normal", "<i2", 2),
+    ("tangent", "<i2", 2),
+    ("tex_coords", "<f2", 2),
+])
+
+Quantized_Skinned_Vertex_Dtype = np.dtype(Quantized_Static_Vertex_Dtype.descr + [
+    ("joint_ids", "<i2", 4),
+    ("joint_weights", "u1", 4),
+])
+
+Mesh_Version = 10000
+# Files using features that older readers can't skip (quantized vertices, 16 bit indices)
+# get a new version, so they are rejected instead of being read incorrectly
+Mesh_Version_Extended = 10100
+
+# These need to match MeshFileFlags in the engine
+Mesh_Flag_Has_Tangents = 0x1
+Mesh_Flag_Has_Octree = 0x2
+# Optional sections appended at the end of the file, in the order of their flags. Each
+# section starts with its version and its size in bytes so readers that do not know
+# about it can skip it.
+Mesh_Flag_Has_Meshlets = 0x4
+Mesh_Flag_Quantized_Vertices = 0x8
+# Indices are 16 bit and relative to the base vertex of their submesh. The submeshes are
+# written after the triangle count (see mesh_optimization.Submesh_Dtype), and the index
+# buffer is padded to 4 bytes.
+Mesh_Flag_16_Bit_Indices = 0x10
+
+Meshlet_Section_Version = 10000
+
+# Bounds of the mesh so the engine does not need to go through the vertices when loading,
+# computed from the vertices as they are stored: the AABB min and max, the bounding sphere
+# center and radius (f32), the joint count (u32) and the bounds of each joint (see
+# mesh_optimization.Joint_Bounds_Dtype)
+Mesh_Flag_Has_Bounds = 0x20
+
+Bounds_Section_Version = 10000
+
+# Octahedral encoding of unit vectors (Cigolle et al., A Survey of Efficient
+# Representations for Independent Unit Vectors, 2014) as snorm16 pairs
+def OctahedralEncode(vectors : np.ndarray) -> np.ndarray:
+    vectors = vectors.astype(np.float64)
+    lengths = np.abs(vectors).sum(axis=1)
+    lengths[lengths == 0] = 1
+
+    n = vectors / lengths[:, None]
+    xy = n[:, :2].copy()
+
+    lower = n[:, 2] < 0
+    signs = np.where(xy[lower] >= 0, 1.0, -1.0)
+    xy[lower] = (1 - np.abs(xy[lower][:, ::-1])) * signs
+
+    return np.round(np.clip(xy, -1, 1) * 32767).astype(np.int16)
+
+def OctahedralDecode(encoded : np.ndarray) -> np.ndarray:
+    xy = encoded.astype(np.float64) / 32767
+    z = 1 - np.abs(xy).sum(axis=1)
+    t = np.clip(-z, 0, 1)
+
+    xy -= np.where(xy >= 0, t[:, None], -t[:, None])
+
+    result = np.concatenate([xy, z[:, None]], axis=1)
+
+    return result / np.linalg.norm(result, axis=1)[:, None]
+
+# Returns the quantized vertices, and the offset and scale to apply to the quantized positions
+# to get the original positions back
+def QuantizeVertices(verts : np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    skinned = "joint_ids" in verts.dtype.names
+    result = np.zeros(len(verts), dtype=Quantized_Skinned_Vertex_Dtype if skinned else Quantized_Static_Vertex_Dtype)
+
+    positions = verts["position"].astype(np.float64)
+    if len(verts) > 0:
+        position_min = positions.min(axis=0)
+        position_scale = (positions.max(axis=0) - position_min) / 65535
+    else:
+        position_min = np.zeros(3)
+        position_scale = np.zeros(3)
+
+    safe_scale = np.where(position_scale > 0, position_scale, 1)
+    result["position"] = np.round(np.clip((positions - position_min) / safe_scale, 0, 65535))
+
+    result["normal"] = OctahedralEncode(verts["normal"])
+    result["tangent"] = OctahedralEncode(verts["tangent"][:, :3])
+    result["bitangent_sign"] = np.sign(verts["tangent"][:, 3])
+    result["tex_coords"] = verts["tex_coords"]
+
+    if skinned:
+        result["joint_ids"] = verts["joint_ids"]
+        result["joint_weights"][:, :3] = np.round(np.clip(verts["joint_weights"], 0, 1) * 255)
+
+    return result, position_min.astype(np.float32), position_scale.astype(np.float32)
+
+def DequantizeVertices(quantized : np.ndarray, position_min : np.ndarray, position_scale : np.ndarray) -> np.ndarray:
+    skinned = "joint_ids" in quantized.dtype.names
+    result = np.zeros(len(quantized), dtype=Skinned_Vertex_Dtype if skinned else Static_Vertex_Dtype)
+
+    result["position"] = position_min + quantized["position"].astype(np.float32) * position_scale
+    result["normal"] = OctahedralDecode(quantized["normal"])
+    result["tangent"][:, :3] = OctahedralDecode(quantized["tangent"])
+    result["tangent"][:, 3] = quantized["bitangent_sign"]
+    result["tex_coords"] = quantized["tex_coords"]
+
+    if skinned:
+        result["joint_ids"] = quantized["joint_ids"]
+        result["joint_weights"] = quantized["joint_weights"][:, :3] / 255
+
+    return result
+
+# Maximum error of each attribute after a quantization round trip
+def QuantizationErrors(verts : np.ndarray) -> Dict[str, float]:
+    quantized, position_min, position_scale = QuantizeVertices(verts)
+    dequantized = DequantizeVertices(quantized, position_min, position_scale)
+
+    # atan2 of the cross and dot products stays accurate for small angles, unlike acos
+    def MaxAngle(a : np.ndarray, b : np.ndarray) -> float:
+        a = a.astype(np.float64)
+        b = b.astype(np.float64)
+
+        valid = (np.linalg.norm(a, axis=1) > 0) & (np.linalg.norm(b, axis=1) > 0)
+        if not valid.any():
+            return 0
+
+        a = a[valid]
+        b = b[valid]
+        sines = np.linalg.norm(np.cross(a, b), axis=1)
+        cosines = np.einsum("ij,ij->i", a, b)
+
+        return float(np.degrees(np.arctan2(sines, cosines)).max())
+
+    def MaxDifference(a : np.ndarray, b : np.ndarray) -> float:
+        if len(a) == 0:
+            return 0
+
+        return float(np.abs(a.astype(np.float64) - b).max())
+
+    result = {
+        "position" : MaxDifference(verts["position"], dequantized["position"]),
+        "normal (deg)" : MaxAngle(verts["normal"], dequantized["normal"]),
+        "tangent (deg)" : MaxAngle(verts["tangent"][:, :3], dequantized["tangent"][:, :3]),
+        "tex_coords" : MaxDifference(verts["tex_coords"], dequantized["tex_coords"]),
+    }
+
+    if "joint_weights" in verts.dtype.names:
+        result["joint_weights"] = MaxDifference(verts["joint_weights"], dequantized["joint_weights"])
+
+    return result
+
+# Get a packed array of vertices in the given layout, filling missing fields with zeros
+def ConvertVertices(verts : np.ndarray, dtype : np.dtype) -> np.ndarray:
+    if verts.dtype == dtype:
+        return np.ascontiguousarray(verts)
+
+    result = np.zeros(len(verts), dtype=dtype)
+    for name in dtype.names:
+        if name in verts.dtype.names:
+            result[name] = verts[name]
+
+    return result
+
+def MatrixToArray(matrix : mathutils.Matrix) -> np.ndarray:
+    return np.array([tuple(row) for row in matrix], dtype=np.float32)
+
+# Transform an array of 3D vectors by a 4x4 matrix, the same way mathutils does for
+# Matrix @ Vector (w is 1, each product is done in single precision and accumulated
+# in double precision), so we get exactly the same results as the per vertex path
+def TransformVectors(matrix : np.ndarray, vectors : np.ndarray) -> np.ndarray:
+    result = np.empty((len(vectors), 3), dtype=np.float32)
+
+    for row in range(3):
+        dot = np.zeros(len(vectors), dtype=np.float64)
+        for col in range(3):
+            dot += matrix[row, col] * vectors[:, col]
+        dot += matrix[row, 3]
+
+        result[:, row] = dot
+
+    return result
 
 class ArmatureJoint:
     def __init__(
@@ -33,65 +233,211 @@ class ArmatureJoint:
         self.local_orientation = local_orientation
         self.local_scale = local_scale
 
-class Vertex:
-    def __init__(
-        self,
-        position : utils.Vec3f,
-        normal   : utils.Vec3f,
-        tangent  : utils.Vec4f,
-        tex_coords : utils.Vec2f,
-        joint_ids : utils.Vec4i,
-        joint_weights : utils.Vec3f,
-    ):
-        self.position = position
-        self.normal = normal
-        self.tangent = tangent
-        self.tex_coords = tex_coords
-        self.joint_ids = joint_ids
-        self.joint_weights = joint_weights
-
-    def __hash__(self):
-        return hash((self.position, self.normal, self.tangent, self.tex_coords, self.joint_ids, self.joint_weights))
-
-    def __eq__(a, b):
-        return a.position == b.position and a.normal == b.normal and a.tangent == b.tangent and a.tex_coords == b.tex_coords and a.joint_ids == b.joint_ids and a.joint_weights == b.joint_weights
-
 class Mesh:
     def __init__(self, has_tangents : bool):
         self.name_to_joint_id : Dict[str, int] = {}
         self.joints : List[ArmatureJoint] = []
-        self.verts : List[Vertex] = []
-        self.tris : List[Tuple[int, int, int]] = []
+        self.verts : np.ndarray = np.zeros(0, dtype=Static_Vertex_Dtype)
+        self.tris : np.ndarray = np.zeros((0, 3), dtype=np.uint32)
         self.has_tangents = has_tangents
+        self.quantize_vertices = False
+        self.write_bounds = False
+        # Set when the mesh uses 16 bit indices
+        self.submeshes : np.ndarray = None
+
+        # See mesh_optimization.BuildMeshlets
+        self.meshlets : np.ndarray = None
+        self.meshlet_vertices : np.ndarray = None
+        self.meshlet_triangles : np.ndarray = None
+
+    def Flags(self) -> int:
+        flags = 0
+        if self.has_tangents:
+            flags |= Mesh_Flag_Has_Tangents
+        if self.meshlets is not None:
+            flags |= Mesh_Flag_Has_Meshlets
+        if self.quantize_vertices:
+            flags |= Mesh_Flag_Quantized_Vertices
+        if self.submeshes is not None:
+            flags |= Mesh_Flag_16_Bit_Indices
+        if self.write_bounds:
+            flags |= Mesh_Flag_Has_Bounds
+
+        return flags
+
+    def FileVersion(self) -> int:
+        if self.quantize_vertices or self.submeshes is not None:
+            return Mesh_Version_Extended
+
+        return Mesh_Version
+
+    # Use 16 bit indices if the mesh can be split in at most max_submeshes submeshes of
+    # 65536 vertices. Returns False if the mesh is too big and keeps 32 bit indices.
+    def Use16BitIndices(self, max_submeshes : int = 1) -> bool:
+        if len(self.verts) <= 65536:
+            self.submeshes = np.zeros(1, dtype=mesh_optimization.Submesh_Dtype)
+            self.submeshes[0] = (0, len(self.tris), 0, len(self.verts))
+
+            return True
+
+        # A submesh has at most 65536 vertices, so we know we would need too many of them
+        if len(self.verts) > 65536 * max_submeshes:
+            return False
+
+        vertex_order, tris, submeshes = mesh_optimization.SplitSubmeshes(self.tris)
+        if len(submeshes) > max_submeshes:
+            return False
+
+        self.verts = self.verts[vertex_order]
+        self.tris = tris
+        self.submeshes = submeshes
+
+        return True
+
+    def WriteHeader(self, file):
+        import struct
 
-    def WriteBinarySkinned(self, filename : str):
+        fw = file.write
+
+        fw(struct.pack("<I", self.FileVersion()))
+        fw(struct.pack("<I", self.Flags()))
+
+        fw(struct.pack("<I", len(self.verts)))
+        fw(struct.pack("<I", len(self.tris)))
+
+        if self.submeshes is not None:
+            fw(struct.pack("<I", len(self.submeshes)))
+            fw(self.submeshes.tobytes())
+
+    def WriteIndices(self, file):
+        fw = file.write
+
+        if self.submeshes is not None:
+            local_tris = np.empty(self.tris.shape, dtype="<u2")
+            for submesh in self.submeshes:
+                first = int(submesh["first_triangle"])
+                last = first + int(submesh["triangle_count"])
+                local_tris[first:last] = self.tris[first:last] - submesh["base_vertex"]
+
+            index_bytes = local_tris.tobytes()
+            fw(index_bytes)
+            fw(bytes(-len(index_bytes) % 4))
+        else:
+            fw(np.ascontiguousarray(self.tris, dtype="<u4").tobytes())
+
+    def WriteVertices(self, file, dtype : np.dtype):
+        fw = file.write
+
+        verts = ConvertVertices(self.verts, dtype)
+
+        if self.quantize_vertices:
+            quantized, position_min, position_scale = QuantizeVertices(verts)
+
+            fw(position_min.astype("<f4").tobytes())
+            fw(position_scale.astype("<f4").tobytes())
+            fw(quantized.tobytes())
+        else:
+            fw(verts.tobytes())
+
+    def WriteOptionalSections(self, file):
         import struct
 
-        with open(filename, "wb") as file:
-            fw = file.write
+        fw = file.write
 
-            fw(b"SKINNED_MESH")
-            fw(struct.pack("<I", 10000)) # File version
+        if self.meshlets is not None:
+            # Pad the triangles so the section stays 4 bytes aligned
+            triangle_bytes = self.meshlet_triangles.tobytes()
+            triangle_bytes += bytes(-len(triangle_bytes) % 4)
+
+            header = struct.pack(
+                "<IIII",
+                len(self.meshlets),
+                len(self.meshlet_vertices),
+                len(self.meshlet_triangles),
+                len(triangle_bytes)
+            )
 
-            flags = 0
-            if self.has_tangents:
-                flags |= 0x1
+            section_size = len(header) + self.meshlets.nbytes + self.meshlet_vertices.nbytes + len(triangle_bytes)
 
-            fw(struct.pack("<I", flags))
+            fw(struct.pack("<II", Meshlet_Section_Version, section_size))
+            fw(header)
+            fw(self.meshlets.tobytes())
+            fw(self.meshlet_vertices.astype("<u4").tobytes())
+            fw(triangle_bytes)
 
-            fw(struct.pack("<I", len(self.verts)))
-            fw(struct.pack("<I", len(self.tris)))
+        if self.write_bounds:
+            positions = self.DecodedVertices()["position"].astype(np.float64)
+
+            if len(positions) > 0:
+                aabb_min = positions.min(axis=0)
+                aabb_max = positions.max(axis=0)
+            else:
+                aabb_min = aabb_max = np.zeros(3)
 
-            for vert in self.verts:
-                fw(struct.pack("<fff", *vert.position))
-                fw(struct.pack("<fff", *vert.normal))
-                fw(struct.pack("<ffff", *vert.tangent))
-                fw(struct.pack("<ff", *vert.tex_coords))
-                fw(struct.pack("<hhhh", *vert.joint_ids))
-                fw(struct.pack("<fff", *vert.joint_weights))
+            # The radius is computed from the center as it is stored, and rounded up
+            center, _ = mesh_optimization.BoundingSphere(positions)
+            center = center.astype(np.float32)
+            radius = np.sqrt(((positions - center) ** 2).sum(axis=1).max()) if len(positions) > 0 else 0
+            radius = np.nextafter(np.float32(radius), np.float32(np.inf))
 
-            for tri in self.tris:
-                fw(struct.pack("<III", *tri))
+            joint_bounds = self.JointBounds()
+
+            header = struct.pack("<3f3f3ffI", *aabb_min, *aabb_max, *center, radius, len(joint_bounds))
+
+            section_size = len(header) + joint_bounds.nbytes
+
+            fw(struct.pack("<II", Bounds_Section_Version, section_size))
+            fw(header)
+            fw(joint_bounds.tobytes())
+
+    # Vertices as the engine reads them, bounds are computed from these so they contain the
+    # quantized vertices
+    def DecodedVertices(self) -> np.ndarray:
+        if self.quantize_vertices:
+            return DequantizeVertices(*QuantizeVertices(self.verts))
+
+        return self.verts
+
+    # Model space transforms of the joints in the bind pose
+    def JointBindMatrices(self) -> np.ndarray:
+        matrices = np.zeros((len(self.joints), 4, 4))
+        for i, joint in enumerate(self.joints):
+            x, y, z, w = joint.local_orientation
+            local = mathutils.Matrix.LocRotScale(
+                mathutils.Vector(joint.local_position),
+                mathutils.Quaternion((w, x, y, z)),
+                mathutils.Vector(joint.local_scale)
+            )
+            local = np.array([tuple(row) for row in local])
+
+            if joint.parent_id >= 0:
+                matrices[i] = matrices[joint.parent_id] @ local
+            else:
+                matrices[i] = local
+
+        return matrices
+
+    def JointBounds(self) -> np.ndarray:
+        if len(self.joints) == 0:
+            return np.zeros(0, dtype=mesh_optimization.Joint_Bounds_Dtype)
+
+        verts = self.DecodedVertices()
+
+        return mesh_optimization.ComputeJointBounds(
+            verts["position"], verts["joint_ids"], verts["joint_weights"], self.JointBindMatrices()
+        )
+
+    def WriteBinarySkinned(self, filename : str):
+        import struct
+
+        with open(filename, "wb") as file:
+            fw = file.write
+
+            fw(b"SKINNED_MESH")
+            self.WriteHeader(file)
+
+            self.WriteVertices(file, Skinned_Vertex_Dtype)
+            self.WriteIndices(file)
 
             fw(struct.pack("<h", len(self.joints)))
             for joint in self.joints:
@@ -103,6 +449,8 @@ class Mesh:
 
                 fw(struct.pack("<h", joint.parent_id))
 
+            self.WriteOptionalSections(file)
+
     def WriteBinaryStatic(self, filename : str):
         import struct
 
@@ -113,34 +461,62 @@ class Mesh:
             fw = file.write
 
             fw(b"STATIC_MESH")
-            fw(struct.pack("<I", 10000)) # File version
+            self.WriteHeader(file)
+
+            self.WriteVertices(file, Static_Vertex_Dtype)
+            self.WriteIndices(file)
+
+            self.WriteOptionalSections(file)
 
-            flags = 0
-            if self.has_tangents:
-                flags |= 0x1
+    def WriteBinary(self, filename : str):
+        if len(self.joints) == 0:
+            self.WriteBinaryStatic(filename)
+        else:
+            self.WriteBinarySkinned(filename)
+
+    def WeldCorners(self, corners : np.ndarray, reverse_triangle_ordering : bool, weld_epsilon : float = 0):
+        self.verts, corner_remap = WeldVertices(corners, weld_epsilon)
 
-            fw(struct.pack("<I", flags))
+        self.tris = corner_remap.reshape(-1, 3)
+        if reverse_triangle_ordering:
+            self.tris = self.tris[:, [0, 2, 1]]
 
-            fw(struct.pack("<I", len(self.verts)))
-            fw(struct.pack("<I", len(self.tris)))
+    # Reorder the triangles for the post-transform vertex cache, then
+    # reorder the vertices in the order they are used by the triangles
+    def OptimizeVertexCache(self):
+        self.tris = mesh_optimization.OptimizeVertexCache(self.tris, len(self.verts))
+        self.verts, self.tris = mesh_optimization.OptimizeVertexFetch(self.verts, self.tris)
 
-            for vert in self.verts:
-                fw(struct.pack("<fff", *vert.position))
-                fw(struct.pack("<fff", *vert.normal))
-                fw(struct.pack("<ffff", *vert.tangent))
-                fw(struct.pack("<ff", *vert.tex_coords))
+    def BuildMeshlets(self, max_vertices : int, max_triangles : int):
+        self.meshlets, self.meshlet_vertices, self.meshlet_triangles = mesh_optimization.BuildMeshlets(
+            self.tris, self.verts["position"], max_vertices, max_triangles
+        )
+
+        mesh_optimization.ComputeMeshletBounds(
+            self.meshlets, self.meshlet_vertices, self.meshlet_triangles, self.verts["position"]
+        )
+
+    def Simplified(self, target_triangle_count : int, max_error : float):
+        result = Mesh(self.has_tangents)
+        result.name_to_joint_id = self.name_to_joint_id
+        result.joints = self.joints
+
+        result.verts, result.tris, error = mesh_optimization.SimplifyMesh(
+            self.verts, self.tris, target_triangle_count, max_error
+        )
 
-            for tri in self.tris:
-                fw(struct.pack("<III", *tri))
+        return result, error
 
-    def FromMeshAndArmature(
+    # Gather all the data we need from Blender: returns the mesh with its armature data
+    # filled, and its unwelded corners (see ExtractCorners). Everything after this
+    # does not access bpy, so it can be done outside of the main thread.
+    def SnapshotMeshAndArmature(
         blender_obj : bpy.types.Object,
         blender_mesh : bpy.types.Mesh,
         blender_armature : bpy.types.Armature,
         apply_object_transform : bool,
         dest_coordinate_system : utils.CoordinateSystem,
         transform_matrix : mathutils.Matrix,
-        reverse_triangle_ordering : bool,
         export_tangents : bool
     ):
         transform = transform_matrix
@@ -213,95 +589,342 @@ class Mesh:
             for i, b in enumerate(result.joints):
                 result.name_to_joint_id.update({ b.name : i })
 
+        corners = ExtractCorners(
+            blender_obj, blender_mesh, blender_armature, result.name_to_joint_id,
+            transform, normal_transform, export_tangents
+        )
+
+        return result, corners
+
+# Gather the attributes of every triangle corner of the mesh in a Static_Vertex_Dtype or
+# Skinned_Vertex_Dtype array (if there is an armature), using bulk foreach_get reads
+# instead of going through each loop individually
+def ExtractCorners(
+    blender_obj : bpy.types.Object,
+    blender_mesh : bpy.types.Mesh,
+    blender_armature : bpy.types.Armature,
+    name_to_joint_id : Dict[str, int],
+    transform : mathutils.Matrix,
+    normal_transform : mathutils.Matrix,
+    export_tangents : bool
+) -> np.ndarray:
+    uv_layer = None
+    if blender_mesh.uv_layers.active is not None:
+        uv_layer = blender_mesh.uv_layers.active.data
+
+    if uv_layer is None:
+        raise Exception(f"Mesh has no UVs so it will not render properly in the engine, because we need UVs to calculate tangent information.")
+
+    vertex_count = len(blender_mesh.vertices)
+    loop_count = len(blender_mesh.loops)
+    corner_count = len(blender_mesh.loop_triangles) * 3
+
+    corner_vertices = np.empty(corner_count, dtype=np.int32)
+    blender_mesh.loop_triangles.foreach_get("vertices", corner_vertices)
+
+    corner_loops = np.empty(corner_count, dtype=np.int32)
+    blender_mesh.loop_triangles.foreach_get("loops", corner_loops)
+
+    positions = np.empty(vertex_count * 3, dtype=np.float32)
+    blender_mesh.vertices.foreach_get("co", positions)
+    positions = positions.reshape(-1, 3)
+
+    normals = np.empty(loop_count * 3, dtype=np.float32)
+    blender_mesh.loops.foreach_get("normal", normals)
+    normals = normals.reshape(-1, 3)
+
+    uvs = np.empty(loop_count * 2, dtype=np.float32)
+    uv_layer.foreach_get("uv", uvs)
+    uvs = uvs.reshape(-1, 2)
+
+    if blender_armature is not None:
+        result = np.zeros(corner_count, dtype=Skinned_Vertex_Dtype)
+    else:
+        result = np.zeros(corner_count, dtype=Static_Vertex_Dtype)
+
+    result["position"] = TransformVectors(MatrixToArray(transform), positions[corner_vertices])
+    result["normal"] = TransformVectors(MatrixToArray(normal_transform), normals[corner_loops])
+    result["tex_coords"] = uvs[corner_loops]
+
+    if export_tangents:
+        tangents = np.empty(loop_count * 3, dtype=np.float32)
+        blender_mesh.loops.foreach_get("tangent", tangents)
+        tangents = tangents.reshape(-1, 3)
+
+        # How should this be transformed based on the transform?
+        bitangent_signs = np.empty(loop_count, dtype=np.float32)
+        blender_mesh.loops.foreach_get("bitangent_sign", bitangent_signs)
+
+        result["tangent"][:, :3] = TransformVectors(MatrixToArray(normal_transform), tangents[corner_loops])
+        result["tangent"][:, 3] = bitangent_signs[corner_loops]
+
+    # Vertex groups can't be read in bulk, but there are a lot less vertices than
+    # corners so we fill the skinning data per vertex and then scatter it to the corners
+    joint_ids = np.full((vertex_count, 4), -1, dtype=np.int16)
+    joint_weights = np.zeros((vertex_count, 3), dtype=np.float32)
+
+    if len(blender_obj.vertex_groups) > 0:
         vert_group_names = { g.index : g.name for g in blender_obj.vertex_groups }
-        vertices_dict = {}
-        uv_layer = None
-        if blender_mesh.uv_layers.active is not None:
-            uv_layer = blender_mesh.uv_layers.active.data
 
-        if uv_layer is None:
-            raise Exception(f"Mesh has no UVs so it will not render properly in the engine, because we need UVs to calculate tangent information.")
+        for vert_index in np.unique(corner_vertices).tolist():
+            groups = blender_mesh.vertices[vert_index].groups
+            if len(groups) == 0:
+                continue
+
+            if blender_armature is None:
+                raise Exception("Mesh has vertices assigned to vertex groups, but we could not find an armature associated with it. Make sure it is parented to an armature, or it has a valid skin modifier.")
+
+            if len(groups) > 4:
+                raise Exception(f"Vertex has more than 4 groups assigned to it.")
+
+            for i, group in enumerate(groups):
+                name = vert_group_names[group.group]
+                if name not in name_to_joint_id:
+                    raise Exception(f"Vertex is assigned to group {name} but we could not find a deform bone with this name in the armature.")
+
+                joint_ids[vert_index, i] = name_to_joint_id[name]
+                if i < 3:
+                    joint_weights[vert_index, i] = round(group.weight, 6)
+
+    if blender_armature is not None:
+        result["joint_ids"] = joint_ids[corner_vertices]
+        result["joint_weights"] = joint_weights[corner_vertices]
+
+    return result
+
+# Merge identical corners into unique vertices. Returns the unique vertices, in order
+# of first appearance, and the index of the vertex each corner was merged into.
+# If epsilon is 0, corners are merged only if all their attributes are exactly equal,
+# otherwise float attributes are quantized to a grid of size epsilon before comparing.
+def WeldVertices(corners : np.ndarray, epsilon : float = 0) -> Tuple[np.ndarray, np.ndarray]:
+    if len(corners) == 0:
+        return corners.copy(), np.zeros(0, dtype=np.uint32)
+
+    key_fields = []
+    for name in corners.dtype.names:
+        field_dtype, _ = corners.dtype.fields[name]
+        if field_dtype.base.kind == 'f' and epsilon > 0:
+            key_fields.append((name, "<i8", field_dtype.shape))
+        else:
+            key_fields.append((name, field_dtype.base.str, field_dtype.shape))
+
+    keys = np.empty(len(corners), dtype=key_fields)
+    for name in corners.dtype.names:
+        if corners[name].dtype.kind != 'f':
+            keys[name] = corners[name]
+        elif epsilon > 0:
+            keys[name] = np.floor(corners[name] / epsilon + 0.5)
+        else:
+            # Adding 0 turns -0 into +0 so they compare equal, like floats do
+            keys[name] = corners[name] + np.float32(0)
+
+    keys = keys.view(np.dtype((np.void, keys.dtype.itemsize)))
+
+    _, first_indices, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    del keys
+
+    order = np.argsort(first_indices, kind="stable")
+    ranks = np.empty(len(order), dtype=np.uint32)
+    ranks[order] = np.arange(len(order), dtype=np.uint32)
+
+    return corners[first_indices[order]], ranks[inverse.ravel()]
+
+# Increment this whenever a change in the exporter changes the output for the same input,
+# so meshes exported with the previous version are not considered up to date
+Mesh_Export_Cache_Version = 2
+
+# Hash of everything that affects the exported file of an object, so we can skip
+# exporting objects that did not change since the last export
+def HashMeshInputs(
+    blender_obj : bpy.types.Object,
+    blender_mesh : bpy.types.Mesh,
+    blender_armature : bpy.types.Armature,
+    options_key : str
+) -> str:
+    import hashlib
+
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(bytes(f"{Mesh_Export_Cache_Version} {options_key}", 'UTF-8'))
+
+    def HashCollection(collection, attribute : str, dtype, components : int):
+        values = np.empty(len(collection) * components, dtype=dtype)
+        collection.foreach_get(attribute, values)
+        hasher.update(values.tobytes())
+
+    HashCollection(blender_mesh.vertices, "co", np.float32, 3)
+    HashCollection(blender_mesh.loops, "normal", np.float32, 3)
+    HashCollection(blender_mesh.loop_triangles, "vertices", np.int32, 3)
+    HashCollection(blender_mesh.loop_triangles, "loops", np.int32, 3)
+
+    if blender_mesh.uv_layers.active is not None:
+        HashCollection(blender_mesh.uv_layers.active.data, "uv", np.float32, 2)
+
+    if len(blender_obj.vertex_groups) > 0:
+        hasher.update(bytes(repr([g.name for g in blender_obj.vertex_groups]), 'UTF-8'))
+        hasher.update(bytes(repr([
+            [(g.group, g.weight) for g in v.groups]
+            for v in blender_mesh.vertices
+        ]), 'UTF-8'))
+
+    if blender_armature is not None:
+        hasher.update(bytes(repr([
+            (
+                b.name,
+                b.parent.name if b.parent is not None else "",
+                b.use_deform,
+                [tuple(row) for row in b.matrix_local]
+            )
+            for b in blender_armature.bones
+        ]), 'UTF-8'))
 
-        for i, poly in enumerate(blender_mesh.loop_triangles):
-            tri = []
+    return hasher.hexdigest()
 
-            for vert_index, loop_index in zip(poly.vertices, poly.loops):
-                position = blender_mesh.vertices[vert_index].co
-                position = transform @ position
+# Processing and writing of a single mesh, done on a worker thread
+# once the mesh data has been gathered from Blender
+class MeshExportJob:
+    def __init__(self, name : str, output_filename : str, mesh : Mesh, corners : np.ndarray):
+        self.name = name
+        self.content_hash = ""
+        self.output_filename = output_filename
+        self.written_filenames : List[str] = []
+        self.mesh = mesh
+        self.corners = corners
+        self.timings : Dict[str, float] = {}
+        self.report : List[str] = []
+
+    def AddTiming(self, name : str, start : float):
+        import time
+
+        self.timings[name] = self.timings.get(name, 0) + time.perf_counter() - start
 
-                normal = blender_mesh.loops[loop_index].normal
-                normal = normal_transform @ normal
+    def LodFilename(self, level : int) -> str:
+        import os
 
-                if export_tangents:
-                    tangent = blender_mesh.loops[loop_index].tangent
-                    tangent = normal_transform @ tangent
+        base, ext = os.path.splitext(self.output_filename)
 
-                    # How should this be transformed based on the transform?
-                    bitangent_sign = blender_mesh.loops[loop_index].bitangent_sign
+        return f"{base}_LOD{level}{ext}"
+
+    # This must not access bpy, since it is not thread safe
+    def Run(
+        self,
+        reverse_triangle_ordering : bool,
+        weld_epsilon : float,
+        optimize_vertex_cache : bool,
+        lod_count : int,
+        lod_ratio : float,
+        lod_max_error : float,
+        build_meshlets : bool,
+        meshlet_max_vertices : int,
+        meshlet_max_triangles : int,
+        quantize_vertices : bool,
+        use_16_bit_indices : bool,
+        max_16_bit_submeshes : int,
+        write_bounds : bool
+    ):
+        import os
+        import time
+
+        start = time.perf_counter()
+        self.mesh.WeldCorners(self.corners, reverse_triangle_ordering, weld_epsilon)
+        self.corners = None
+        self.AddTiming("weld", start)
+
+        outputs = [(self.mesh, self.output_filename)]
+
+        # Each LOD is simplified from the previous one, so the error we report is the sum
+        # of the errors of each level, which is an upper bound of the error relative to LOD0
+        lod = self.mesh
+        total_error = 0
+        for level in range(1, lod_count + 1):
+            start = time.perf_counter()
+            target_triangle_count = int(len(self.mesh.tris) * lod_ratio ** level)
+            lod, error = lod.Simplified(target_triangle_count, lod_max_error)
+            total_error += error
+            self.AddTiming("simplify", start)
+
+            self.report.append(f"LOD{level}: {len(lod.tris)} triangles ({len(lod.tris) / max(len(self.mesh.tris), 1) * 100:.1f}% of LOD0, target {target_triangle_count}), {len(lod.verts)} vertices, error {total_error * 100:.3f}%")
+
+            outputs.append((lod, self.LodFilename(level)))
+
+        for mesh, filename in outputs:
+            if optimize_vertex_cache:
+                acmr_before, atvr_before = mesh_optimization.VertexCacheStats(mesh.tris, len(mesh.verts))
+
+                start = time.perf_counter()
+                mesh.OptimizeVertexCache()
+                self.AddTiming("optimize", start)
+
+                acmr_after, atvr_after = mesh_optimization.VertexCacheStats(mesh.tris, len(mesh.verts))
+
+                self.report.append(f"{os.path.basename(filename)}: ACMR {acmr_before:.3f} -> {acmr_after:.3f}, ATVR {atvr_before:.3f} -> {atvr_after:.3f} (FIFO cache of {mesh_optimization.Vertex_Cache_Size} vertices)")
+
+            if use_16_bit_indices:
+                start = time.perf_counter()
+                if mesh.Use16BitIndices(max_16_bit_submeshes):
+                    self.report.append(f"{os.path.basename(filename)}: 16 bit indices, {len(mesh.submeshes)} submesh(es), {len(mesh.verts)} vertices, index buffer {len(mesh.tris) * 12} -> {len(mesh.tris) * 6} bytes")
                 else:
-                    tangent = mathutils.Vector((0, 0, 0))
-                    bitangent_sign = 0
-
-                uv_coords = (0,0)
-                if uv_layer is not None:
-                    uv_coords = uv_layer[loop_index].uv
-
-                groups = blender_mesh.vertices[vert_index].groups
-
-                if len(groups) != 0 and blender_armature is None:
-                    raise Exception("Mesh has vertices assigned to vertex groups, but we could not find an armature associated with it. Make sure it is parented to an armature, or it has a valid skin modifier.")
-
-                if len(groups) > 4:
-                    raise Exception(f"Vertex has more than 4 groups assigned to it.")
-
-                group_indices = [
-                    groups[i].group
-                    if i < len(groups)
-                    else -1
-                    for i in range(4)
-                ]
-
-                weights = [
-                    round(groups[i].weight, 6)
-                    if i < len(groups)
-                    else 0
-                    for i in range(3)
-                ]
-
-                joint_ids = [-1 for i in range(4)]
-
-                for i in range(4):
-                    if group_indices[i] != -1:
-                        name = vert_group_names[group_indices[i]]
-                        if name not in result.name_to_joint_id:
-                            raise Exception(f"Vertex is assigned to group {name} but we could not find a deform bone with this name in the armature.")
-
-                        joint_ids[i] = result.name_to_joint_id[name]
-
-                vertex = Vertex(
-                    tuple(position),
-                    tuple(normal),
-                    (tangent.x, tangent.y, tangent.z, bitangent_sign),
-                    tuple(uv_coords),
-                    tuple(joint_ids),
-                    tuple(weights)
-                )
+                    self.report.append(f"{os.path.basename(filename)}: too many vertices ({len(mesh.verts)}) for {max_16_bit_submeshes} 16 bit submesh(es), using 32 bit indices")
+                self.AddTiming("indices", start)
+
+            if build_meshlets:
+                start = time.perf_counter()
+                mesh.BuildMeshlets(meshlet_max_vertices, meshlet_max_triangles)
+                self.AddTiming("meshlets", start)
+
+                meshlet_count = len(mesh.meshlets)
+                if meshlet_count > 0:
+                    vertex_fill = mesh.meshlets["vertex_count"].mean() / meshlet_max_vertices
+                    triangle_fill = mesh.meshlets["triangle_count"].mean() / meshlet_max_triangles
+                    cullable = (mesh.meshlets["cone_cutoff"] < 1).mean()
+                else:
+                    vertex_fill = triangle_fill = cullable = 0
+
+                self.report.append(f"{os.path.basename(filename)}: {meshlet_count} meshlets, vertex fill {vertex_fill * 100:.1f}%, triangle fill {triangle_fill * 100:.1f}%, {cullable * 100:.1f}% with a usable normal cone")
 
-                if vertex in vertices_dict:
-                    result_vert_index = vertices_dict[vertex]
+            if quantize_vertices:
+                mesh.quantize_vertices = True
+
+                errors = QuantizationErrors(mesh.verts)
+                errors_string = ", ".join(f"{name} {error:.6g}" for name, error in errors.items())
+
+                if len(mesh.joints) == 0:
+                    float_size, quantized_size = Static_Vertex_Dtype.itemsize, Quantized_Static_Vertex_Dtype.itemsize
                 else:
-                    result_vert_index = len(result.verts)
-                    result.verts.append(vertex)
-                    vertices_dict.update({ vertex : result_vert_index })
+                    float_size, quantized_size = Skinned_Vertex_Dtype.itemsize, Quantized_Skinned_Vertex_Dtype.itemsize
 
-                tri.append(result_vert_index)
+                self.report.append(f"{os.path.basename(filename)}: quantized vertices {float_size} -> {quantized_size} bytes, max errors: {errors_string}")
 
-            if reverse_triangle_ordering:
-                result.tris.append((tri[0], tri[2], tri[1]))
-            else:
-                result.tris.append((tri[0], tri[1], tri[2]))
+            mesh.write_bounds = write_bounds
+
+            start = time.perf_counter()
+            mesh.WriteBinary(filename)
+            self.written_filenames.append(filename)
+            self.AddTiming("write", start)
+
+        return self
+
+    def TimingsString(self) -> str:
+        return ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in self.timings.items())
+
+# Remove the LOD files left by a previous export with more levels of detail. LOD files
+# that are also the file of an exported mesh are kept.
+def RemoveStaleLodFiles(dirname : str, names : List[str], lod_count : int):
+    import os
 
-        return result
+    name_set = set(names)
+    for name in names:
+        level = lod_count + 1
+        while True:
+            lod_name = f"{name}_LOD{level}"
+            filename = os.path.join(dirname, lod_name) + ".mesh"
+            if not os.path.exists(filename):
+                break
+
+            if lod_name not in name_set:
+                os.remove(filename)
+                print(f"Removed stale LOD file {filename}")
+
+            level += 1
 
 def ExportMeshes(
     context : bpy.types.Context,
@@ -311,46 +934,187 @@ def ExportMeshes(
     dest_coordinate_system : utils.CoordinateSystem,
     transform_matrix : mathutils.Matrix = mathutils.Matrix.Identity(4),
     reverse_triangle_ordering : bool = False,
-    export_tangents : bool = True
+    export_tangents : bool = True,
+    weld_epsilon : float = 0,
+    optimize_vertex_cache : bool = False,
+    lod_count : int = 0,
+    lod_ratio : float = 0.5,
+    lod_max_error : float = 0.01,
+    build_meshlets : bool = False,
+    meshlet_max_vertices : int = 64,
+    meshlet_max_triangles : int = 124,
+    quantize_vertices : bool = False,
+    use_16_bit_indices : bool = False,
+    max_16_bit_submeshes : int = 1,
+    worker_count : int = 0,
+    use_cache : bool = False,
+    share_mesh_data : bool = False,
+    write_bounds : bool = False,
+    expand_collection_instances : bool = False
 ):
     import os
+    import time
+    import collections
+    import concurrent.futures
 
     os.makedirs(dirname, exist_ok=True)
 
     if bpy.ops.object.mode_set.poll():
         bpy.ops.object.mode_set(mode = 'OBJECT')
 
-    for obj in objects:
-        try:
-            me = obj.to_mesh()
-        except RuntimeError:
-            continue
-
-        if len(obj.material_slots) > 1:
-            print("ERROR: Object has multiple materials assigned to it. Separate mesh by material first")
-            continue
-
-        armature_obj = obj.find_armature()
-        armature : bpy.types.Armature = None
-        if armature_obj is not None:
-            armature = armature_obj.data.copy()
-
-        result = Mesh.FromMeshAndArmature(
-            obj, me, armature,
-            apply_object_transform, dest_coordinate_system, transform_matrix,
-            reverse_triangle_ordering, export_tangents
-        )
+    if worker_count <= 0:
+        worker_count = os.cpu_count() or 1
+
+    export_start = time.perf_counter()
+    exported_count = 0
+
+    if expand_collection_instances:
+        object_count = len(objects)
+        objects = utils.ExpandCollectionInstances(objects)
+        print(f"Collection instances: {len(objects) - object_count} object(s) added from instanced collections")
+
+    # Mesh datablock, or object if it doesn't share its mesh data, each file is exported from
+    sources_by_name : Dict[str, object] = {}
+    shared_count = 0
+
+    cache = utils.ExportCache(os.path.join(dirname, ".mesh_export_cache.json"), Mesh_Export_Cache_Version)
+    if use_cache:
+        cache.Load()
+
+    options_key = repr((
+        apply_object_transform,
+        dest_coordinate_system.right + dest_coordinate_system.up + dest_coordinate_system.forward,
+        [tuple(row) for row in transform_matrix],
+        reverse_triangle_ordering,
+        export_tangents,
+        weld_epsilon,
+        optimize_vertex_cache,
+        lod_count,
+        lod_ratio,
+        lod_max_error,
+        build_meshlets,
+        meshlet_max_vertices,
+        meshlet_max_triangles,
+        quantize_vertices,
+        use_16_bit_indices,
+        max_16_bit_submeshes,
+        write_bounds,
+    ))
+
+    def FinishJob(future : concurrent.futures.Future):
+        job : MeshExportJob = future.result()
+
+        if use_cache:
+            cache.Update(job.name, job.content_hash, job.written_filenames)
+
+        print(f"Exported mesh {job.name} to file {job.output_filename} ({job.TimingsString()})")
+        for line in job.report:
+            print(f"    {line}")
+
+    # bpy is not thread safe, so we gather the mesh data on the main thread and hand it
+    # off to the worker threads. We limit the number of meshes in flight so we don't keep
+    # the data of the whole scene in memory.
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=worker_count)
+    pending = collections.deque()
+
+    try:
+        for obj in objects:
+            start = time.perf_counter()
+
+            output_name = utils.MeshAssetName(obj, share_mesh_data, apply_object_transform)
+            source = obj.data if share_mesh_data and utils.CanShareMeshData(obj, apply_object_transform) else obj
+            if output_name in sources_by_name:
+                if sources_by_name[output_name] == source:
+                    shared_count += 1
+                else:
+                    print(f"ERROR: Object {obj.name} has the same mesh file name as another object or mesh ({output_name}), skipping it")
 
-        output_filename = os.path.join(dirname, obj.name) + ".mesh"
-        if len(result.joints) == 0:
-            result.WriteBinaryStatic(output_filename)
-        else:
-            result.WriteBinarySkinned(output_filename)
+                continue
+
+            try:
+                me = obj.to_mesh()
+            except RuntimeError:
+                continue
+
+            if len(obj.material_slots) > 1:
+                print("ERROR: Object has multiple materials assigned to it. Separate mesh by material first")
+                obj.to_mesh_clear()
+                continue
+
+            sources_by_name[output_name] = source
+
+            armature_obj = obj.find_armature()
+
+            output_filename = os.path.join(dirname, output_name) + ".mesh"
+
+            content_hash = ""
+            if use_cache:
+                object_key = options_key
+                if apply_object_transform:
+                    object_key += repr([tuple(row) for row in obj.matrix_world])
+
+                content_hash = HashMeshInputs(
+                    obj, me,
+                    armature_obj.data if armature_obj is not None else None,
+                    object_key
+                )
+
+                if cache.IsUpToDate(output_name, content_hash):
+                    cache.hits += 1
+                    obj.to_mesh_clear()
+                    continue
+
+                cache.misses += 1
+
+            armature : bpy.types.Armature = None
+            if armature_obj is not None:
+                armature = armature_obj.data.copy()
+
+            result, corners = Mesh.SnapshotMeshAndArmature(
+                obj, me, armature,
+                apply_object_transform, dest_coordinate_system, transform_matrix,
+                export_tangents
+            )
+
+            me.free_tangents()
+            obj.to_mesh_clear()
+
+            job = MeshExportJob(output_name, output_filename, result, corners)
+            job.content_hash = content_hash
+            job.timings["extract"] = time.perf_counter() - start
+
+            pending.append(executor.submit(
+                job.Run,
+                reverse_triangle_ordering, weld_epsilon, optimize_vertex_cache,
+                lod_count, lod_ratio, lod_max_error,
+                build_meshlets, meshlet_max_vertices, meshlet_max_triangles,
+                quantize_vertices,
+                use_16_bit_indices, max_16_bit_submeshes,
+                write_bounds
+            ))
+            exported_count += 1
 
-        me.free_tangents()
-        obj.to_mesh_clear()
+            while len(pending) > worker_count * 2:
+                FinishJob(pending.popleft())
 
-        print(f"Exported mesh {obj.name} to file {output_filename}")
+        while len(pending) > 0:
+            FinishJob(pending.popleft())
+
+        RemoveStaleLodFiles(dirname, list(sources_by_name.keys()), lod_count)
+    finally:
+        executor.shutdown()
+
+        # Save what we successfully exported even if something failed along the way
+        if use_cache:
+            cache.Save()
+
+    print(f"Exported {exported_count} mesh(es) in {time.perf_counter() - export_start:.2f} s using {worker_count} worker thread(s)")
+
+    if use_cache:
+        print(f"Export cache: {cache.hits} unchanged mesh(es) skipped, {cache.misses} exported")
+
+    if share_mesh_data:
+        print(f"Shared mesh data: {shared_count} object(s) use a mesh file exported for another object, {len(sources_by_name)} mesh file(s) for {len(sources_by_name) + shared_count} object(s)")
 
 class MeshExportOptions(bpy.types.PropertyGroup):
     only_selected : BoolProperty(
@@ -371,12 +1135,124 @@ class MeshExportOptions(bpy.types.PropertyGroup):
         default = True
     )
 
+    weld_epsilon : FloatProperty(
+        name = "Weld Epsilon",
+        description = "Round the float attributes of the vertices to the nearest multiple of this value before merging equal vertices, so nearly equal vertices are merged. Vertices closer than this can still be kept apart if they round to different multiples. If this is 0 only vertices with exactly equal attributes are merged.",
+        default = 0,
+        min = 0,
+        precision = 6
+    )
+
+    optimize_vertex_cache : BoolProperty(
+        name = "Optimize Vertex Cache",
+        description = "Reorder triangles and vertices to make better use of the GPU post-transform vertex cache and reduce vertex fetches.",
+        default = False
+    )
+
+    lod_count : IntProperty(
+        name = "LOD Count",
+        description = "Number of simplified levels of detail to generate for each mesh, written to <name>_LOD<n>.mesh.",
+        default = 0,
+        min = 0,
+        max = 8
+    )
+
+    lod_ratio : FloatProperty(
+        name = "LOD Ratio",
+        description = "Fraction of the triangles of the previous level of detail that each level of detail should keep.",
+        default = 0.5,
+        min = 0.01,
+        max = 1
+    )
+
+    lod_max_error : FloatProperty(
+        name = "LOD Max Error",
+        description = "Maximum error introduced by each level of detail, relative to the size of the mesh. Simplification stops before reaching the target triangle count if the error would be higher.",
+        default = 0.01,
+        min = 0,
+        max = 1,
+        precision = 4
+    )
+
+    build_meshlets : BoolProperty(
+        name = "Build Meshlets",
+        description = "Partition meshes into small clusters of triangles with bounding spheres and normal cones for GPU culling, stored in an optional section of the mesh file.",
+        default = False
+    )
+
+    meshlet_max_vertices : IntProperty(
+        name = "Meshlet Max Vertices",
+        description = "Maximum number of unique vertices in a meshlet.",
+        default = 64,
+        min = 3,
+        max = 256
+    )
+
+    meshlet_max_triangles : IntProperty(
+        name = "Meshlet Max Triangles",
+        description = "Maximum number of triangles in a meshlet.",
+        default = 124,
+        min = 1,
+        max = 512
+    )
+
+    quantize_vertices : BoolProperty(
+        name = "Quantize Vertices",
+        description = "Store vertices in a compressed format (16 bit positions, octahedral normals and tangents, half float texture coordinates, 8 bit joint weights). This writes a newer version of the mesh file format.",
+        default = False
+    )
+
+    use_16_bit_indices : BoolProperty(
+        name = "16 Bit Indices",
+        description = "Use 16 bit indices for meshes that have at most 65536 vertices. This writes a newer version of the mesh file format.",
+        default = False
+    )
+
+    max_16_bit_submeshes : IntProperty(
+        name = "Max 16 Bit Submeshes",
+        description = "Meshes with more than 65536 vertices are split in this many submeshes at most to use 16 bit indices, vertices shared by submeshes are duplicated. Bigger meshes keep 32 bit indices.",
+        default = 1,
+        min = 1,
+        max = 16
+    )
+
+    write_bounds : BoolProperty(
+        name = "Write Bounds",
+        description = "Store the bounding box and bounding sphere of the mesh, and the bounds of the vertices influenced by each joint for skinned meshes, so the engine does not need to compute them when loading.",
+        default = False
+    )
+
     coordinate_system : StringProperty(
         name = "Coordinate System",
         description = "Specify an output coordinate system in the form [+-][XYZ].",
         default = "+X+Y+Z"
     )
 
+    expand_collection_instances : BoolProperty(
+        name = "Expand Collection Instances",
+        description = "Also export the meshes of the objects of the collections instanced by the exported objects, each mesh once. The scene exporter needs the same option to create entities for these objects.",
+        default = False
+    )
+
+    share_mesh_data : BoolProperty(
+        name = "Share Mesh Data",
+        description = "Export a single file, named after the mesh datablock, for the objects that use the same mesh. Only objects without modifiers can share their mesh, and only when the object transform is not applied. The scene exporter needs the same option to reference these files.",
+        default = False
+    )
+
+    use_cache : BoolProperty(
+        name = "Skip Unchanged",
+        description = "Only export the objects whose mesh data, armature, transform or export options changed since the last export to the output directory.",
+        default = False
+    )
+
+    worker_count : IntProperty(
+        name = "Worker Threads",
+        description = "Number of threads used to process and write the meshes. If this is 0 one thread per CPU core is used.",
+        default = 0,
+        min = 0
+    )
+
     output_directory : StringProperty(
         name = "Output Directory",
         description = "Specify the output directory.",
@@ -410,7 +1286,23 @@ class EXPORTER_OT_VkEngineMesh(bpy.types.Operator):
            bpy.path.abspath(options.output_directory),
            apply_object_transform = options.apply_object_transform,
            dest_coordinate_system = dest_coordinate_system,
-           export_tangents = options.export_tangents
+           export_tangents = options.export_tangents,
+           weld_epsilon = options.weld_epsilon,
+           optimize_vertex_cache = options.optimize_vertex_cache,
+           lod_count = options.lod_count,
+           lod_ratio = options.lod_ratio,
+           lod_max_error = options.lod_max_error,
+           build_meshlets = options.build_meshlets,
+           meshlet_max_vertices = options.meshlet_max_vertices,
+           meshlet_max_triangles = options.meshlet_max_triangles,
+           quantize_vertices = options.quantize_vertices,
+           use_16_bit_indices = options.use_16_bit_indices,
+           max_16_bit_submeshes = options.max_16_bit_submeshes,
+           worker_count = options.worker_count,
+           use_cache = options.use_cache,
+           share_mesh_data = options.share_mesh_data,
+           write_bounds = options.write_bounds,
+           expand_collection_instances = options.expand_collection_instances
         )
 
         context.window.cursor_set('DEFAULT')
@@ -431,7 +1323,25 @@ class VIEW3D_PT_VkEngineMeshExport(bpy.types.Panel):
         layout.row().prop(options, "only_selected")
         layout.row().prop(options, "apply_object_transform")
         layout.row().prop(options, "export_tangents")
+        layout.row().prop(options, "weld_epsilon")
+        layout.row().prop(options, "optimize_vertex_cache")
+        layout.row().prop(options, "lod_count")
+        layout.row().prop(options, "lod_ratio")
+        layout.row().prop(options, "lod_max_error")
+        layout.row().prop(options, "build_meshlets")
+        if options.build_meshlets:
+            layout.row().prop(options, "meshlet_max_vertices")
+            layout.row().prop(options, "meshlet_max_triangles")
+        layout.row().prop(options, "quantize_vertices")
+        layout.row().prop(options, "use_16_bit_indices")
+        if options.use_16_bit_indices:
+            layout.row().prop(options, "max_16_bit_submeshes")
+        layout.row().prop(options, "write_bounds")
         layout.row().prop(options, "coordinate_system")
+        layout.row().prop(options, "share_mesh_data")
+        layout.row().prop(options, "expand_collection_instances")
+        layout.row().prop(options, "use_cache")
+        layout.row().prop(options, "worker_count")
         layout.row().prop(options, "output_directory")
 
         valid = options.output_directory != ""
@@ -0,0 +1,693 @@
+# This file contains mesh processing algorithms that are run on the welded
+# vertex and triangle arrays of a mesh before it is written. Nothing in here
+# touches bpy so it can be run from the export worker threads.
+
+import numpy as np
+
+from typing import (
+    List,
+    Tuple
+)
+
+Vertex_Cache_Size = 16
+
+# Returns, for each vertex, the list of triangles using it as a CSR-like pair of arrays
+# (the triangles of vertex v are triangles[offsets[v]:offsets[v + 1]])
+def BuildVertexTriangleAdjacency(tris : np.ndarray, vertex_count : int) -> Tuple[np.ndarray, np.ndarray]:
+    flat = tris.ravel()
+
+    counts = np.bincount(flat, minlength=vertex_count)
+    offsets = np.zeros(vertex_count + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    triangles = np.argsort(flat, kind="stable") // 3
+
+    return offsets, triangles
+
+# Simulate a FIFO post-transform vertex cache, returns the number of cache misses
+def CountVertexCacheMisses(tris : np.ndarray, cache_size : int = Vertex_Cache_Size) -> int:
+    import collections
+
+    cache = collections.deque()
+    cached = set()
+    misses = 0
+
+    for v in tris.ravel().tolist():
+        if v in cached:
+            continue
+
+        misses += 1
+        cache.append(v)
+        cached.add(v)
+
+        if len(cache) > cache_size:
+            cached.discard(cache.popleft())
+
+    return misses
+
+# Average cache miss ratio (transformed vertices per triangle) and
+# average transform to vertex ratio (transformed vertices per vertex)
+def VertexCacheStats(tris : np.ndarray, vertex_count : int, cache_size : int = Vertex_Cache_Size) -> Tuple[float, float]:
+    if len(tris) == 0 or vertex_count == 0:
+        return 0, 0
+
+    misses = CountVertexCacheMisses(tris, cache_size)
+
+    return misses / len(tris), misses / vertex_count
+
+# Reorder triangles for post-transform vertex cache locality using Tipsify
+# (Sander, Nehab and Barczak, Fast Triangle Reordering for Vertex Locality and
+# Reduced Overdraw, 2007). The winding of each triangle is kept.
+def OptimizeVertexCache(tris : np.ndarray, vertex_count : int, cache_size : int = Vertex_Cache_Size) -> np.ndarray:
+    triangle_count = len(tris)
+    if triangle_count == 0:
+        return tris
+
+    offsets, adjacency = BuildVertexTriangleAdjacency(tris, vertex_count)
+    offsets = offsets.tolist()
+    adjacency = adjacency.tolist()
+    indices = tris.tolist()
+
+    live_triangles = np.bincount(tris.ravel(), minlength=vertex_count).tolist()
+    cache_time = [0] * vertex_count
+    emitted = [False] * triangle_count
+    dead_ends : List[int] = []
+    output : List[int] = []
+
+    timestamp = cache_size + 1
+    cursor = 0
+    fanning_vertex = 0
+
+    # Skip leading unreferenced vertices
+    while fanning_vertex < vertex_count and live_triangles[fanning_vertex] == 0:
+        fanning_vertex += 1
+
+    while fanning_vertex < vertex_count:
+        candidates = {}
+
+        for t in adjacency[offsets[fanning_vertex]:offsets[fanning_vertex + 1]]:
+            if emitted[t]:
+                continue
+
+            emitted[t] = True
+            output.append(t)
+
+            for v in indices[t]:
+                dead_ends.append(v)
+                candidates[v] = None
+                live_triangles[v] -= 1
+
+                if timestamp - cache_time[v] > cache_size:
+                    cache_time[v] = timestamp
+                    timestamp += 1
+
+        # Pick the candidate that will still be in the cache after fanning it,
+        # preferring the oldest ones, since they are more likely to be evicted
+        next_vertex = -1
+        best_priority = 0
+        for v in candidates:
+            if live_triangles[v] <= 0:
+                continue
+
+            priority = 0
+            if timestamp - cache_time[v] + 2 * live_triangles[v] <= cache_size:
+                priority = timestamp - cache_time[v]
+
+            if priority > best_priority:
+                best_priority = priority
+                next_vertex = v
+
+        if next_vertex == -1:
+            while len(dead_ends) > 0:
+                v = dead_ends.pop()
+                if live_triangles[v] > 0:
+                    next_vertex = v
+                    break
+
+        if next_vertex == -1:
+            while cursor < vertex_count and live_triangles[cursor] <= 0:
+                cursor += 1
+
+            next_vertex = cursor
+
+        fanning_vertex = next_vertex
+
+    return tris[np.array(output, dtype=np.int64)]
+
+# Renumber vertices in the order they are first used by the triangles, so vertex fetches
+# are as sequential as possible. Unreferenced vertices are moved at the end.
+# Returns the reordered vertices and triangles.
+def OptimizeVertexFetch(verts : np.ndarray, tris : np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    vertex_count = len(verts)
+    flat = tris.ravel()
+
+    first_use = np.full(vertex_count, len(flat), dtype=np.int64)
+    np.minimum.at(first_use, flat, np.arange(len(flat), dtype=np.int64))
+
+    order = np.argsort(first_use, kind="stable")
+    remap = np.empty(vertex_count, dtype=tris.dtype)
+    remap[order] = np.arange(vertex_count, dtype=tris.dtype)
+
+    return verts[order], remap[tris]
+
+# Weight of the normal, UV and skin weight differences relative to the
+# geometric error when computing the cost of collapsing an edge
+Simplify_Attribute_Weight = 0.01
+
+# Simplify the mesh using quadric error metric half-edge collapses (Garland and Heckbert,
+# Surface Simplification Using Quadric Error Metrics, 1997), until the mesh has at most
+# target_triangle_count triangles or no collapse introduces less than max_error.
+# Errors are relative to the size of the mesh bounding box.
+# Vertices are only ever merged into other existing vertices, so the remaining vertices
+# keep their exact attributes. Vertices on UV or normal seams and on borders are
+# never removed, and vertices influenced by different joints are never merged.
+# Returns the simplified vertices and triangles, and the error of the simplified mesh.
+def SimplifyMesh(verts : np.ndarray, tris : np.ndarray, target_triangle_count : int, max_error : float) -> Tuple[np.ndarray, np.ndarray, float]:
+    import heapq
+
+    vertex_count = len(verts)
+    if len(tris) <= target_triangle_count or vertex_count == 0:
+        return verts, tris, 0
+
+    positions = verts["position"].astype(np.float64)
+    extent = float(np.linalg.norm(positions.max(axis=0) - positions.min(axis=0)))
+    if extent == 0:
+        return verts, tris, 0
+
+    positions /= extent
+
+    # Vertices that share their position with other vertices are on a seam
+    position_keys = np.ascontiguousarray(verts["position"]).view(np.dtype((np.void, 12))).ravel()
+    _, position_ids, position_counts = np.unique(position_keys, return_inverse=True, return_counts=True)
+    position_ids = position_ids.ravel()
+    locked = position_counts[position_ids] > 1
+
+    # Vertices on an edge that is not shared by exactly two triangles are on a border
+    # or a non manifold part of the mesh
+    tri_positions = position_ids[tris]
+    edges = np.concatenate([tri_positions[:, [0, 1]], tri_positions[:, [1, 2]], tri_positions[:, [2, 0]]])
+    edges = np.sort(edges, axis=1)
+    unique_edges, edge_counts = np.unique(edges, axis=0, return_counts=True)
+
+    border_positions = np.zeros(len(position_counts), dtype=bool)
+    border_positions[unique_edges[edge_counts != 2].ravel()] = True
+    locked |= border_positions[position_ids]
+
+    # Error quadric of each vertex, as the 10 unique coefficients of the symmetric 4x4 matrix
+    p0 = positions[tris[:, 0]]
+    p1 = positions[tris[:, 1]]
+    p2 = positions[tris[:, 2]]
+    normals = np.cross(p1 - p0, p2 - p0)
+    lengths = np.linalg.norm(normals, axis=1)
+    normals[lengths > 0] /= lengths[lengths > 0, None]
+
+    planes = np.concatenate([normals, -np.einsum("ij,ij->i", normals, p0)[:, None]], axis=1)
+    rows, cols = np.triu_indices(4)
+    plane_quadrics = planes[:, rows] * planes[:, cols]
+
+    quadrics = np.zeros((vertex_count, 10), dtype=np.float64)
+    for corner in range(3):
+        np.add.at(quadrics, tris[:, corner], plane_quadrics)
+
+    attribute_fields = [name for name in ("normal", "tex_coords", "joint_weights") if name in verts.dtype.names]
+    attributes = np.concatenate([verts[name].reshape(vertex_count, -1).astype(np.float64) for name in attribute_fields], axis=1)
+
+    if "joint_ids" in verts.dtype.names:
+        joint_ids = [tuple(ids) for ids in verts["joint_ids"].tolist()]
+    else:
+        joint_ids = [()] * vertex_count
+
+    positions = positions.tolist()
+    quadrics = quadrics.tolist()
+    attributes = attributes.tolist()
+    locked = locked.tolist()
+    triangles = tris.tolist()
+
+    vertex_triangles = [set() for _ in range(vertex_count)]
+    for t, tri in enumerate(triangles):
+        for v in tri:
+            vertex_triangles[v].add(t)
+
+    def Neighbors(v : int) -> set:
+        result = set()
+        for t in vertex_triangles[v]:
+            result.update(triangles[t])
+        result.discard(v)
+
+        return result
+
+    def CollapseCost(u : int, v : int) -> float:
+        if joint_ids[u] != joint_ids[v]:
+            return float("inf")
+
+        a2, ab, ac, ad, b2, bc, bd, c2, cd, d2 = quadrics[u]
+        x, y, z = positions[v]
+
+        error = (
+            a2 * x * x + 2 * ab * x * y + 2 * ac * x * z + 2 * ad * x +
+            b2 * y * y + 2 * bc * y * z + 2 * bd * y +
+            c2 * z * z + 2 * cd * z + d2
+        )
+
+        attribute_error = sum((a - b) * (a - b) for a, b in zip(attributes[u], attributes[v]))
+
+        return max(error, 0) + Simplify_Attribute_Weight * attribute_error
+
+    def TriangleNormal(a, b, c):
+        e1 = (b[0] - a[0], b[1] - a[1], b[2] - a[2])
+        e2 = (c[0] - a[0], c[1] - a[1], c[2] - a[2])
+
+        return (
+            e1[1] * e2[2] - e1[2] * e2[1],
+            e1[2] * e2[0] - e1[0] * e2[2],
+            e1[0] * e2[1] - e1[1] * e2[0],
+        )
+
+    # Moving u to v must not flip or collapse any of the remaining triangles,
+    # and u and v must not share neighbors other than the ones of the triangles
+    # on the edge, otherwise the mesh would become non manifold
+    def IsCollapseValid(u : int, v : int) -> bool:
+        edge_triangles = vertex_triangles[u] & vertex_triangles[v]
+        if len(Neighbors(u) & Neighbors(v)) > len(edge_triangles):
+            return False
+
+        for t in vertex_triangles[u]:
+            if t in edge_triangles:
+                continue
+
+            tri = triangles[t]
+            before = TriangleNormal(*(positions[i] for i in tri))
+            after = TriangleNormal(*(positions[v if i == u else i] for i in tri))
+
+            if before[0] * after[0] + before[1] * after[1] + before[2] * after[2] <= 0:
+                return False
+
+        return True
+
+    heap = []
+    for u in range(vertex_count):
+        if locked[u]:
+            continue
+
+        for v in Neighbors(u):
+            cost = CollapseCost(u, v)
+            if cost <= max_error * max_error:
+                heap.append((cost, u, v))
+
+    heapq.heapify(heap)
+
+    removed = [False] * vertex_count
+    triangle_alive = [True] * len(triangles)
+    live_triangle_count = len(triangles)
+    result_error = 0
+
+    while live_triangle_count > target_triangle_count and len(heap) > 0:
+        cost, u, v = heapq.heappop(heap)
+        if cost > max_error * max_error:
+            break
+
+        if removed[u] or removed[v] or len(vertex_triangles[u] & vertex_triangles[v]) == 0:
+            continue
+
+        # The quadric of u changes when other vertices are collapsed into it
+        current_cost = CollapseCost(u, v)
+        if current_cost != cost:
+            if current_cost <= max_error * max_error:
+                heapq.heappush(heap, (current_cost, u, v))
+            continue
+
+        if not IsCollapseValid(u, v):
+            continue
+
+        for t in vertex_triangles[u]:
+            tri = triangles[t]
+
+            if v in tri:
+                triangle_alive[t] = False
+                live_triangle_count -= 1
+
+                for i in tri:
+                    if i != u:
+                        vertex_triangles[i].discard(t)
+            else:
+                tri[tri.index(u)] = v
+                vertex_triangles[v].add(t)
+
+        vertex_triangles[u] = set()
+        removed[u] = True
+
+        quadrics[v] = [a + b for a, b in zip(quadrics[v], quadrics[u])]
+        result_error = max(result_error, cost)
+
+        for w in Neighbors(v):
+            if not locked[w]:
+                cost = CollapseCost(w, v)
+                if cost <= max_error * max_error:
+                    heapq.heappush(heap, (cost, w, v))
+
+            if not locked[v]:
+                cost = CollapseCost(v, w)
+                if cost <= max_error * max_error:
+                    heapq.heappush(heap, (cost, v, w))
+
+    result_tris = np.array(
+        [tri for tri, alive in zip(triangles, triangle_alive) if alive],
+        dtype=tris.dtype
+    ).reshape(-1, 3)
+
+    used = np.unique(result_tris)
+    remap = np.zeros(vertex_count, dtype=tris.dtype)
+    remap[used] = np.arange(len(used), dtype=tris.dtype)
+
+    return verts[used], remap[result_tris], result_error ** 0.5
+
+Meshlet_Dtype = np.dtype([
+    ("vertex_offset", "<u4"),
+    ("vertex_count", "<u4"),
+    ("triangle_offset", "<u4"),
+    ("triangle_count", "<u4"),
+    ("center", "<f4", 3),
+    ("radius", "<f4"),
+    ("cone_apex", "<f4", 3),
+    ("cone_axis", "<f4", 3),
+    ("cone_cutoff", "<f4"),
+])
+
+# Partition the triangles into meshlets of at most max_vertices unique vertices and
+# max_triangles triangles. Meshlets are grown greedily, always adding the triangle that
+# shares the most vertices with the current meshlet (the closest one to the meshlet
+# centroid if it needs a new vertex, to keep meshlets compact), and seeded in triangle order,
+# so it works best on triangles that have been optimized for the vertex cache.
+# Returns the meshlets (see Meshlet_Dtype, the bounds are not filled), the vertex indices
+# of all meshlets and the local indices (into the meshlet vertices) of their triangles.
+def BuildMeshlets(tris : np.ndarray, positions : np.ndarray, max_vertices : int = 64, max_triangles : int = 124) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    vertex_count = len(positions)
+    offsets, adjacency = BuildVertexTriangleAdjacency(tris, vertex_count)
+    triangle_centers = positions[tris].mean(axis=1).tolist()
+    offsets = offsets.tolist()
+    adjacency = adjacency.tolist()
+    indices = tris.tolist()
+
+    emitted = [False] * len(indices)
+    meshlets : List[Tuple[int, int, int, int]] = []
+    meshlet_vertices : List[int] = []
+    meshlet_triangles : List[int] = []
+
+    local_indices = {}
+    centroid_sum = [0.0, 0.0, 0.0]
+    triangle_count = 0
+    # Candidate triangles by number of vertices they share with the current meshlet
+    scores = {}
+    candidates = [None, set(), set(), set()]
+    cursor = 0
+
+    def FinishMeshlet():
+        nonlocal triangle_count
+
+        if triangle_count == 0:
+            return
+
+        meshlets.append((
+            len(meshlet_vertices) - len(local_indices), len(local_indices),
+            len(meshlet_triangles) // 3 - triangle_count, triangle_count
+        ))
+
+        local_indices.clear()
+        centroid_sum[:] = [0.0, 0.0, 0.0]
+        scores.clear()
+        for c in candidates[1:]:
+            c.clear()
+
+        triangle_count = 0
+
+    while True:
+        t = -1
+        if len(candidates[3]) > 0:
+            t = next(iter(candidates[3]))
+        elif len(candidates[2]) > 0 or len(candidates[1]) > 0:
+            cx, cy, cz = (c / triangle_count for c in centroid_sum)
+            best_distance = float("inf")
+
+            for other in candidates[2] if len(candidates[2]) > 0 else candidates[1]:
+                x, y, z = triangle_centers[other]
+                distance = (x - cx) * (x - cx) + (y - cy) * (y - cy) + (z - cz) * (z - cz)
+                if distance < best_distance:
+                    best_distance = distance
+                    t = other
+
+        new_vertex_count = sum(1 for v in indices[t] if v not in local_indices) if t >= 0 else 0
+        if t < 0 or len(local_indices) + new_vertex_count > max_vertices or triangle_count >= max_triangles:
+            FinishMeshlet()
+
+            while cursor < len(indices) and emitted[cursor]:
+                cursor += 1
+
+            if cursor == len(indices):
+                break
+
+            t = cursor
+
+        emitted[t] = True
+        score = scores.pop(t, 0)
+        if score > 0:
+            candidates[score].discard(t)
+
+        for v in indices[t]:
+            if v in local_indices:
+                meshlet_triangles.append(local_indices[v])
+                continue
+
+            local_indices[v] = len(local_indices)
+            meshlet_vertices.append(v)
+            meshlet_triangles.append(local_indices[v])
+
+            for other in adjacency[offsets[v]:offsets[v + 1]]:
+                if emitted[other]:
+                    continue
+
+                score = scores.get(other, 0)
+                if score > 0:
+                    candidates[score].discard(other)
+
+                scores[other] = score + 1
+                candidates[score + 1].add(other)
+
+        x, y, z = triangle_centers[t]
+        centroid_sum[0] += x
+        centroid_sum[1] += y
+        centroid_sum[2] += z
+        triangle_count += 1
+
+    FinishMeshlet()
+
+    result = np.zeros(len(meshlets), dtype=Meshlet_Dtype)
+    if len(meshlets) > 0:
+        ranges = np.array(meshlets, dtype=np.uint32)
+        result["vertex_offset"] = ranges[:, 0]
+        result["vertex_count"] = ranges[:, 1]
+        result["triangle_offset"] = ranges[:, 2]
+        result["triangle_count"] = ranges[:, 3]
+
+    return (
+        result,
+        np.array(meshlet_vertices, dtype=np.uint32),
+        np.array(meshlet_triangles, dtype=np.uint8).reshape(-1, 3)
+    )
+
+# Fill the bounding sphere and normal cone of each meshlet. A meshlet can be backface
+# culled if dot(normalize(cone_apex - camera_position), cone_axis) >= cone_cutoff,
+# the cutoff is 1 for meshlets whose triangles face too many directions to be culled.
+def ComputeMeshletBounds(meshlets : np.ndarray, meshlet_vertices : np.ndarray, meshlet_triangles : np.ndarray, positions : np.ndarray):
+    positions = positions.astype(np.float64)
+
+    for meshlet in meshlets:
+        vertex_offset = int(meshlet["vertex_offset"])
+        triangle_offset = int(meshlet["triangle_offset"])
+
+        points = positions[meshlet_vertices[vertex_offset:vertex_offset + int(meshlet["vertex_count"])]]
+        local_tris = meshlet_triangles[triangle_offset:triangle_offset + int(meshlet["triangle_count"])]
+
+        center = (points.min(axis=0) + points.max(axis=0)) * 0.5
+        meshlet["center"] = center
+        meshlet["radius"] = np.sqrt(((points - center) ** 2).sum(axis=1).max())
+
+        p0 = points[local_tris[:, 0]]
+        normals = np.cross(points[local_tris[:, 1]] - p0, points[local_tris[:, 2]] - p0)
+        lengths = np.linalg.norm(normals, axis=1)
+        valid = lengths > 0
+
+        meshlet["cone_apex"] = center
+        meshlet["cone_cutoff"] = 1
+
+        if not valid.any():
+            continue
+
+        normals = normals[valid] / lengths[valid, None]
+        p0 = p0[valid]
+
+        axis = normals.sum(axis=0)
+        axis_length = np.linalg.norm(axis)
+        if axis_length == 0:
+            continue
+
+        axis /= axis_length
+        meshlet["cone_axis"] = axis
+
+        min_dot = (normals @ axis).min()
+        if min_dot <= 0:
+            continue
+
+        # Move the apex back along the axis so that it is behind the plane of every triangle
+        distances = np.einsum("ij,ij->i", center - p0, normals) / (normals @ axis)
+        apex = center - axis * max(distances.max(), 0)
+
+        # With the apex behind every plane, a camera inside the cone sees the back of every
+        # triangle, so the meshlet is never culled while one of its triangles faces the camera
+        in_front = np.einsum("ij,ij->i", apex - p0, normals)
+        if in_front.max() > 1e-9 * max(meshlet["radius"], 1):
+            raise Exception(f"Meshlet cone apex is in front of a triangle by {in_front.max()}")
+
+        meshlet["cone_apex"] = apex
+        meshlet["cone_cutoff"] = np.sqrt(max(1 - min_dot * min_dot, 0))
+
+Submesh_Dtype = np.dtype([
+    ("first_triangle", "<u4"),
+    ("triangle_count", "<u4"),
+    ("base_vertex", "<u4"),
+    ("vertex_count", "<u4"),
+])
+
+# Split the triangles in consecutive submeshes that each use at most max_vertices vertices,
+# so they can be drawn with small indices relative to their base vertex. Vertices used by
+# several submeshes are duplicated. Returns the index of the original vertex of each new
+# vertex, the triangles indexing the new vertices and the submeshes (see Submesh_Dtype).
+def SplitSubmeshes(tris : np.ndarray, max_vertices : int = 65536) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    vertex_order : List[int] = []
+    result_tris = np.empty_like(tris)
+    submeshes : List[Tuple[int, int, int, int]] = []
+
+    local_indices = {}
+    base_vertex = 0
+    first_triangle = 0
+
+    for t, tri in enumerate(tris.tolist()):
+        new_vertex_count = sum(1 for v in tri if v not in local_indices)
+        if len(local_indices) + new_vertex_count > max_vertices:
+            submeshes.append((first_triangle, t - first_triangle, base_vertex, len(local_indices)))
+
+            base_vertex += len(local_indices)
+            first_triangle = t
+            local_indices = {}
+
+        for i, v in enumerate(tri):
+            if v not in local_indices:
+                local_indices[v] = len(local_indices)
+                vertex_order.append(v)
+
+            result_tris[t, i] = base_vertex + local_indices[v]
+
+    submeshes.append((first_triangle, len(tris) - first_triangle, base_vertex, len(local_indices)))
+
+    return (
+        np.array(vertex_order, dtype=np.int64),
+        result_tris,
+        np.array(submeshes, dtype=np.uint32).view(Submesh_Dtype).ravel()
+    )
+
+# Bounds of the vertices influenced by a joint, in the space of the joint in the bind pose.
+# Joints that do not influence any vertex have a min of FLT_MAX and a max of -FLT_MAX.
+Joint_Bounds_Dtype = np.dtype([
+    ("min", "<f4", 3),
+    ("max", "<f4", 3),
+])
+
+Bounding_Sphere_Max_Iterations = 100
+
+# Bounding sphere of the points: Ritter's sphere (Ritter, An Efficient Bounding Sphere, 1990)
+# grown until it contains every point, or the sphere centered on the bounding box if it is
+# smaller. Returns the center and the radius.
+def BoundingSphere(points : np.ndarray) -> Tuple[np.ndarray, float]:
+    points = points.astype(np.float64)
+    if len(points) == 0:
+        return np.zeros(3), 0.0
+
+    box_center = (points.min(axis=0) + points.max(axis=0)) * 0.5
+    box_radius = np.sqrt(((points - box_center) ** 2).sum(axis=1).max())
+
+    # Start from the farthest point from an arbitrary point and the farthest point from it
+    a = points[np.argmax(((points - points[0]) ** 2).sum(axis=1))]
+    b = points[np.argmax(((points - a) ** 2).sum(axis=1))]
+    center = (a + b) * 0.5
+    radius = np.linalg.norm(b - a) * 0.5
+
+    # Each step moves the sphere so it touches the farthest point outside of it, the sphere
+    # grows every time so this converges quickly. Points less than an ulp outside of the
+    # sphere don't make it grow, so we stop then, and use the distance to the farthest point
+    # as the radius so the sphere contains every point.
+    for _ in range(Bounding_Sphere_Max_Iterations):
+        distances = np.sqrt(((points - center) ** 2).sum(axis=1))
+        farthest = int(np.argmax(distances))
+        distance = distances[farthest]
+        if distance <= radius:
+            break
+
+        new_radius = (radius + distance) * 0.5
+        if new_radius <= radius:
+            break
+
+        center = center + (points[farthest] - center) * ((new_radius - radius) / distance)
+        radius = new_radius
+
+    radius = np.sqrt(((points - center) ** 2).sum(axis=1).max())
+
+    if box_radius < radius:
+        return box_center, box_radius
+
+    return center, radius
+
+# Bounds of the vertices influenced by each joint (see Joint_Bounds_Dtype). joint_ids has 4
+# joints per vertex (-1 if unused), joint_weights has the first 3 weights, the last one being
+# 1 minus their sum. bind_matrices are the 4x4 model space transforms of the joints in the
+# bind pose.
+def ComputeJointBounds(positions : np.ndarray, joint_ids : np.ndarray, joint_weights : np.ndarray, bind_matrices : np.ndarray) -> np.ndarray:
+    positions = positions.astype(np.float64)
+    joint_count = len(bind_matrices)
+
+    inverse_binds = np.linalg.inv(bind_matrices.astype(np.float64))
+
+    weights = np.empty((len(positions), 4), dtype=np.float64)
+    weights[:, :3] = joint_weights
+    weights[:, 3] = 1 - weights[:, :3].sum(axis=1)
+
+    # Each influence is a (vertex, joint) pair, they are sorted by joint so the vertices of
+    # each joint are transformed at once
+    influenced = (joint_ids >= 0) & (joint_ids < joint_count) & (weights > 0)
+    vertices = np.nonzero(influenced)[0]
+    ids = joint_ids[influenced].astype(np.int64)
+
+    order = np.argsort(ids, kind="stable")
+    vertices = vertices[order]
+    ends = np.searchsorted(ids[order], np.arange(joint_count), side="right")
+
+    mins = np.full((joint_count, 3), np.inf)
+    maxs = np.full((joint_count, 3), -np.inf)
+    start = 0
+    for joint, end in enumerate(ends.tolist()):
+        if end > start:
+            local = positions[vertices[start:end]] @ inverse_binds[joint, :3, :3].T + inverse_binds[joint, :3, 3]
+            mins[joint] = local.min(axis=0)
+            maxs[joint] = local.max(axis=0)
+
+        start = end
+
+    # Round away from the box so it still contains the vertices once stored as floats
+    float_max = np.finfo(np.float32).max
+    bounds = np.empty(joint_count, dtype=Joint_Bounds_Dtype)
+    bounds["min"] = np.nextafter(np.clip(mins, -float_max, float_max).astype(np.float32), np.float32(-np.inf))
+    bounds["max"] = np.nextafter(np.clip(maxs, -float_max, float_max).astype(np.float32), np.float32(np.inf))
+
+    empty = np.isinf(mins[:, 0])
+    bounds["min"][empty] = float_max
+    bounds["max"][empty] = -float_max
+
+    return bounds
@@ -0,0 +1,218 @@
+# This file contains the packed scene archive format: all the entities of a scene in a
+# single file instead of one .entity file per entity. Entities are stored as the same blocks
+# and fields as the text format, with the same indices. Nothing in here touches bpy so the
+# archives can be read outside of Blender.
+#
+# Layout (little endian, all sections 4 bytes aligned):
+#   header:  magic (16 bytes), version, entity count, string count, strings offset,
+#            index offset, records offset (u32 each)
+#   strings: string count entries of (offset, length) u32 relative to the end of the entries,
+#            followed by the UTF-8 data of all the strings
+#   index:   entity count entries of guid (16 bytes), type string, record offset, record size
+#            (u32 each), record offsets are relative to the records offset
+#   records: block count u32, then for each block its name string, index and field count
+#            (u32 each), then for each field its name string u32, index u16, type u16 and value
+#
+# Values are a 16 bytes guid, a u32 string, a u32 bool, a f32 or a u32 count followed by
+# that many f32. Since the index gives the offset and size of every record, an archive can be
+# memory mapped and an entity read without parsing the others.
+
+import struct
+
+from typing import (
+    List,
+    Dict,
+    Tuple
+)
+
+Scene_Archive_Magic = b"VK_SCENE_ARCHIVE"
+Scene_Archive_Version = 10000
+
+Field_Type_Guid = 1
+Field_Type_String = 2
+Field_Type_Bool = 3
+Field_Type_Float = 4
+Field_Type_Float_Array = 5
+
+Header_Struct = struct.Struct("<16s6I")
+String_Entry_Struct = struct.Struct("<2I")
+Index_Entry_Struct = struct.Struct("<16s3I")
+Block_Struct = struct.Struct("<3I")
+Field_Struct = struct.Struct("<IHH")
+
+# Blocks are (name, index, fields) and fields are (name, index, type, value)
+EntityBlocks = List[Tuple[str, int, List[Tuple[str, int, int, object]]]]
+
+def Align4(size : int) -> int:
+    return (size + 3) & ~3
+
+# Strings are stored once in the archive and referenced by their index
+class StringTable:
+    def __init__(self):
+        self.strings : List[str] = []
+        self.ids : Dict[str, int] = {}
+
+    def Add(self, string : str) -> int:
+        string_id = self.ids.get(string)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.ids[string] = string_id
+            self.strings.append(string)
+
+        return string_id
+
+    def ToBytes(self) -> bytes:
+        entries = bytearray()
+        data = bytearray()
+        for string in self.strings:
+            encoded = string.encode("utf-8")
+            entries += String_Entry_Struct.pack(len(data), len(encoded))
+            data += encoded
+
+        data += bytes(Align4(len(data)) - len(data))
+
+        return bytes(entries + data)
+
+def PackRecord(blocks : EntityBlocks, strings : StringTable) -> bytes:
+    parts = [struct.pack("<I", len(blocks))]
+    for block_name, block_index, fields in blocks:
+        parts.append(Block_Struct.pack(strings.Add(block_name), block_index, len(fields)))
+
+        for name, index, field_type, value in fields:
+            parts.append(Field_Struct.pack(strings.Add(name), index, field_type))
+
+            if field_type == Field_Type_Guid:
+                parts.append(bytes.fromhex(value))
+            elif field_type == Field_Type_String:
+                parts.append(struct.pack("<I", strings.Add(value)))
+            elif field_type == Field_Type_Bool:
+                parts.append(struct.pack("<I", 1 if value else 0))
+            elif field_type == Field_Type_Float:
+                parts.append(struct.pack("<f", value))
+            elif field_type == Field_Type_Float_Array:
+                parts.append(struct.pack(f"<I{len(value)}f", len(value), *value))
+            else:
+                raise Exception(f"Unknown field type {field_type} for field {name}")
+
+    return b"".join(parts)
+
+# Pack entities, given as (guid, type, blocks), into an archive
+def PackSceneArchive(entities : List[Tuple[str, str, EntityBlocks]]) -> bytes:
+    strings = StringTable()
+
+    index = bytearray()
+    records = []
+    records_size = 0
+    for guid, entity_type, blocks in entities:
+        record = PackRecord(blocks, strings)
+        index += Index_Entry_Struct.pack(bytes.fromhex(guid), strings.Add(entity_type), records_size, len(record))
+        records.append(record)
+        records_size += len(record)
+
+    string_data = strings.ToBytes()
+
+    strings_offset = Header_Struct.size
+    index_offset = strings_offset + len(string_data)
+    records_offset = index_offset + len(index)
+
+    header = Header_Struct.pack(
+        Scene_Archive_Magic, Scene_Archive_Version, len(entities), len(strings.strings),
+        strings_offset, index_offset, records_offset
+    )
+
+    return b"".join([header, string_data, bytes(index)] + records)
+
+# Read access to an archive, data can be bytes or a memory map. Only the header, the strings
+# and the index are read when opening, records are parsed when their entity is asked for.
+class SceneArchive:
+    def __init__(self, data):
+        self.data = data
+
+        magic, version, entity_count, string_count, strings_offset, index_offset, records_offset = Header_Struct.unpack_from(data, 0)
+        if magic != Scene_Archive_Magic:
+            raise Exception("Not a scene archive")
+
+        if version != Scene_Archive_Version:
+            raise Exception(f"Unsupported scene archive version {version}, expected {Scene_Archive_Version}")
+
+        self.records_offset : int = records_offset
+
+        string_data_offset = strings_offset + string_count * String_Entry_Struct.size
+        self.strings : List[str] = []
+        for offset, length in String_Entry_Struct.iter_unpack(data[strings_offset:string_data_offset]):
+            start = string_data_offset + offset
+            self.strings.append(bytes(data[start:start + length]).decode("utf-8"))
+
+        self.index : List[Tuple[str, str, int, int]] = []
+        self.entities_by_guid : Dict[str, int] = {}
+        index_end = index_offset + entity_count * Index_Entry_Struct.size
+        for guid, type_id, offset, size in Index_Entry_Struct.iter_unpack(data[index_offset:index_end]):
+            self.entities_by_guid[guid.hex()] = len(self.index)
+            self.index.append((guid.hex(), self.strings[type_id], offset, size))
+
+    def EntityCount(self) -> int:
+        return len(self.index)
+
+    def FindEntity(self, guid : str) -> int:
+        return self.entities_by_guid.get(guid, -1)
+
+    # Returns the guid, the type and the blocks of an entity
+    def Entity(self, entity_index : int) -> Tuple[str, str, EntityBlocks]:
+        guid, entity_type, offset, size = self.index[entity_index]
+
+        data = self.data
+        strings = self.strings
+        position = self.records_offset + offset
+
+        block_count, = struct.unpack_from("<I", data, position)
+        position += 4
+
+        blocks = []
+        for _ in range(block_count):
+            block_name, block_index, field_count = Block_Struct.unpack_from(data, position)
+            position += Block_Struct.size
+
+            fields = []
+            for _ in range(field_count):
+                name, index, field_type = Field_Struct.unpack_from(data, position)
+                position += Field_Struct.size
+
+                if field_type == Field_Type_Guid:
+                    value = bytes(data[position:position + 16]).hex()
+                    position += 16
+                elif field_type == Field_Type_String:
+                    value = strings[struct.unpack_from("<I", data, position)[0]]
+                    position += 4
+                elif field_type == Field_Type_Bool:
+                    value = struct.unpack_from("<I", data, position)[0] != 0
+                    position += 4
+                elif field_type == Field_Type_Float:
+                    value, = struct.unpack_from("<f", data, position)
+                    position += 4
+                elif field_type == Field_Type_Float_Array:
+                    count, = struct.unpack_from("<I", data, position)
+                    value = struct.unpack_from(f"<{count}f", data, position + 4)
+                    position += 4 + count * 4
+                else:
+                    raise Exception(f"Unknown field type {field_type} in entity {guid}")
+
+                fields.append((strings[name], index, field_type, value))
+
+            blocks.append((strings[block_name], block_index, fields))
+
+        if position != self.records_offset + offset + size:
+            raise Exception(f"Record of entity {guid} is {position - self.records_offset - offset} bytes but the index says {size}")
+
+        return guid, entity_type, blocks
+
+    def Entities(self) -> List[Tuple[str, str, EntityBlocks]]:
+        return [self.Entity(i) for i in range(len(self.index))]
+
+# Memory map an archive file. The returned archive keeps the file mapped while it is alive.
+def OpenSceneArchive(filename : str) -> SceneArchive:
+    import mmap
+
+    with open(filename, "rb") as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    return SceneArchive(data)
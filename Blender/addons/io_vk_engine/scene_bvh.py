@@ -0,0 +1,283 @@
+# This file contains the bounding volume hierarchy written alongside exported scenes, so the
+# engine does not need to compute the bounds of the entities and build its acceleration
+# structure when loading. It also has ray and frustum queries to check the hierarchy from
+# Python. Nothing in here touches bpy.
+#
+# Layout (little endian):
+#   header: magic (12 bytes), version, node count, item count (u32 each)
+#   nodes:  node count entries of min (3 f32), max (3 f32), offset u32, count u32
+#   items:  item count entries of entity guid (16 bytes), instance index u32, min (3 f32),
+#           max (3 f32)
+#
+# Nodes are in depth first order, the first one being the root. An inner node has a count of
+# 0, its first child is the next node and offset is the index of its second child. A leaf node
+# has count items starting at item offset. Items are world space AABBs of mesh entities, the
+# instance index is the index of the instance for instanced mesh entities and
+# No_Instance_Index otherwise.
+
+import numpy as np
+
+from typing import (
+    List,
+    Tuple
+)
+
+Scene_BVH_Magic = b"VK_SCENE_BVH"
+Scene_BVH_Version = 10000
+
+No_Instance_Index = 0xffffffff
+
+# Nodes with up to Max_Leaf_Size items are always leaves, nodes with up to Max_SAH_Leaf_Size
+# items are leaves if the surface area heuristic says splitting them is not worth it
+Max_Leaf_Size = 4
+Max_SAH_Leaf_Size = 16
+SAH_Bin_Count = 16
+
+Node_Dtype = np.dtype([("min", "<f4", 3), ("max", "<f4", 3), ("offset", "<u4"), ("count", "<u4")])
+Item_Dtype = np.dtype([("guid", "S16"), ("instance", "<u4"), ("min", "<f4", 3), ("max", "<f4", 3)])
+Header_Dtype = np.dtype([("magic", "S12"), ("version", "<u4"), ("node_count", "<u4"), ("item_count", "<u4")])
+
+# Bounds are stored as f32, they are rounded away from the box so they still contain it
+def RoundDown(values : np.ndarray) -> np.ndarray:
+    rounded = values.astype(np.float32)
+
+    return np.where(rounded > values, np.nextafter(rounded, np.float32(-np.inf)), rounded)
+
+def RoundUp(values : np.ndarray) -> np.ndarray:
+    rounded = values.astype(np.float32)
+
+    return np.where(rounded < values, np.nextafter(rounded, np.float32(np.inf)), rounded)
+
+def SurfaceAreas(extents : np.ndarray) -> np.ndarray:
+    extents = np.maximum(extents, 0)
+
+    return extents[..., 0] * extents[..., 1] + extents[..., 1] * extents[..., 2] + extents[..., 2] * extents[..., 0]
+
+# Find the best split of the items along the axis of the biggest extent of their centroids
+# using the surface area heuristic, with the centroids put in SAH_Bin_Count bins. Returns the
+# items of the two sides, or None if keeping the items in a single leaf is cheaper.
+def FindSAHSplit(items : np.ndarray, mins : np.ndarray, maxs : np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    centroids = (mins[items] + maxs[items]) * 0.5
+    centroid_min = centroids.min(axis=0)
+    centroid_extent = centroids.max(axis=0) - centroid_min
+    axis = int(np.argmax(centroid_extent))
+
+    # All the centroids are at the same place, split in the middle of the list
+    if centroid_extent[axis] <= 0:
+        middle = len(items) // 2
+        return items[:middle], items[middle:]
+
+    bins = ((centroids[:, axis] - centroid_min[axis]) * (SAH_Bin_Count / centroid_extent[axis])).astype(np.int64)
+    bins = np.minimum(bins, SAH_Bin_Count - 1)
+
+    bin_counts = np.bincount(bins, minlength=SAH_Bin_Count)
+    bin_mins = np.full((SAH_Bin_Count, 3), np.inf)
+    bin_maxs = np.full((SAH_Bin_Count, 3), -np.inf)
+    np.minimum.at(bin_mins, bins, mins[items])
+    np.maximum.at(bin_maxs, bins, maxs[items])
+
+    left_counts = np.cumsum(bin_counts)[:-1]
+    left_areas = SurfaceAreas(np.maximum.accumulate(bin_maxs)[:-1] - np.minimum.accumulate(bin_mins)[:-1])
+    right_counts = np.cumsum(bin_counts[::-1])[::-1][1:]
+    right_areas = SurfaceAreas(np.maximum.accumulate(bin_maxs[::-1])[::-1][1:] - np.minimum.accumulate(bin_mins[::-1])[::-1][1:])
+
+    costs = np.where((left_counts > 0) & (right_counts > 0), left_counts * left_areas + right_counts * right_areas, np.inf)
+    split = int(np.argmin(costs))
+
+    # There are centroids in the first and the last bins so there always is a split with
+    # items on both sides
+    node_area = SurfaceAreas(maxs[items].max(axis=0) - mins[items].min(axis=0))
+    if costs[split] >= len(items) * node_area and len(items) <= Max_SAH_Leaf_Size:
+        return None
+
+    return items[bins <= split], items[bins > split]
+
+class SceneBVH:
+    def __init__(self, nodes : np.ndarray, items : np.ndarray):
+        self.nodes = nodes
+        self.items = items
+
+    # Build the hierarchy of the given world space AABBs, guids are the 32 characters hex
+    # GUIDs of the entities
+    @staticmethod
+    def Build(guids : List[str], instances : List[int], mins : np.ndarray, maxs : np.ndarray):
+        mins = np.asarray(mins, dtype=np.float64).reshape(-1, 3)
+        maxs = np.asarray(maxs, dtype=np.float64).reshape(-1, 3)
+
+        nodes = []
+        order = []
+
+        # Nodes are built depth first, the second child of a node sets the offset of its parent
+        stack = [(np.arange(len(guids)), -1)] if len(guids) > 0 else []
+        while len(stack) > 0:
+            items, parent_index = stack.pop()
+
+            node_index = len(nodes)
+            if parent_index >= 0:
+                nodes[parent_index][2] = node_index
+
+            split = FindSAHSplit(items, mins, maxs) if len(items) > Max_Leaf_Size else None
+            if split is None:
+                nodes.append([mins[items].min(axis=0), maxs[items].max(axis=0), len(order), len(items)])
+                order.extend(items.tolist())
+            else:
+                nodes.append([mins[items].min(axis=0), maxs[items].max(axis=0), 0, 0])
+                stack.append((split[1], node_index))
+                stack.append((split[0], -1))
+
+        node_array = np.zeros(len(nodes), dtype=Node_Dtype)
+        if len(nodes) > 0:
+            node_array["min"] = RoundDown(np.array([node[0] for node in nodes]))
+            node_array["max"] = RoundUp(np.array([node[1] for node in nodes]))
+            node_array["offset"] = [node[2] for node in nodes]
+            node_array["count"] = [node[3] for node in nodes]
+
+        item_array = np.zeros(len(order), dtype=Item_Dtype)
+        item_array["guid"] = [bytes.fromhex(guids[i]) for i in order]
+        item_array["instance"] = [instances[i] for i in order]
+        item_array["min"] = RoundDown(mins[order])
+        item_array["max"] = RoundUp(maxs[order])
+
+        return SceneBVH(node_array, item_array)
+
+    def ToBytes(self) -> bytes:
+        header = np.array([(Scene_BVH_Magic, Scene_BVH_Version, len(self.nodes), len(self.items))], dtype=Header_Dtype)
+
+        return header.tobytes() + self.nodes.tobytes() + self.items.tobytes()
+
+    @staticmethod
+    def FromBytes(data : bytes):
+        header = np.frombuffer(data, dtype=Header_Dtype, count=1)[0]
+        if header["magic"] != Scene_BVH_Magic:
+            raise Exception("Not a scene BVH")
+
+        if header["version"] != Scene_BVH_Version:
+            raise Exception(f"Unsupported scene BVH version {header['version']}, expected {Scene_BVH_Version}")
+
+        offset = Header_Dtype.itemsize
+        nodes = np.frombuffer(data, dtype=Node_Dtype, count=int(header["node_count"]), offset=offset)
+        offset += nodes.nbytes
+        items = np.frombuffer(data, dtype=Item_Dtype, count=int(header["item_count"]), offset=offset)
+
+        return SceneBVH(nodes, items)
+
+    def Item(self, index : int) -> Tuple[str, int]:
+        return self.items["guid"][index].ljust(16, b"\0").hex(), int(self.items["instance"][index])
+
+    # Returns the items whose AABB is hit by the ray as (distance, guid, instance index),
+    # sorted by distance
+    def Raycast(self, origin, direction, max_distance : float = np.inf) -> List[Tuple[float, str, int]]:
+        origin = np.asarray(origin, dtype=np.float64)
+        with np.errstate(divide="ignore"):
+            inv_direction = 1 / np.asarray(direction, dtype=np.float64)
+
+        def Intersect(box_min : np.ndarray, box_max : np.ndarray) -> float:
+            with np.errstate(invalid="ignore"):
+                t0 = (box_min - origin) * inv_direction
+                t1 = (box_max - origin) * inv_direction
+
+            # NaNs come from axes the ray is parallel to and whose slab contains the origin
+            t_near = np.nanmax(np.append(np.minimum(t0, t1), 0))
+            t_far = np.nanmin(np.append(np.maximum(t0, t1), max_distance))
+            if t_near > t_far:
+                return None
+
+            return t_near
+
+        hits = []
+        stack = [0] if len(self.nodes) > 0 else []
+        while len(stack) > 0:
+            node_index = stack.pop()
+            node = self.nodes[node_index]
+            if Intersect(node["min"], node["max"]) is None:
+                continue
+
+            if node["count"] == 0:
+                stack.append(int(node["offset"]))
+                stack.append(node_index + 1)
+                continue
+
+            for i in range(int(node["offset"]), int(node["offset"] + node["count"])):
+                distance = Intersect(self.items["min"][i], self.items["max"][i])
+                if distance is not None:
+                    hits.append((float(distance), *self.Item(i)))
+
+        hits.sort()
+
+        return hits
+
+    # Returns the items whose AABB is inside or intersects the frustum as (guid, instance
+    # index). planes is a 6x4 array of (a, b, c, d) with a point being inside a plane when
+    # a * x + b * y + c * z + d >= 0, see FrustumPlanes. Like most frustum culling tests this
+    # is conservative, AABBs near the corners of the frustum can be returned while being
+    # outside of it.
+    def QueryFrustum(self, planes) -> List[Tuple[str, int]]:
+        planes = np.asarray(planes, dtype=np.float64).reshape(-1, 4)
+        normals = planes[:, :3]
+        positive = normals >= 0
+
+        # 0 if the box is outside of the frustum, 1 if it intersects it, 2 if it is inside
+        def Classify(box_min : np.ndarray, box_max : np.ndarray) -> int:
+            farthest = np.where(positive, box_max, box_min)
+            nearest = np.where(positive, box_min, box_max)
+            if np.any(np.einsum("ij,ij->i", normals, farthest) + planes[:, 3] < 0):
+                return 0
+
+            if np.all(np.einsum("ij,ij->i", normals, nearest) + planes[:, 3] >= 0):
+                return 2
+
+            return 1
+
+        results = []
+        stack = [0] if len(self.nodes) > 0 else []
+        while len(stack) > 0:
+            node_index = stack.pop()
+            node = self.nodes[node_index]
+            classification = Classify(node["min"], node["max"])
+            if classification == 0:
+                continue
+
+            if classification == 2:
+                first, last = self.SubtreeItems(node_index)
+                results.extend(self.Item(i) for i in range(first, last))
+                continue
+
+            if node["count"] == 0:
+                stack.append(int(node["offset"]))
+                stack.append(node_index + 1)
+                continue
+
+            for i in range(int(node["offset"]), int(node["offset"] + node["count"])):
+                if Classify(self.items["min"][i], self.items["max"][i]) != 0:
+                    results.append(self.Item(i))
+
+        return results
+
+    # Items of a subtree are contiguous since nodes are in depth first order. Returns the
+    # first item and the end of the items.
+    def SubtreeItems(self, node_index : int) -> Tuple[int, int]:
+        first = node_index
+        while self.nodes[first]["count"] == 0:
+            first += 1
+
+        last = node_index
+        while self.nodes[last]["count"] == 0:
+            last = int(self.nodes[last]["offset"])
+
+        return int(self.nodes[first]["offset"]), int(self.nodes[last]["offset"] + self.nodes[last]["count"])
+
+# Planes of the frustum of a view projection matrix, for column vectors and a depth range of
+# 0 to 1 like Vulkan (Gribb and Hartmann). Returns a 6x4 array of normalized planes.
+def FrustumPlanes(view_projection) -> np.ndarray:
+    m = np.asarray(view_projection, dtype=np.float64)
+
+    planes = np.array([
+        m[3] + m[0],
+        m[3] - m[0],
+        m[3] + m[1],
+        m[3] - m[1],
+        m[2],
+        m[3] - m[2],
+    ])
+
+    return planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
@@ -2,7 +2,9 @@ import bpy
 import mathutils
 
 from typing import (
-    Tuple
+    Tuple,
+    List,
+    Dict
 )
 
 from bpy_extras.io_utils import (
@@ -110,6 +112,48 @@ class CoordinateSystem:
 
         return mathutils.Matrix.Identity(3)
 
+# The .mesh file of an object only depends on its mesh datablock when it has no modifiers or
+# armature and its transform is not applied to the mesh, in which case all the objects
+# using the datablock can share the same file
+def CanShareMeshData(obj : bpy.types.Object, apply_object_transform : bool) -> bool:
+    return (
+        obj.type == 'MESH'
+        and not apply_object_transform
+        and len(obj.modifiers) == 0
+        and obj.find_armature() is None
+    )
+
+# Name of the .mesh file of an object, without the extension. Shared files are named
+# after the mesh datablock.
+def MeshAssetName(obj : bpy.types.Object, share_mesh_data : bool, apply_object_transform : bool) -> str:
+    if share_mesh_data and CanShareMeshData(obj, apply_object_transform):
+        return obj.data.name
+
+    return obj.name
+
+# Add the objects of the collections instanced by the objects (recursively) to the list,
+# each object appearing once, so the meshes of instanced collections are exported even if
+# the collection itself is not part of the scene or is linked from another file
+def ExpandCollectionInstances(objects : List[bpy.types.Object]) -> List[bpy.types.Object]:
+    result = []
+    visited = set()
+
+    def Visit(obj : bpy.types.Object):
+        if obj in visited:
+            return
+
+        visited.add(obj)
+        result.append(obj)
+
+        if obj.instance_type == 'COLLECTION' and obj.instance_collection is not None:
+            for child in obj.instance_collection.all_objects:
+                Visit(child)
+
+    for obj in objects:
+        Visit(obj)
+
+    return result
+
 def GetAssetName(filename: str) -> str:
     import os
     import pathlib
@@ -129,3 +173,67 @@ def GetAssetName(filename: str) -> str:
     result = str(pathlib.Path(result).as_posix())
 
     return result
+
+# Manifest of the last export of each object in an output directory, entries are keyed
+# by name and are discarded when version changes
+class ExportCache:
+    def __init__(self, filename : str, version : int):
+        self.filename = filename
+        self.version = version
+        self.entries : Dict[str, dict] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def Load(self):
+        import json
+
+        try:
+            with open(self.filename, "r") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+
+        if data.get("version") == self.version:
+            self.entries = data.get("entries", {})
+
+    def Save(self):
+        import os
+        import json
+
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, "w", newline='\n') as file:
+            json.dump({ "version" : self.version, "entries" : self.entries }, file, indent=4, sort_keys=True)
+
+        os.replace(tmp_filename, self.filename)
+
+    # The output files also need to be the ones we wrote, in case they were modified or deleted since
+    def IsUpToDate(self, name : str, content_hash : str) -> bool:
+        import os
+
+        entry = self.entries.get(name)
+        if entry is None or entry["hash"] != content_hash:
+            return False
+
+        for filename, (size, mtime_ns) in entry["files"].items():
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                return False
+
+            if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+                return False
+
+        return True
+
+    def Update(self, name : str, content_hash : str, output_filenames : List[str]):
+        import os
+
+        files = {}
+        for filename in output_filenames:
+            stat = os.stat(filename)
+            files[filename] = (stat.st_size, stat.st_mtime_ns)
+
+        self.entries[name] = {
+            "hash" : content_hash,
+            "files" : files,
+        }